@@ -0,0 +1,6 @@
+# -*- coding: utf-8 -*-
+
+"""Micro-benchmarks, run from the source tree:
+
+    python -m benchmarks.bench_grants
+"""
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Compare parse_accesses() with the strptime based parser it replaced.
+
+    python -m benchmarks.bench_grants [count]
+"""
+
+from __future__ import print_function
+
+import datetime
+import random
+import sys
+import timeit
+
+from ipalib_rfiddoorcontrol.access import parse_accesses, parse_grant
+
+
+def legacy_parse_accesses(acc_list):
+    accesses = {}
+    for acc_lel in acc_list or ():
+        acc_lel = acc_lel.replace(',', ';')
+        for acc_t in acc_lel.split(';'):
+            acc_t = acc_t.split(':', 1)
+            acc = acc_t[0].lower().strip()
+            if len(acc_t) == 2:
+                exc = acc_t[1].strip().upper()
+                if exc == 'DISABLED':
+                    exc = '0001-01-01T00:00:00'
+                if 'T' not in exc:
+                    exc += 'T00:00:00'
+            else:
+                exc = '9999-12-31T23:59:59'
+            try:
+                exc_dt = datetime.datetime.strptime(exc, '%Y-%m-%dT%H:%M:%S')
+            except:
+                if acc not in accesses:
+                    accesses[acc] = acc_t[1]
+            else:
+                if accesses.get(acc, exc_dt) <= exc_dt:
+                    accesses[acc] = exc_dt
+    return accesses.items()
+
+
+def synthetic_grants(count, doors=200, seed=42):
+    rnd = random.Random(seed)
+    forms = (
+        lambda d: d,
+        lambda d: '{0}: disabled'.format(d),
+        lambda d: '{0}: DISABLED'.format(d),
+        lambda d: '{0}: 20{1:02d}-{2:02d}-{3:02d}'.format(
+            d, rnd.randint(15, 30), rnd.randint(1, 12), rnd.randint(1, 28)),
+        lambda d: '{0}:20{1:02d}-{2:02d}-{3:02d}t{4:02d}:30:00'.format(
+            d, rnd.randint(15, 30), rnd.randint(1, 12), rnd.randint(1, 28),
+            rnd.randint(0, 23)),
+        lambda d: '{0}: 2020-2-3'.format(d),
+    )
+    grants = []
+    for i in range(count):
+        if rnd.random() < 0.05:
+            # the legacy parser cannot merge text and dates for one door
+            door = 'Gate-{0:03d}'.format(rnd.randrange(doors))
+            grants.append('{0}: until further notice'.format(door))
+        else:
+            door = 'Door-{0:03d}'.format(rnd.randrange(doors))
+            grants.append(rnd.choice(forms)(door))
+    return grants
+
+
+def values(grants, per_user=5):
+    """Group grants into users, joining some of them into one value."""
+    for i in range(0, len(grants), per_user):
+        chunk = grants[i:i + per_user]
+        yield [', '.join(chunk[:2])] + chunk[2:]
+
+
+def main(argv=sys.argv[1:]):
+    count = int(argv[0]) if argv else 100000
+    users = list(values(synthetic_grants(count)))
+
+    for user in users:
+        old = sorted(legacy_parse_accesses(user))
+        # without windows, the latest grant of a door covers the others
+        new = sorted((acc, excs[-1]) for acc, excs in parse_accesses(user))
+        assert old == new, (user, old, new)
+
+    def run(parser):
+        for user in users:
+            for _ in parser(user):
+                pass
+
+    def run_cold():
+        parse_grant.cache_clear()
+        run(parse_accesses)
+
+    results = [
+        ('legacy', min(timeit.repeat(lambda: run(legacy_parse_accesses),
+                                     number=1, repeat=3))),
+        ('cold cache', min(timeit.repeat(run_cold, number=1, repeat=3))),
+        ('warm cache', min(timeit.repeat(lambda: run(parse_accesses),
+                                         number=1, repeat=3))),
+    ]
+    print('{0:d} grants in {1:d} values'.format(count, len(users)))
+    legacy = results[0][1]
+    for name, secs in results:
+        print('{0:12s} {1:8.3f} s  {2:10.0f} grants/s  x{3:.1f}'.format(
+            name, secs, count / secs, legacy / secs))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Compare xsos2ipa's LdapObject with the implementation it replaced.
+
+    python -m benchmarks.bench_ldapobject [users] [values per attribute]
+
+Each user carries many mail and rfidDoorAccess values, half of which
+are already present (in a different case) in the kw being merged into.
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'tools'))
+
+from xsos2ipa import LdapObject
+
+try:
+    basestring
+except NameError:
+    basestring = (str, bytes)
+
+
+class LegacyLdapObject(object):
+
+    def __init__(self, dn, attrs):
+        object.__setattr__(self, '_LegacyLdapObject__attrs', attrs)
+        object.__setattr__(self, 'dn', dn)
+
+    def __getattr__(self, att):
+        vals = object.__getattribute__(self, '_LegacyLdapObject__attrs')[att]
+        if len(vals) != 1:
+            raise ValueError('not exactly one value')
+        if isinstance(vals[0], basestring):
+            return vals[0].decode('utf-8').strip()
+        return vals[0].strip()
+
+    def values(self, att, fmt='{0}'):
+        vals = object.__getattribute__(self, '_LegacyLdapObject__attrs')[att]
+        try:
+            for val in vals:
+                if isinstance(vals[0], basestring):
+                    yield fmt.format(val.decode('utf-8').strip(), **object.__getattribute__(self, '_LegacyLdapObject__attrs'))
+                else:
+                    yield fmt.format(val.strip(), **object.__getattribute__(self, '_LegacyLdapObject__attrs'))
+        except KeyError as e:
+            raise AttributeError(str(e))
+
+    def update(self, kw, att, toatt=None, fmt='{0}'):
+        if toatt is None:
+            toatt = att.lower()
+        try:
+            vals = list(self.values(att, fmt=fmt))
+        except KeyError:
+            if toatt in kw:
+                del kw[toatt]
+        else:
+            ikw = list(map(lambda s: s.lower(), kw.get(toatt, ())))
+            for val in vals:
+                ival = val.lower()
+                if not any(ival == v for v in ikw):
+                    if toatt not in kw:
+                        kw[toatt] = [val]
+                    else:
+                        kw[toatt].append(val)
+
+
+def make_users(count, nvalues):
+    users = []
+    for u in range(count):
+        attrs = {
+            'uid': [('user{0}'.format(u)).encode('utf-8')],
+            'mail': [('u{0}.alias{1}@example.org'.format(u, i)).encode('utf-8')
+                     for i in range(nvalues)],
+            'rfidDoorAccess': [('door-{0:04d}: 2030-01-01'.format(i)).encode('utf-8')
+                               for i in range(nvalues)],
+        }
+        existing = {
+            'mail': ['U{0}.ALIAS{1}@EXAMPLE.ORG'.format(u, i)
+                     for i in range(0, nvalues, 2)],
+            'rfiddooraccess': ['DOOR-{0:04d}: 2030-01-01'.format(i)
+                               for i in range(0, nvalues, 2)],
+        }
+        users.append(('uid=user{0},dc=example,dc=org'.format(u), attrs, existing))
+    return users
+
+
+def sync(cls, users):
+    result = []
+    for dn, attrs, existing in users:
+        user = cls(dn, attrs)
+        kw = dict((k, list(v)) for k, v in existing.items())
+        user.update(kw, 'mail')
+        user.update(kw, 'rfidDoorAccess')
+        user.update(kw, 'mail', 'edupersontargetedid', fmt='mail:{0}')
+        result.append(kw)
+    return result
+
+
+def main(argv=sys.argv[1:]):
+    count = int(argv[0]) if argv else 200
+    nvalues = int(argv[1]) if len(argv) > 1 else 300
+    users = make_users(count, nvalues)
+    assert sync(LegacyLdapObject, users) == sync(LdapObject, users)
+
+    legacy = min(timeit.repeat(lambda: sync(LegacyLdapObject, users),
+                               number=1, repeat=3))
+    new = min(timeit.repeat(lambda: sync(LdapObject, users),
+                            number=1, repeat=3))
+    print('{0:d} users with {1:d} values per attribute'.format(count, nvalues))
+    print('legacy     {0:8.3f} s'.format(legacy))
+    print('LdapObject {0:8.3f} s  x{1:.1f}'.format(new, legacy / new))
+
+
+if __name__ == '__main__':
+    main()
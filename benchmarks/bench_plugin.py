@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Benchmarks of the code run on every user_add/user_mod.
+
+    python -m benchmarks.bench_plugin [-o results.json] [--bulk N] [--quick]
+
+Runs against an in-memory LDAP backend and a temporary door list, no
+FreeIPA server is needed.  Without ipalib the plugin is imported with
+the stand-ins of tests/ipastubs.py (reported as "ipalib": "stub").
+With -o the results are written as JSON (one object per case) to track
+regressions.
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'tests'))
+
+import ipastubs
+from ipalib_rfiddoorcontrol import doorlist, metrics
+from ipalib_rfiddoorcontrol.access import AccessChangeManager, parse_grant
+
+IPALIB = 'stub' if ipastubs.install() else 'installed'
+
+from ipalib_rfiddoorcontrol import rfiddoorcontrol
+
+
+GRANT_COUNTS = (1, 10, 100, 500)
+DOOR_COUNTS = (10, 1000, 10000)
+BULK = 10000
+
+
+class FakeEntry(dict):
+    """Just enough of an ldap2 LDAPEntry for the callbacks."""
+
+    def __init__(self, dn, *args, **kw):
+        super(FakeEntry, self).__init__(*args, **kw)
+        self.dn = dn
+
+
+class FakeLDAP(object):
+    """In-memory stand-in for the ldap2 backend."""
+
+    def __init__(self):
+        self.entries = {}
+
+    def add_entry(self, entry):
+        self.entries[entry.dn] = FakeEntry(entry.dn, entry)
+
+    def get_entry(self, dn, attrs_list=None):
+        stored = self.entries[dn]
+        if attrs_list is None:
+            return FakeEntry(dn, stored)
+        return FakeEntry(dn, ((att, list(stored[att])) for att in attrs_list
+                              if att in stored))
+
+    def update_entry(self, entry):
+        self.entries[entry.dn].update(entry)
+
+
+class FakeCommand(object):
+
+    def __init__(self, name):
+        self.name = name
+
+
+def use_doorlist(dirname, ndoors):
+    """Point the door registry at a new door list of ndoors doors."""
+    doors = ['Door-{0:05d}'.format(i) for i in range(ndoors)]
+    path = os.path.join(dirname, 'doorlist-{0:d}.txt'.format(ndoors))
+    with open(path, 'w') as fh:
+        fh.write('\n'.join(doors) + '\n')
+    doorlist.registry = doorlist.DoorRegistry(path)
+    return doors
+
+
+def make_grants(rnd, doors, count):
+    forms = ('{0}', '{0}: disabled', '{0}: 2030-06-30', '{0}: 2014-01-01',
+             '{0}: 2029-01-01T08:00:00')
+    return [rnd.choice(forms).format(rnd.choice(doors)) for _ in range(count)]
+
+
+def timed(func, number):
+    parse_grant.cache_clear()
+    t0 = time.time()
+    for _ in range(number):
+        func()
+    return time.time() - t0
+
+
+def bench_acm(rnd, doors, ngrants, number):
+    old = make_grants(rnd, doors, ngrants)
+    new = old[:ngrants // 2] + make_grants(rnd, doors, ngrants - ngrants // 2)
+    return timed(lambda: list(AccessChangeManager(old, new).get_access()),
+                 number)
+
+
+def bench_useradd(rnd, doors, ngrants, number):
+    cmd = FakeCommand('user_add')
+    grants = make_grants(rnd, doors, ngrants)
+
+    def run():
+        entry = FakeEntry('uid=u,cn=users', objectclass=['person'],
+                          rfiddooraccess=list(grants))
+        rfiddoorcontrol.useradd_precallback(cmd, None, entry.dn, entry, [])
+    return timed(run, number)
+
+
+def bench_usermod(rnd, doors, ngrants, number):
+    cmd = FakeCommand('user_mod')
+    ldap = FakeLDAP()
+    dn = 'uid=u,cn=users'
+    ldap.add_entry(FakeEntry(dn, objectclass=['person', 'rfidDoorControl'],
+                             rfiddooraccess=make_grants(rnd, doors, ngrants)))
+    grants = make_grants(rnd, doors, ngrants)
+
+    def run():
+        entry = FakeEntry(dn, rfiddooraccess=list(grants))
+        rfiddoorcontrol.usermod_precallback(cmd, ldap, dn, entry, [])
+    return timed(run, number)
+
+
+def bench_bulk(rnd, doors, nusers, number):
+    """user_mod of nusers users with 1..500 grants each, written back."""
+    cmd = FakeCommand('user_mod')
+    ldap = FakeLDAP()
+    mods = []
+    for u in range(nusers):
+        dn = 'uid=u{0:d},cn=users'.format(u)
+        ngrants = rnd.choice(GRANT_COUNTS)
+        ldap.add_entry(FakeEntry(dn, objectclass=['person'],
+                                 rfiddooraccess=make_grants(rnd, doors, ngrants)))
+        mods.append((dn, make_grants(rnd, doors, ngrants)))
+
+    def run():
+        for dn, grants in mods:
+            entry = FakeEntry(dn, rfiddooraccess=list(grants))
+            rfiddoorcontrol.usermod_precallback(cmd, ldap, dn, entry, [])
+            ldap.update_entry(entry)
+    return timed(run, number)
+
+
+def cases(args):
+    grant_counts = GRANT_COUNTS[:2] if args.quick else GRANT_COUNTS
+    door_counts = DOOR_COUNTS[:2] if args.quick else DOOR_COUNTS
+    for ndoors in door_counts:
+        for ngrants in grant_counts:
+            number = max(1, 2000 // ngrants)
+            params = dict(doors=ndoors, grants=ngrants)
+            yield 'acm', bench_acm, ndoors, ngrants, number, params
+            yield 'useradd_precallback', bench_useradd, ndoors, ngrants, number, params
+            yield 'usermod_precallback', bench_usermod, ndoors, ngrants, number, params
+    yield ('usermod_bulk', bench_bulk, door_counts[-1], args.bulk, 1,
+           dict(doors=door_counts[-1], users=args.bulk))
+
+
+def main(argv=sys.argv[1:]):
+    parser = argparse.ArgumentParser(prog='bench_plugin')
+    parser.add_argument('-o', '--output',
+                        help='write JSON results to this file ("-" for stdout)')
+    parser.add_argument('--bulk', type=int, default=BULK,
+                        help='users modified by the bulk case (default: %(default)s)')
+    parser.add_argument('--quick', action='store_true',
+                        help='only the small grants and door counts')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args(argv)
+
+    rnd = random.Random(args.seed)
+    dirname = tempfile.mkdtemp(prefix='bench_plugin-')
+    saved = doorlist.registry
+    results = []
+    try:
+        for name, func, ndoors, size, number, params in cases(args):
+            doors = use_doorlist(dirname, ndoors)
+            metrics.reset()
+            secs = func(rnd, doors, size, number)
+            ops = number * (size if func is bench_bulk else 1)
+            result = dict(name=name, params=params, seconds=secs, ops=ops,
+                          us_per_op=secs / ops * 1e6,
+                          counters=metrics.snapshot())
+            results.append(result)
+            line = '{0:12.1f} us/op  {1:6d} ops'.format(
+                result['us_per_op'], result['ops'])
+            print('{0:22s} {1:34s} {2}'.format(
+                name, ' '.join('{0}={1}'.format(k, v)
+                               for k, v in sorted(params.items())), line),
+                file=sys.stderr if args.output == '-' else sys.stdout)
+    finally:
+        doorlist.registry = saved
+        shutil.rmtree(dirname)
+
+    if args.output:
+        report = dict(
+            benchmark='bench_plugin',
+            time=time.strftime('%Y-%m-%dT%H:%M:%S'),
+            python=platform.python_version(),
+            ipalib=IPALIB,
+            platform=platform.platform(),
+            seed=args.seed,
+            results=results,
+        )
+        if args.output == '-':
+            json.dump(report, sys.stdout, indent=2, sort_keys=True)
+            print()
+        else:
+            with open(args.output, 'w') as fh:
+                json.dump(report, fh, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Compare netcenter2ipa's zone lookup loop with the suffix trie.
+
+    python -m benchmarks.bench_zonetrie [hosts] [zones]
+
+The legacy loop is O(hosts x zones) and is timed on a sample of the
+hosts; its rate is reported per host.  Zones are not nested, so both
+lookups must agree.
+"""
+
+from __future__ import print_function
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'tools'))
+
+from zonetrie import ZoneTrie
+
+FALLBACK = ('example.net', 'fallback.')
+LEGACY_SAMPLE = 2000
+
+
+def legacy_match(fqdn, managed_zones, fallback_s, fallback_t):
+    for mz in managed_zones:
+        if fqdn.endswith('.' + mz):
+            return fqdn[:-len(mz) - 1], managed_zones[mz]
+    if fqdn.endswith(fallback_s):
+        return fqdn[:-len(fallback_s) - 1], fallback_t
+    return None
+
+
+def make_data(nhosts, nzones, seed=42):
+    rnd = random.Random(seed)
+    zones = dict(('net{0:d}.dept{1:d}.example.org'.format(i, i % 97),
+                  'zone{0:d}.'.format(i)) for i in range(nzones))
+    suffixes = sorted(zones) + [FALLBACK[0], 'elsewhere.com']
+    hosts = ['h{0:d}.{1}'.format(i, rnd.choice(suffixes))
+             for i in range(nhosts)]
+    return zones, hosts
+
+
+def main(argv=sys.argv[1:]):
+    nhosts = int(argv[0]) if argv else 100000
+    nzones = int(argv[1]) if len(argv) > 1 else 3000
+    zones, hosts = make_data(nhosts, nzones)
+
+    t0 = time.time()
+    trie = ZoneTrie(zones, fallback=FALLBACK)
+    build = time.time() - t0
+
+    t0 = time.time()
+    matched = [trie.match(fqdn) for fqdn in hosts]
+    new = (time.time() - t0) / len(hosts)
+
+    sample = hosts[:LEGACY_SAMPLE]
+    t0 = time.time()
+    legacy = [legacy_match(fqdn, zones, *FALLBACK) for fqdn in sample]
+    old = (time.time() - t0) / len(sample)
+    assert legacy == matched[:len(sample)]
+
+    print('{0:d} hosts, {1:d} zones, trie built in {2:.3f} s'.format(
+        nhosts, nzones, build))
+    print('legacy loop {0:10.2f} us/host'.format(old * 1e6))
+    print('ZoneTrie    {0:10.2f} us/host  x{1:.0f}  ({2:.2f} s total)'.format(
+        new * 1e6, old / new, new * len(hosts)))
+
+
+if __name__ == '__main__':
+    main()
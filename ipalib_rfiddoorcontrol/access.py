@@ -0,0 +1,324 @@
+#!/usr/bin/env python
+# -*- Mode: Python; py-indent-offset: 4; coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 expandtab
+
+## Copyright (c) 2015, Claudio Luck (Zurich, Switzerland)
+##
+## Licensed under the terms of the MIT License, see LICENSE file.
+
+"""Parsing and merging of rfidDoorAccess values.
+
+A value holds one or more grants separated by ',' or ';'.  A grant is
+"door" (forever), "door: disabled", "door: YYYY-MM-DD[THH:MM:SS]",
+"door: <windows> [until YYYY-MM-DD[THH:MM:SS]]" (see schedule) or
+"door: <anything else>", which is kept verbatim.
+
+A door granted more than once keeps every grant that another one does
+not cover (see schedule.reduce_grants), so "lab-3: 2027-01-31" and
+"lab-3: Mon-Fri 07:00-19:00" both stay; the door opens if any of its
+grants is active.
+"""
+
+from __future__ import print_function
+
+import datetime
+import re
+
+try:
+    from functools import lru_cache
+except ImportError:  # Python 2
+    def lru_cache(maxsize=128):
+        def decorate(func):
+            cache = {}
+
+            def wrapper(arg):
+                try:
+                    return cache[arg]
+                except KeyError:
+                    pass
+                if len(cache) >= maxsize:
+                    cache.clear()
+                result = cache[arg] = func(arg)
+                return result
+            wrapper.cache_clear = cache.clear
+            return wrapper
+        return decorate
+
+from ipalib_rfiddoorcontrol import metrics
+from ipalib_rfiddoorcontrol.doorlist import known_doors
+from ipalib_rfiddoorcontrol.schedule import (
+        allows,
+        format_schedule,
+        parse_schedule,
+        reduce_grants,
+    )
+
+
+DISABLED = datetime.datetime(1, 1, 1, 0, 0, 0)
+FOREVER = datetime.datetime(9999, 12, 31, 23, 59, 59)
+
+GRANT_CACHE_SIZE = 16384
+
+_grant_sep = re.compile(r'[,;]')
+_iso_datetime = re.compile(
+    r'([0-9]{4})-([0-9]{2})-([0-9]{2})T([0-9]{2}):([0-9]{2}):([0-9]{2})\Z')
+
+
+class Scheduled(datetime.datetime):
+    """An expiry that only opens during the windows of a week bitmap."""
+
+    def __new__(cls, expiry, week):
+        self = datetime.datetime.__new__(cls, *expiry.timetuple()[:6])
+        self.week = week
+        return self
+
+    def __eq__(self, other):
+        if not isinstance(other, datetime.datetime):
+            return NotImplemented
+        return datetime.datetime.__eq__(self, other) and \
+            getattr(other, 'week', None) == self.week
+
+    def __ne__(self, other):
+        eq = self.__eq__(other)
+        return eq if eq is NotImplemented else not eq
+
+    def __hash__(self):
+        return hash((datetime.datetime.__hash__(self), self.week))
+
+    def __repr__(self):
+        return 'Scheduled({0}, {1!r})'.format(
+            self.isoformat(), format_schedule(self.week))
+
+
+def scheduled(expiry, week):
+    """Return expiry restricted to week (None: not restricted)."""
+    if week is None or expiry == DISABLED:
+        return datetime.datetime(*expiry.timetuple()[:6])
+    return Scheduled(expiry, week)
+
+
+def _parse_expiry(text):
+    exc = text.strip().upper()
+    if exc == 'DISABLED':
+        return DISABLED
+    if 'T' not in exc:
+        exc += 'T00:00:00'
+    m = _iso_datetime.match(exc)
+    if m is not None:
+        return datetime.datetime(*[int(g) for g in m.groups()])
+    # strptime accepts more than the canonical form (single digits)
+    return datetime.datetime.strptime(exc, '%Y-%m-%dT%H:%M:%S')
+
+
+@lru_cache(maxsize=GRANT_CACHE_SIZE)
+def parse_grant(grant):
+    """Parse a single grant into (door, expiry).
+
+    The door is lower-cased.  The expiry is a datetime (a Scheduled
+    one for grants with time windows), or the raw text after the colon
+    if it is neither a date nor a schedule.
+    """
+    acc, colon, raw = grant.partition(':')
+    acc = acc.lower().strip()
+    if not colon:
+        return acc, FOREVER
+    try:
+        return acc, _parse_expiry(raw)
+    except ValueError:
+        pass
+    try:
+        week, until = parse_schedule(raw)
+        expiry = FOREVER if until is None else _parse_expiry(until)
+        if expiry == DISABLED:
+            raise ValueError('schedule until disabled')
+        return acc, scheduled(expiry, week)
+    except ValueError:
+        return acc, raw
+
+
+def _naive(exc):
+    return datetime.datetime(*exc.timetuple()[:6])
+
+
+def merge_grants(excs):
+    """Reduce the expiries of a door to a canonical tuple.
+
+    Dates win over free-form text, of which only the first is kept;
+    "disabled" only remains if nothing else is granted.  The other
+    dates are reduced by schedule.reduce_grants and sorted by expiry.
+    """
+    if len(excs) == 1:
+        return tuple(excs)
+    dates = [exc for exc in excs if isinstance(exc, datetime.datetime)]
+    if not dates:
+        return tuple(excs[:1])
+    if not any(isinstance(exc, Scheduled) for exc in dates):
+        # without windows the latest date covers the others
+        return (max(dates),)
+    dates = [exc for exc in dates if exc != DISABLED]
+    return tuple(scheduled(expiry, week) for expiry, week in reduce_grants(
+        (_naive(exc), getattr(exc, 'week', None)) for exc in dates))
+
+
+def parse_accesses(acc_list, case=None):
+    """Yield (door, expiries) for the values in acc_list.
+
+    expiries is the tuple of merge_grants() of all grants of the door.
+    If case is a dict, it is filled with the lower-cased values mapped
+    to their original spelling.
+    """
+    accesses = {}
+    for acc_lel in acc_list or ():
+        if case is not None:
+            iacc_lel = acc_lel.lower().strip()
+            if iacc_lel not in case:
+                case[iacc_lel] = acc_lel
+        for grant in _grant_sep.split(acc_lel):
+            acc, exc = parse_grant(grant)
+            prev = accesses.get(acc)
+            accesses[acc] = (exc,) if prev is None else prev + (exc,)
+    return [(acc, excs if len(excs) == 1 else merge_grants(excs))
+            for acc, excs in accesses.items()]
+
+
+def _format_date(exc):
+    if (exc.hour, exc.minute, exc.second) == (0, 0, 0):
+        return exc.strftime('%Y-%m-%d')
+    return exc.strftime('%Y-%m-%dT%H:%M:%S')
+
+
+def format_grant(acc, exc):
+    """Format a parsed grant as an rfidDoorAccess value."""
+    week = getattr(exc, 'week', None)
+    if week is not None:
+        if exc == Scheduled(FOREVER, week):
+            return '{0}: {1}'.format(acc, format_schedule(week))
+        return '{0}: {1} until {2}'.format(acc, format_schedule(week),
+                                           _format_date(exc))
+    if exc == FOREVER:
+        return acc
+    elif exc == DISABLED:
+        return '{0}: disabled'.format(acc)
+    elif not isinstance(exc, datetime.datetime):
+        return '{0}:{1}'.format(acc, exc)
+    else:
+        return '{0}: {1}'.format(acc, _format_date(exc))
+
+
+def format_grants(acc, excs):
+    """Format the expiries of a door as one value, "; " separated."""
+    return '; '.join(format_grant(acc, exc) for exc in excs)
+
+
+def is_active(exc, now=None):
+    """Does a parsed grant open its door at now (default: local time)?
+
+    Scheduled grants are only active inside their time windows.
+    Free-form expiries cannot be evaluated and never count as active.
+    """
+    if not isinstance(exc, datetime.datetime):
+        return False
+    if now is None:
+        now = datetime.datetime.now()
+    return now < exc and allows(getattr(exc, 'week', None), now)
+
+
+def _fold(excs):
+    """Comparison key of expiries: free-form text ignores case."""
+    if excs is None:
+        return None
+    return tuple(exc if isinstance(exc, datetime.datetime) else exc.lower()
+                 for exc in excs)
+
+
+class AccessChangeManager(object):
+
+    DISABLED = DISABLED
+    FOREVER = FOREVER
+
+    @metrics.timed('AccessChangeManager')
+    def __init__(self, old_access, new_access):
+        self._case = {}
+        self._old = dict(self._parse_accesses(old_access, case=True))
+        self._new = dict(self._parse_accesses(new_access))
+        self.fill_gaps()
+
+    def _parse_accesses(self, acc_list, case=False):
+        return parse_accesses(acc_list, self._case if case else None)
+
+    def update(self, acc_list):
+        """Replace the new grants of the doors named in acc_list."""
+        self._new.update(self._parse_accesses(acc_list))
+
+    def expire(self, now=None):
+        """Remove lapsed grants and drop disabled grants of unknown doors.
+
+        A door left without grants is disabled.  Returns the number of
+        grants removed and of doors dropped.
+        """
+        if now is None:
+            now = datetime.datetime.now()
+        expired = 0
+        for acc, excs in list(self._new.items()):
+            live = tuple(exc for exc in excs
+                         if not (isinstance(exc, datetime.datetime) and
+                                 self.DISABLED < exc <= now))
+            if len(live) < len(excs):
+                self._new[acc] = live or (self.DISABLED,)
+                expired += len(excs) - len(live)
+        self.fill_gaps()
+        return expired, len([acc for acc in self._old if acc not in self._new])
+
+    def fill_gaps(self):
+        self.known_accesses = known_doors()
+        for acc in self._old:
+            if acc not in self._new:
+                self._new[acc] = (self.DISABLED,)
+        for acc in list(self._new):
+            if self._new[acc] != (self.DISABLED,):
+                continue
+            if acc not in self.known_accesses:
+                del self._new[acc]
+
+    def clear(self):
+        """Drop all new grants, as when RFID control is removed."""
+        self._new = {}
+
+    def changed(self):
+        """Do the new grants differ in meaning from the old ones?
+
+        Free-form expiries that only differ in case are the same, as in
+        get_access(), which writes them back in the old spelling.
+        """
+        return set(self._new) != set(self._old) or \
+            any(_fold(self._new[acc]) != _fold(excs)
+                for acc, excs in self._old.items())
+
+    def diff(self):
+        """Return (door, old grants, new grants) of the changed doors.
+
+        Grants are in canonical form (format_grants), None where the
+        door has none; the list is sorted by door.
+        """
+        changes = []
+        for acc in sorted(set(self._old) | set(self._new)):
+            old = self._old.get(acc)
+            new = self._new.get(acc)
+            if _fold(old) != _fold(new):
+                changes.append((
+                    acc,
+                    None if old is None else format_grants(acc, old),
+                    None if new is None else format_grants(acc, new),
+                ))
+        return changes
+
+    def get_access(self):
+        """Yield the new grants in canonical form, sorted by door and expiry.
+
+        Values that only differ in case from an old value keep the old
+        spelling, so unchanged grants are written back unchanged.
+        """
+        for acc in sorted(self._new):
+            for exc in self._new[acc]:
+                s = format_grant(acc, exc)
+                yield self._case.get(s.lower(), s)
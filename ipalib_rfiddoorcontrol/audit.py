@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+# -*- Mode: Python; py-indent-offset: 4; coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 expandtab
+
+## Copyright (c) 2015, Claudio Luck (Zurich, Switzerland)
+##
+## Licensed under the terms of the MIT License, see LICENSE file.
+
+"""Append-only audit log of door access changes.
+
+Every change is one line of UTF-8 encoded JSON:
+
+    {"actor":"admin@EXAMPLE.ORG","changes":[["lab-3",null,"lab-3: 2027-01-31"]],
+     "command":"user_mod","target":"jdoe","time":1792310400.5}
+
+with the changes as (door, old grant, new grant) in canonical form,
+null where the door has no grant.
+
+record() only puts the record on an in-process queue and never waits:
+a background thread writes the queued records in batches to
+AUDIT_DIR/audit.jsonl, which is rotated to audit.jsonl.1 ... .KEEP
+once it exceeds MAX_BYTES.  The log is shared by all (httpd worker)
+processes, which serialize their writes with a lock file.  If the
+queue is full, records are dropped and counted as "audit.dropped".
+
+Logging is only enabled when AUDIT_DIR (environment variable
+RFIDDOORCONTROL_AUDIT) is a writable directory when the module is
+imported.  read() streams the log files, oldest first, one line at a
+time; `rfiddoorctl audit` filters and prints them.
+"""
+
+from __future__ import print_function
+
+import atexit
+import fcntl
+import json
+import os
+import threading
+import time
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from ipalib_rfiddoorcontrol import metrics
+
+
+AUDIT_DIR = os.environ.get('RFIDDOORCONTROL_AUDIT',
+                           '/var/lib/rfiddoorcontrol/audit')
+LOG_NAME = 'audit.jsonl'
+LOCK_NAME = 'audit.lock'
+MAX_BYTES = 64 * 1024 * 1024
+KEEP = 10
+QUEUE_SIZE = 10000
+BATCH_SIZE = 500
+FLUSH_INTERVAL = 1.0
+
+enabled = os.path.isdir(AUDIT_DIR) and os.access(AUDIT_DIR, os.W_OK)
+
+
+def _encode(record):
+    return json.dumps(record, sort_keys=True, separators=(',', ':'),
+                      ensure_ascii=False) + u'\n'
+
+
+def _needle(text):
+    """Return text as it appears in a record line, JSON escaped."""
+    return json.dumps(text, ensure_ascii=False)[1:-1]
+
+
+class AuditLog(object):
+    """Queue of audit records and the thread writing them to audit_dir."""
+
+    def __init__(self, audit_dir=AUDIT_DIR, max_bytes=MAX_BYTES, keep=KEEP):
+        self.path = os.path.join(audit_dir, LOG_NAME)
+        self.lock_path = os.path.join(audit_dir, LOCK_NAME)
+        self.max_bytes = max_bytes
+        self.keep = keep
+        self._start_lock = threading.Lock()
+        self._pid = None
+        self._queue = None
+        self._thread = None
+
+    def _start(self):
+        # after a fork only the queue is inherited, not its writer
+        with self._start_lock:
+            if self._pid != os.getpid():
+                self._queue = queue.Queue(QUEUE_SIZE)
+                self._thread = threading.Thread(target=self._run,
+                                                name='rfiddoorcontrol-audit')
+                self._thread.daemon = True
+                self._thread.start()
+                self._pid = os.getpid()
+
+    def put(self, record):
+        """Queue record for writing, drop it if the queue is full."""
+        if self._pid != os.getpid():
+            self._start()
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            metrics.incr('audit.dropped')
+
+    def _take(self, block):
+        batch = []
+        try:
+            batch.append(self._queue.get(block, FLUSH_INTERVAL))
+            while len(batch) < BATCH_SIZE:
+                batch.append(self._queue.get_nowait())
+        except queue.Empty:
+            pass
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._take(True)
+            if batch:
+                self.write(batch)
+
+    def flush(self):
+        """Write the queued records now (at exit)."""
+        if self._pid != os.getpid():
+            return
+        batch = self._take(False)
+        while batch:
+            self.write(batch)
+            batch = self._take(False)
+
+    def write(self, records):
+        t0 = time.time()
+        data = u''.join(_encode(r) for r in records).encode('utf-8')
+        try:
+            with open(self.lock_path, 'a') as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                try:
+                    self._rotate()
+                    fd = os.open(self.path,
+                                 os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o640)
+                    try:
+                        os.write(fd, data)
+                    finally:
+                        os.close(fd)
+                finally:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+        except (IOError, OSError):
+            metrics.incr('audit.dropped', len(records))
+            return
+        metrics.incr('audit.records', len(records))
+        metrics.observe('audit.write', time.time() - t0)
+
+    def _rotate(self):
+        try:
+            if os.path.getsize(self.path) < self.max_bytes:
+                return
+        except OSError:
+            return
+        for i in range(self.keep - 1, 0, -1):
+            src = '{0}.{1:d}'.format(self.path, i)
+            if os.path.exists(src):
+                os.rename(src, '{0}.{1:d}'.format(self.path, i + 1))
+        os.rename(self.path, self.path + '.1')
+
+
+log = AuditLog()
+
+
+def record(command, actor, target, changes):
+    """Queue an audit record of command changing the grants of target."""
+    if not enabled:
+        return
+    log.put(dict(
+        time=time.time(),
+        actor=actor,
+        command=command,
+        target=target,
+        changes=[list(change) for change in changes],
+    ))
+
+
+def _flush_at_exit():
+    if enabled:
+        log.flush()
+
+atexit.register(_flush_at_exit)
+
+
+def log_files(audit_dir=AUDIT_DIR):
+    """Return the paths of the log files, oldest first."""
+    path = os.path.join(audit_dir, LOG_NAME)
+    rotated = []
+    for name in os.listdir(audit_dir):
+        suffix = name[len(LOG_NAME) + 1:]
+        if name.startswith(LOG_NAME + '.') and suffix.isdigit():
+            rotated.append((int(suffix), os.path.join(audit_dir, name)))
+    files = [p for i, p in sorted(rotated, reverse=True)]
+    if os.path.exists(path):
+        files.append(path)
+    return files
+
+
+def read(audit_dir=AUDIT_DIR, since=None, until=None, target=None,
+         actor=None, door=None):
+    """Yield the records matching all given filters, oldest first.
+
+    since and until are epochs, door is matched case-insensitively.
+    Lines are tested for the filter strings before they are decoded,
+    and lines that are not complete records are skipped.
+    """
+    idoor = door.lower() if door else None
+    target_text = _needle(target) if target else None
+    actor_text = _needle(actor) if actor else None
+    door_text = _needle(idoor) if idoor else None
+    for path in log_files(audit_dir):
+        with open(path, 'rb') as fh:
+            for line in fh:
+                line = line.decode('utf-8', 'replace')
+                if target_text and target_text not in line or \
+                        actor_text and actor_text not in line or \
+                        door_text and door_text not in line.lower():
+                    continue
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    continue
+                if since is not None and rec['time'] < since:
+                    continue
+                if until is not None and rec['time'] >= until:
+                    continue
+                if target and rec['target'] != target:
+                    continue
+                if actor and rec['actor'] != actor:
+                    continue
+                if idoor and not any(c[0] == idoor for c in rec['changes']):
+                    continue
+                yield rec
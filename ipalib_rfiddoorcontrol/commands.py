@@ -10,12 +10,234 @@ from __future__ import print_function
 
 import sys
 import os
+import argparse
+import json
+import time
 
+from ipalib_rfiddoorcontrol import audit, metrics
+from ipalib_rfiddoorcontrol.doorlist import DOORLIST
+from ipalib_rfiddoorcontrol.export import (
+        find_users,
+        full_export,
+        group_base_dn,
+        incremental_export,
+        user_base_dn,
+    )
+from ipalib_rfiddoorcontrol.keys import find_duplicates, normalize_stored
 
-def rfiddoorctl():
+
+DEFAULT_SNAPSHOT = '/var/lib/rfiddoorcontrol/access.snap'
+
+
+def ldap_connect():
+    from ipalib import api
+    api.bootstrap(context='cli', in_server=True)
+    api.finalize()
+    api.Backend.ldap2.connect(ccache=api.Backend.krb.default_ccname())
+    return api, api.Backend.ldap2
+
+
+def export(args):
+    api, ldap = ldap_connect()
+    base_dn = user_base_dn(api)
+    state = args.state or args.output + '.state'
+    groups_dn = group_base_dn(api)
+    if args.incremental:
+        result = incremental_export(ldap, base_dn, args.output, args.doorlist,
+                                    state, groups_dn)
+    else:
+        result = full_export(ldap, base_dn, args.output, args.doorlist, state,
+                             groups_dn)
+    print('{0}: {1[keys]:d} keys, {1[doors]:d} doors, {1[users]:d} users '
+          '({1[changed]:d} changed, {1[removed]:d} removed)'.format(
+              args.output, result))
+    return 0
+
+
+def dupes(args):
+    api, ldap = ldap_connect()
+    entries = find_users(ldap, user_base_dn(api), '(rfidKey=*)',
+                         ('uid', 'rfidkey'))
+    duplicates, invalid = find_duplicates(
+        (entry['uid'][0], entry.get('rfidkey', ())) for entry in entries)
+    for key in sorted(duplicates):
+        print('{0}: {1}'.format(key, ' '.join(duplicates[key])))
+    for uid, key in invalid:
+        print('{0}: invalid key {1!r}'.format(uid, key))
+    print('{0:d} users, {1:d} duplicate keys, {2:d} invalid keys'.format(
+        len(entries), len(duplicates), len(invalid)))
+    return 1 if duplicates else 0
+
+
+def migrate_keys(ldap, base_dn, decimal=False, dry_run=False):
+    """Rewrite the rfidKey values of all users in canonical form.
+
+    Returns the (uid, old keys, new keys) of the users changed, or
+    to be changed with dry_run, and the (uid, key) of invalid keys,
+    which are kept as they are.
+    """
+    changed = []
+    invalid = []
+    for entry in find_users(ldap, base_dn, '(rfidKey=*)', ('uid', 'rfidkey')):
+        uid = entry['uid'][0]
+        old = list(entry.get('rfidkey', ()))
+        new, bad = normalize_stored(old, decimal)
+        invalid.extend((uid, key) for key in bad)
+        if new == old:
+            continue
+        changed.append((uid, old, new))
+        if not dry_run:
+            entry['rfidkey'] = new
+            ldap.update_entry(entry)
+    return changed, invalid
+
+
+def normalize_keys(args):
+    api, ldap = ldap_connect()
+    changed, invalid = migrate_keys(ldap, user_base_dn(api), args.decimal,
+                                    args.dry_run)
+    for uid, old, new in changed:
+        print('{0}: {1} -> {2}'.format(uid, ' '.join(old), ' '.join(new)))
+    for uid, key in invalid:
+        print('{0}: invalid key {1!r}'.format(uid, key))
+    print('{0:d} users {1}, {2:d} invalid keys'.format(
+        len(changed), 'to change' if args.dry_run else 'changed', len(invalid)))
+    return 0
+
+
+def _ms(seconds):
+    if seconds is None:
+        return '-'
+    if seconds == float('inf'):
+        return '>{0:g}'.format(metrics.BUCKETS[-1] * 1e3)
+    return '{0:g}'.format(seconds * 1e3)
+
+
+def stats(args):
+    if not os.path.isdir(args.dir):
+        print('{0}: no such directory; create it (writable by the IPA '
+              'server processes) to enable statistics'.format(args.dir))
+        return 1
+    if args.reset:
+        metrics.clear(args.dir)
+        return 0
+    counters, histograms, processes = metrics.load(args.dir)
+    print('{0:d} processes'.format(processes))
+    for name in sorted(counters):
+        print('{0:40s} {1:10d}'.format(name, counters[name]))
+    if histograms:
+        print()
+        print('{0:32s} {1:>8s} {2:>10s} {3:>8s} {4:>8s}'.format(
+            'latency (ms)', 'calls', 'mean', 'p50<=', 'p99<='))
+    for name in sorted(histograms):
+        hist = histograms[name]
+        calls = sum(hist['buckets'])
+        print('{0:32s} {1:8d} {2:10.3f} {3:>8s} {4:>8s}'.format(
+            name, calls, hist['sum'] / calls * 1e3 if calls else 0.0,
+            _ms(metrics.percentile(hist, 50)),
+            _ms(metrics.percentile(hist, 99))))
     return 0
 
 
+def _epoch(text):
+    for fmt in ('%Y-%m-%dT%H:%M:%S', '%Y-%m-%d'):
+        try:
+            return time.mktime(time.strptime(text, fmt))
+        except ValueError:
+            pass
+    raise argparse.ArgumentTypeError(
+        'not a date (YYYY-MM-DD[THH:MM:SS]): {0}'.format(text))
+
+
+def _grant_text(door, grant):
+    if grant is None:
+        return '-'
+    if grant == door:
+        return 'always'
+    return grant[len(door) + 1:].strip()
+
+
+def show_audit(args):
+    if not os.path.isdir(args.dir):
+        print('{0}: no such directory; create it (writable by the IPA '
+              'server processes) to enable the audit log'.format(args.dir))
+        return 1
+    for rec in audit.read(args.dir, since=args.since, until=args.until,
+                          target=args.user, actor=args.actor, door=args.door):
+        if args.json:
+            print(json.dumps(rec, sort_keys=True))
+            continue
+        head = '{0} {1} {2} {3}'.format(
+            time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(rec['time'])),
+            rec['actor'] or '-', rec['command'], rec['target'])
+        if not rec['changes']:
+            print(head)
+        for door, old, new in rec['changes']:
+            print('{0} {1}: {2} -> {3}'.format(head, door, _grant_text(door, old),
+                                               _grant_text(door, new)))
+    return 0
+
+
+def rfiddoorctl(argv=None):
+    parser = argparse.ArgumentParser(prog='rfiddoorctl')
+    commands = parser.add_subparsers(dest='command')
+
+    p = commands.add_parser('export',
+        help='write the RFID access snapshot for the door controllers')
+    p.add_argument('-o', '--output', default=DEFAULT_SNAPSHOT,
+        help='snapshot file (default: %(default)s)')
+    p.add_argument('--doorlist', default=DOORLIST,
+        help='door list defining the door ids (default: %(default)s)')
+    p.add_argument('-i', '--incremental', action='store_true',
+        help='only fetch users changed since the last export')
+    p.add_argument('--state',
+        help='export state file (default: OUTPUT.state)')
+    p.set_defaults(func=export)
+
+    p = commands.add_parser('dupes',
+        help='list RFID keys assigned to more than one user')
+    p.set_defaults(func=dupes)
+
+    p = commands.add_parser('normalize-keys',
+        help='rewrite stored RFID keys in canonical form')
+    p.add_argument('--decimal', action='store_true',
+        help='read stored keys of exactly 10 digits as decimal')
+    p.add_argument('-n', '--dry-run', action='store_true',
+        help='only print the changes')
+    p.set_defaults(func=normalize_keys)
+
+    p = commands.add_parser('stats',
+        help='print the counters and latencies recorded by the plugin')
+    p.add_argument('-d', '--dir', default=metrics.STATS_DIR,
+        help='statistics directory (default: %(default)s)')
+    p.add_argument('--reset', action='store_true',
+        help='delete the recorded statistics')
+    p.set_defaults(func=stats)
+
+    p = commands.add_parser('audit',
+        help='print the door access changes recorded by the plugin')
+    p.add_argument('-d', '--dir', default=audit.AUDIT_DIR,
+        help='audit log directory (default: %(default)s)')
+    p.add_argument('-u', '--user',
+        help='only changes of this user (or group)')
+    p.add_argument('-a', '--actor',
+        help='only changes made by this principal')
+    p.add_argument('--door',
+        help='only changes of this door')
+    p.add_argument('--since', type=_epoch,
+        help='only changes at or after this date')
+    p.add_argument('--until', type=_epoch,
+        help='only changes before this date')
+    p.add_argument('--json', action='store_true',
+        help='print the records as JSON lines')
+    p.set_defaults(func=show_audit)
+
+    args = parser.parse_args(argv)
+    if args.command is None:
+        parser.print_help()
+        return 2
+    return args.func(args)
+
+
 if __name__ == '__main__':
     sys.exit(rfiddoorctl())
-
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- Mode: Python; py-indent-offset: 4; coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 expandtab
+
+## Copyright (c) 2015, Claudio Luck (Zurich, Switzerland)
+##
+## Licensed under the terms of the MIT License, see LICENSE file.
+
+"""Process-wide registry of the doors listed in /etc/ipa/doorlist.txt.
+
+The file is parsed once per change of its identity (mtime, size, inode)
+and published as an immutable DoorList.  Readers never take a lock; a
+reload swaps the published reference, and workers that race with a
+reload keep using the previous list instead of waiting for it.
+
+Each DoorList carries a digest of its doors, which changes only when
+the doors do, so clients (the web UI) can cache the list by digest.
+"""
+
+from __future__ import print_function
+
+import codecs
+import hashlib
+import os
+import threading
+import time
+
+from ipalib_rfiddoorcontrol import metrics
+
+
+DOORLIST = '/etc/ipa/doorlist.txt'
+
+
+class DoorList(object):
+    """Immutable door list with case-insensitive O(1) lookup.
+
+    Doors keep the order and spelling of their first occurrence in the
+    file; their position is the door id.  The digest is the SHA-1 of
+    the doors, one per line.
+    """
+
+    __slots__ = ('doors', 'index', 'identity', 'digest')
+
+    def __init__(self, doors=(), identity=None):
+        uniq = []
+        index = {}
+        for door in doors:
+            idoor = door.lower()
+            if idoor not in index:
+                index[idoor] = len(uniq)
+                uniq.append(door)
+        self.doors = tuple(uniq)
+        self.index = index
+        self.identity = identity
+        self.digest = hashlib.sha1(
+            u'\n'.join(uniq).encode('utf-8')).hexdigest()
+
+    def __contains__(self, door):
+        return door.lower() in self.index
+
+    def __iter__(self):
+        return iter(self.doors)
+
+    def __len__(self):
+        return len(self.doors)
+
+    def door_id(self, door):
+        return self.index.get(door.lower())
+
+    @classmethod
+    def load(cls, path, identity=None):
+        doors = []
+        with codecs.open(path, 'r', 'utf-8') as fh:
+            for door in fh:
+                door = door.strip()
+                if not door or door.startswith('#'):
+                    continue
+                doors.append(door)
+        return cls(doors, identity)
+
+
+def file_identity(path):
+    st = os.stat(path)
+    return (st.st_mtime, st.st_size, st.st_ino)
+
+
+class DoorRegistry(object):
+    """Shares one DoorList per file among all threads of a process."""
+
+    def __init__(self, path=DOORLIST):
+        self.path = path
+        self._current = DoorList()
+        self._lock = threading.Lock()
+
+    def get(self):
+        identity = file_identity(self.path)
+        current = self._current
+        if identity == current.identity:
+            if metrics.enabled:
+                metrics.incr('doorlist.hit')
+            return current
+        # Only block while nothing has been loaded yet; afterwards a
+        # concurrent reload is left to whoever got the lock first.
+        if not self._lock.acquire(current.identity is None):
+            if metrics.enabled:
+                metrics.incr('doorlist.stale')
+            return current
+        try:
+            current = self._current
+            if identity != current.identity:
+                t0 = time.time()
+                current = DoorList.load(self.path, identity)
+                self._current = current
+                if metrics.enabled:
+                    metrics.incr('doorlist.miss')
+                    metrics.observe('doorlist.reload', time.time() - t0)
+        finally:
+            self._lock.release()
+        return current
+
+
+registry = DoorRegistry()
+
+
+def known_doors():
+    return registry.get()
@@ -0,0 +1,246 @@
+#!/usr/bin/env python
+# -*- Mode: Python; py-indent-offset: 4; coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 expandtab
+
+## Copyright (c) 2015, Claudio Luck (Zurich, Switzerland)
+##
+## Licensed under the terms of the MIT License, see LICENSE file.
+
+"""Full and incremental export of the RFID access snapshot.
+
+Next to the snapshot, a JSON state file remembers the rfidKey and
+rfidDoorAccess values of every exported user, the modifyTimestamp
+high-water mark, the door list identity and the fingerprint of the
+group grants.  An incremental run only fetches users modified since
+the high-water mark, recompiles the keys they own (or owned) and
+rewrites the snapshot from the previous one.  When the door list or
+any group membership or group grant changed, all keys are recompiled
+from the state instead.
+"""
+
+from __future__ import print_function
+
+import codecs
+import datetime
+import json
+import os
+
+from ipalib_rfiddoorcontrol.doorlist import DoorList, file_identity
+from ipalib_rfiddoorcontrol.groups import GroupGraph
+from ipalib_rfiddoorcontrol.snapshot import (
+        Snapshot,
+        compile_grants,
+        snapshot_key,
+        write_snapshot,
+    )
+
+
+RFID_ATTRS = ('uid', 'objectclass', 'rfidkey', 'rfiddooraccess',
+              'modifytimestamp')
+
+# re-fetch entries this far behind the high-water mark, so changes
+# committed while the previous search was running are not missed
+WATERMARK_OVERLAP = datetime.timedelta(minutes=5)
+
+GENERALIZED_TIME = '%Y%m%d%H%M%SZ'
+
+
+def generalized_time(value):
+    if isinstance(value, datetime.datetime):
+        return value.strftime(GENERALIZED_TIME)
+    return str(value)
+
+
+def user_base_dn(api):
+    from ipapython.dn import DN
+    return DN(api.env.container_user, api.env.basedn)
+
+
+def group_base_dn(api):
+    from ipapython.dn import DN
+    return DN(api.env.container_group, api.env.basedn)
+
+
+def find_users(ldap, base_dn, filter, attrs_list=RFID_ATTRS):
+    """Search all users, ignoring the IPA search time and size limits."""
+    from ipalib import errors
+    try:
+        entries, truncated = ldap.find_entries(
+            filter=filter, attrs_list=list(attrs_list), base_dn=base_dn,
+            scope=ldap.SCOPE_ONELEVEL, time_limit=0, size_limit=0,
+            paged_search=True)
+    except errors.NotFound:
+        return []
+    return entries
+
+
+def load_groups(ldap, base_dn=None):
+    """Build the GroupGraph of all groups below base_dn (None: no groups)."""
+    if base_dn is None:
+        return GroupGraph()
+    entries = find_users(ldap, base_dn, '(objectClass=groupOfNames)',
+                         ('member', 'rfiddooraccess'))
+    return GroupGraph((entry.dn, entry.get('member', ()),
+                       entry.get('rfiddooraccess', ())) for entry in entries)
+
+
+def is_rfid_entry(entry):
+    return any(oc.lower() == 'rfiddoorcontrol'
+               for oc in entry.get('objectclass', ()))
+
+
+class ExportState(object):
+
+    VERSION = 1
+
+    def __init__(self, watermark=None, doorlist=None, users=None, groups=None):
+        self.watermark = watermark
+        self.doorlist = doorlist
+        self.users = users if users is not None else {}
+        self.groups = groups
+
+    @classmethod
+    def load(cls, path):
+        with codecs.open(path, 'r', 'utf-8') as fh:
+            data = json.load(fh)
+        if data.get('version') != cls.VERSION:
+            raise ValueError('{0}: unknown state version'.format(path))
+        doorlist = data.get('doorlist')
+        return cls(data.get('watermark'),
+                   tuple(doorlist) if doorlist else None,
+                   data.get('users', {}), data.get('groups'))
+
+    def save(self, path):
+        tmp = path + '.tmp'
+        with codecs.open(tmp, 'w', 'utf-8') as fh:
+            json.dump(dict(version=self.VERSION, watermark=self.watermark,
+                           doorlist=self.doorlist, users=self.users,
+                           groups=self.groups), fh)
+        os.rename(tmp, path)
+
+    def set_user(self, entry):
+        uid = entry['uid'][0]
+        self.users[uid] = dict(
+            dn=u'{0}'.format(entry.dn),
+            keys=list(entry.get('rfidkey', [])),
+            access=list(entry.get('rfiddooraccess', [])),
+        )
+        self.advance(entry)
+
+    def advance(self, entry):
+        for ts in entry.get('modifytimestamp', ()):
+            ts = generalized_time(ts)
+            if self.watermark is None or ts > self.watermark:
+                self.watermark = ts
+
+    def since(self):
+        """modifyTimestamp to search from, WATERMARK_OVERLAP early."""
+        dt = datetime.datetime.strptime(self.watermark, GENERALIZED_TIME)
+        return (dt - WATERMARK_OVERLAP).strftime(GENERALIZED_TIME)
+
+    def keyed_accesses(self, uids=None, graph=None):
+        """Yield (key, own and inherited rfidDoorAccess values)."""
+        for uid in self.users if uids is None else uids:
+            user = self.users[uid]
+            access = user['access']
+            if graph is not None:
+                access = access + list(graph.access(user['dn']))
+            for key in user['keys']:
+                yield key, access
+
+
+def full_export(ldap, base_dn, output, doorlist_path, state_path=None,
+                groups_dn=None):
+    """Rebuild the snapshot from all rfidDoorControl users.
+
+    Grants of the groups below groups_dn are inherited by their members.
+    """
+    state = ExportState()
+    graph = load_groups(ldap, groups_dn)
+    for entry in find_users(ldap, base_dn, '(objectClass=rfidDoorControl)'):
+        state.set_user(entry)
+    return _rebuild(state, output, doorlist_path, state_path, graph)
+
+
+def _rebuild(state, output, doorlist_path, state_path, graph):
+    state.doorlist = file_identity(doorlist_path)
+    state.groups = graph.fingerprint
+    doors = DoorList.load(doorlist_path)
+    grants, doors = compile_grants(state.keyed_accesses(graph=graph), doors)
+    write_snapshot(output, grants, doors)
+    if state_path:
+        state.save(state_path)
+    return dict(keys=len(grants), doors=len(doors), users=len(state.users),
+                changed=len(state.users), removed=0)
+
+
+def incremental_export(ldap, base_dn, output, doorlist_path, state_path,
+                       groups_dn=None):
+    """Patch the snapshot with the users changed since the last export.
+
+    Falls back to a full export when there is no usable state.  Users
+    that lost the rfidDoorControl object class (user_delrfid) or were
+    deleted are removed from the snapshot.
+    """
+    try:
+        state = ExportState.load(state_path)
+        snap = Snapshot(output)
+    except (IOError, OSError, ValueError):
+        return full_export(ldap, base_dn, output, doorlist_path, state_path,
+                           groups_dn)
+    if state.watermark is None:
+        snap.close()
+        return full_export(ldap, base_dn, output, doorlist_path, state_path,
+                           groups_dn)
+    graph = load_groups(ldap, groups_dn)
+
+    affected = set()
+    changed = removed = 0
+
+    def drop(uid):
+        old = state.users.pop(uid, None)
+        if old is not None:
+            affected.update(snapshot_key(k) for k in old['keys'])
+        return old is not None
+
+    entries = find_users(ldap, base_dn,
+                         '(modifyTimestamp>={0})'.format(state.since()))
+    for entry in entries:
+        uid = entry['uid'][0]
+        if is_rfid_entry(entry):
+            drop(uid)
+            state.set_user(entry)
+            affected.update(snapshot_key(k) for k in state.users[uid]['keys'])
+            changed += 1
+        else:
+            state.advance(entry)
+            removed += drop(uid)
+    # deleted users leave no modifyTimestamp behind
+    present = set(e['uid'][0] for e in find_users(
+        ldap, base_dn, '(objectClass=rfidDoorControl)', ('uid',)))
+    for uid in set(state.users) - present:
+        removed += drop(uid)
+
+    if tuple(state.doorlist or ()) != file_identity(doorlist_path) or \
+            state.groups != graph.fingerprint:
+        snap.close()
+        result = _rebuild(state, output, doorlist_path, state_path, graph)
+        result.update(changed=changed, removed=removed)
+        return result
+
+    with snap:
+        grants = dict((snapshot_key(k), v) for k, v in snap)
+        doors = snap.doors
+    for key in affected:
+        grants.pop(key, None)
+    owners = [uid for uid, user in state.users.items()
+              if any(snapshot_key(k) in affected for k in user['keys'])]
+    grants, doors = compile_grants(
+        ((k, a) for k, a in state.keyed_accesses(owners, graph)
+         if snapshot_key(k) in affected),
+        doors, grants)
+    if affected:
+        write_snapshot(output, grants, doors)
+    state.save(state_path)
+    return dict(keys=len(grants), doors=len(doors), users=len(state.users),
+                changed=changed, removed=removed)
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- Mode: Python; py-indent-offset: 4; coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 expandtab
+
+## Copyright (c) 2015, Claudio Luck (Zurich, Switzerland)
+##
+## Licensed under the terms of the MIT License, see LICENSE file.
+
+"""Door grants inherited from IPA groups.
+
+A user holds the rfidDoorAccess values of every group it is a direct
+or nested member of, merged with its own values by parse_accesses()
+(every grant of a door counts unless another one covers it).
+
+GroupGraph is built from the member attributes of all groups.  The
+set of groups above each group is computed once, and the inherited
+values once per distinct set of direct groups, so users sharing their
+groups share the result.  The fingerprint changes with any membership
+or group grant, which is how the export notices that it has to
+recompile.
+"""
+
+from __future__ import print_function
+
+import hashlib
+
+
+def _dn(dn):
+    return u'{0}'.format(dn).lower()
+
+
+class GroupGraph(object):
+
+    def __init__(self, groups=()):
+        """groups: (group dn, member dns, rfidDoorAccess values) tuples."""
+        self.parents = {}
+        self.grants = {}
+        digest = hashlib.sha1()
+        for dn, members, access in sorted(
+                (_dn(dn), sorted(_dn(m) for m in members), sorted(access))
+                for dn, members, access in groups):
+            for member in members:
+                self.parents.setdefault(member, set()).add(dn)
+            if access:
+                self.grants[dn] = access
+            digest.update(repr((dn, members, access)).encode('utf-8'))
+        self.fingerprint = digest.hexdigest()
+        self._above = {}
+        self._access = {}
+
+    def above(self, group):
+        """Return the group and all groups it is nested in (memoized)."""
+        group = _dn(group)
+        found = self._above.get(group)
+        if found is None:
+            found = set([group])
+            todo = [group]
+            while todo:
+                for parent in self.parents.get(todo.pop(), ()):
+                    if parent not in found:
+                        found.add(parent)
+                        todo.append(parent)
+            found = self._above[group] = frozenset(found)
+        return found
+
+    def groups(self, member):
+        """Return all groups member (a user or group dn) belongs to."""
+        direct = self.parents.get(_dn(member), ())
+        found = set()
+        for group in direct:
+            found.update(self.above(group))
+        return found
+
+    def access(self, member):
+        """Return the rfidDoorAccess values member inherits from groups."""
+        direct = frozenset(self.parents.get(_dn(member), ()))
+        values = self._access.get(direct)
+        if values is None:
+            groups = set()
+            for group in direct:
+                groups.update(self.above(group))
+            values = self._access[direct] = tuple(
+                value for group in sorted(groups)
+                for value in self.grants.get(group, ()))
+        return values
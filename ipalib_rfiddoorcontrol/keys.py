@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# -*- Mode: Python; py-indent-offset: 4; coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 expandtab
+
+## Copyright (c) 2015, Claudio Luck (Zurich, Switzerland)
+##
+## Licensed under the terms of the MIT License, see LICENSE file.
+
+"""Canonical form of rfidKey values.
+
+Readers print the same card as "04a1b2c3", "04:A1:B2:C3", "0x4A1B2C3"
+or as a decimal number, "0077705923".  All of them are stored as
+upper-case hex with an even number of digits ("04A1B2C3"), so that keys
+can be compared with an indexed equality filter.  Hex digits are kept
+as given, only an odd count gets a leading zero: "0004A1B2C3" is a
+different card than "04A1B2C3".
+
+Keys are read as hex unless they start with DECIMAL_PREFIX
+("#0077705923"): an all-digit key may just as well be a hex ID (a
+5 byte EM4100 ID has 10 digits), so decimal input has to be marked.
+Values stored before keys were normalized are migrated with
+normalize_stored() (`rfiddoorctl normalize-keys`).
+"""
+
+from __future__ import print_function
+
+import re
+
+
+DECIMAL_PREFIX = '#'
+# digits of the decimal form printed by the readers, see normalize_stored()
+DECIMAL_DIGITS = 10
+
+_separators = re.compile(r'[\s:.\-]')
+_hex = re.compile(r'[0-9A-F]+\Z')
+_decimal = re.compile(r'[0-9]+\Z')
+
+
+def normalize_key(key):
+    """Return the canonical form of an RFID key, ValueError if invalid."""
+    digits = key.strip()
+    base = 16
+    if digits.startswith(DECIMAL_PREFIX):
+        digits = digits[len(DECIMAL_PREFIX):]
+        base = 10
+    digits = _separators.sub('', digits).upper()
+    if base == 16 and digits.startswith('0X'):
+        digits = digits[2:]
+    if not (_hex if base == 16 else _decimal).match(digits):
+        raise ValueError('invalid RFID key {0!r}'.format(key))
+    # leading zero bytes are part of the ID: 0004A1B2C3 is not 04A1B2C3
+    canonical = digits if base == 16 else '{0:X}'.format(int(digits))
+    if len(canonical) % 2:
+        canonical = '0' + canonical
+    return canonical
+
+
+def canonical_key(key):
+    """Like normalize_key, but keep invalid keys (stripped) as they are."""
+    try:
+        return normalize_key(key)
+    except ValueError:
+        return key.strip()
+
+
+def normalize_stored(keys, decimal=False):
+    """Canonicalize stored rfidKey values.
+
+    With decimal, values of exactly DECIMAL_DIGITS digits are read as
+    the readers' decimal form.  Returns (keys, invalid): the canonical
+    keys without duplicates, followed by the invalid values unchanged,
+    and the invalid values.
+    """
+    canonical = []
+    invalid = []
+    for key in keys:
+        text = key.strip()
+        if decimal and len(text) == DECIMAL_DIGITS and text.isdigit():
+            text = DECIMAL_PREFIX + text
+        try:
+            text = normalize_key(text)
+        except ValueError:
+            invalid.append(key)
+            continue
+        if text not in canonical:
+            canonical.append(text)
+    return canonical + invalid, invalid
+
+
+def find_duplicates(user_keys):
+    """Index (uid, rfidKey values) pairs by canonical key.
+
+    Returns (duplicates, invalid): duplicates maps each key held by
+    more than one user to the sorted uids, invalid lists the (uid, key)
+    pairs that are not valid keys.
+    """
+    index = {}
+    invalid = []
+    for uid, keys in user_keys:
+        for key in keys:
+            try:
+                key = normalize_key(key)
+            except ValueError:
+                invalid.append((uid, key))
+                continue
+            holders = index.setdefault(key, [])
+            if uid not in holders:
+                holders.append(uid)
+    duplicates = dict((key, sorted(uids)) for key, uids in index.items()
+                      if len(uids) > 1)
+    return duplicates, invalid
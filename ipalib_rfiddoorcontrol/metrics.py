@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+# -*- Mode: Python; py-indent-offset: 4; coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 expandtab
+
+## Copyright (c) 2015, Claudio Luck (Zurich, Switzerland)
+##
+## Licensed under the terms of the MIT License, see LICENSE file.
+
+"""Counters and latency histograms for the plugin.
+
+LDAP operations are counted per command as "<command>.ldap.<op>", by
+wrapping the ldap2 backend in CountingLDAP.
+
+Functions decorated with timed() record their call count and a latency
+histogram.  Recording is only enabled when STATS_DIR (environment
+variable RFIDDOORCONTROL_STATS) is a writable directory when the module
+is imported; otherwise timed() and counting() return the function and
+the backend unchanged and incr() and observe() return at once.  Every
+process then has a background thread writing its counters to
+STATS_DIR/<pid>-<start>.json every FLUSH_INTERVAL seconds (and on
+exit), named by its start time as well so that a process reusing the
+pid of a dead one does not overwrite its file, and `rfiddoorctl stats`
+sums the files of all (httpd worker) processes.
+"""
+
+from __future__ import print_function
+
+import atexit
+import bisect
+import collections
+import functools
+import json
+import os
+import threading
+import time
+
+
+LDAP_OPS = frozenset((
+    'get_entry', 'get_entries', 'find_entries', 'add_entry', 'update_entry',
+    'delete_entry', 'search',
+))
+
+STATS_DIR = os.environ.get('RFIDDOORCONTROL_STATS',
+                           '/var/lib/rfiddoorcontrol/stats')
+FLUSH_INTERVAL = 5.0
+
+# upper bounds of the histogram buckets in seconds, plus one overflow
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+           0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+enabled = os.path.isdir(STATS_DIR) and os.access(STATS_DIR, os.W_OK)
+
+_lock = threading.Lock()
+counters = collections.Counter()
+histograms = {}
+
+# the flush thread of this process and its stats file
+_flusher_lock = threading.Lock()
+_flusher_pid = None
+_path = None
+
+
+def _start_flusher():
+    # after a fork the counters are inherited, but not the thread
+    global _flusher_pid, _path
+    with _flusher_lock:
+        if _flusher_pid == os.getpid():
+            return
+        _path = os.path.join(STATS_DIR, '{0:d}-{1:d}.json'.format(
+            os.getpid(), int(time.time() * 1000)))
+        thread = threading.Thread(target=_run_flusher,
+                                  name='rfiddoorcontrol-stats')
+        thread.daemon = True
+        thread.start()
+        _flusher_pid = os.getpid()
+
+
+def _run_flusher():
+    while True:
+        time.sleep(FLUSH_INTERVAL)
+        flush()
+
+
+def incr(name, n=1):
+    if not enabled:
+        return
+    if _flusher_pid != os.getpid():
+        _start_flusher()
+    with _lock:
+        counters[name] += n
+
+
+def observe(name, seconds):
+    """Record one call of name that took seconds."""
+    if not enabled:
+        return
+    if _flusher_pid != os.getpid():
+        _start_flusher()
+    with _lock:
+        counters[name + '.calls'] += 1
+        hist = histograms.get(name)
+        if hist is None:
+            hist = histograms[name] = dict(sum=0.0, buckets=[0] * (len(BUCKETS) + 1))
+        hist['sum'] += seconds
+        hist['buckets'][bisect.bisect_left(BUCKETS, seconds)] += 1
+
+
+def timed(name):
+    """Decorator recording the latency of calls as histogram name."""
+    def decorate(func):
+        if not enabled:
+            return func
+
+        @functools.wraps(func)
+        def wrapper(*args, **kw):
+            t0 = time.time()
+            try:
+                return func(*args, **kw)
+            finally:
+                observe(name, time.time() - t0)
+        return wrapper
+    return decorate
+
+
+def snapshot():
+    with _lock:
+        return dict(counters)
+
+
+def reset():
+    with _lock:
+        counters.clear()
+        histograms.clear()
+
+
+def flush(path=None):
+    """Write the counters of this process to its file in STATS_DIR."""
+    with _lock:
+        data = dict(pid=os.getpid(), updated=time.time(),
+                    counters=dict(counters),
+                    histograms=json.loads(json.dumps(histograms)))
+    path = path or _path
+    if path is None:
+        return
+    tmp = '{0}.tmp'.format(path)
+    try:
+        with open(tmp, 'w') as fh:
+            json.dump(data, fh)
+        os.rename(tmp, path)
+    except (IOError, OSError):
+        pass
+
+
+def _flush_at_exit():
+    if enabled and _flusher_pid == os.getpid():
+        flush()
+
+atexit.register(_flush_at_exit)
+
+
+def load(stats_dir=STATS_DIR):
+    """Sum the counters and histograms written by all processes.
+
+    Returns (counters, histograms, number of processes).
+    """
+    total = collections.Counter()
+    hists = {}
+    files = 0
+    for name in sorted(os.listdir(stats_dir)):
+        if not name.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(stats_dir, name)) as fh:
+                data = json.load(fh)
+        except (IOError, OSError, ValueError):
+            continue
+        files += 1
+        total.update(data.get('counters', {}))
+        for hname, hist in data.get('histograms', {}).items():
+            acc = hists.setdefault(hname, dict(sum=0.0, buckets=[0] * (len(BUCKETS) + 1)))
+            acc['sum'] += hist['sum']
+            for i, n in enumerate(hist['buckets'][:len(acc['buckets'])]):
+                acc['buckets'][i] += n
+    return total, hists, files
+
+
+def clear(stats_dir=STATS_DIR):
+    for name in os.listdir(stats_dir):
+        if name.endswith('.json'):
+            os.unlink(os.path.join(stats_dir, name))
+
+
+def percentile(hist, p):
+    """Upper bound of the bucket holding the p-th percentile, None if empty."""
+    count = sum(hist['buckets'])
+    if not count:
+        return None
+    rank = count * p / 100.0
+    seen = 0
+    for bound, n in zip(BUCKETS + (float('inf'),), hist['buckets']):
+        seen += n
+        if seen >= rank:
+            return bound
+    return float('inf')
+
+
+class CountingLDAP(object):
+    """Proxy to an ldap2 backend counting the operations of a command."""
+
+    def __init__(self, ldap, command):
+        self._ldap = ldap
+        self._prefix = '{0}.ldap.'.format(command)
+
+    def __getattr__(self, name):
+        attr = getattr(self._ldap, name)
+        if name not in LDAP_OPS:
+            return attr
+        counter = self._prefix + name
+
+        def counted(*args, **kw):
+            incr(counter)
+            return attr(*args, **kw)
+        return counted
+
+
+def counting(ldap, command):
+    """Return ldap counting the operations of command, if enabled."""
+    if not enabled or isinstance(ldap, CountingLDAP):
+        return ldap
+    return CountingLDAP(ldap, command)
@@ -1,19 +1,29 @@
 # -*- coding: utf-8 -*-
 
 import datetime
-import re
 
-from ipalib import _
-from ipalib import errors, output
-from ipalib.parameters import Str
+from ipalib import _, ngettext
+from ipalib import Command, errors, output
+from ipalib.parameters import Flag, Int, Str
 from ipalib.plugable import Registry
-from ipalib.plugins import user
+from ipalib.plugins import group, user
 from ipalib.plugins.baseldap import (
         LDAPQuery,
         pkey_to_value,
-        add_missing_object_class,
     )
 from ipalib.plugins.internal import i18n_messages
+from ipalib.request import context
+from ipapython.dn import DN
+
+from ipalib_rfiddoorcontrol import audit, metrics
+from ipalib_rfiddoorcontrol.access import (
+        AccessChangeManager,
+        format_grant,
+        is_active,
+        parse_accesses,
+    )
+from ipalib_rfiddoorcontrol.doorlist import known_doors
+from ipalib_rfiddoorcontrol.keys import normalize_key
 
 
 # No other way to do this?:
@@ -39,130 +49,233 @@ user.user.takes_params += (
 )
 
 
+group.group.takes_params += (
+    Str('rfiddooraccess*',
+        cli_name='rfid_door_access',
+        label=_('RFID Door Access'),
+        doc=_('Door access granted to all direct and nested members'),
+    ),
+)
 
-register = Registry()
-
-
-class AccessChangeManager(object):
 
-    DISABLED = datetime.datetime(1, 1, 1, 0, 0, 0)
-    FOREVER = datetime.datetime(9999, 12, 31, 23, 59, 59)
 
-    def __init__(self, old_access, new_access):
-        self._case = {}
-        self._old = {}
-        self._new = {}
-        self._old.update(self._parse_accesses(old_access), case=True)
-        self._new.update(self._parse_accesses(new_access))
-        self.fill_gaps()
-        self.known_accesses_mtime = 0
-        self.reload_known_accesses()
+register = Registry()
 
-    def reload_known_accesses(self):
-        f = '/etc/ipa/doorlist.txt'
-        mtime = os.stat(f).st_mtime
-        doors = []
-        if mtime <= self.known_accesses_mtime:
+def _pending_audit():
+    """Return the grant changes of the pre-callbacks by command name.
+
+    They are audited by the post-callbacks once the entry has been
+    written.  Keeping them in the request context rather than by dn
+    survives a rename, and the context is dropped with the request.
+    """
+    pending = getattr(context, 'rfiddoor_audit', None)
+    if pending is None:
+        pending = context.rfiddoor_audit = {}
+    return pending
+
+
+def stash_audit(command, acm):
+    """Keep the grant changes of command (none if acm is None)."""
+    if not audit.enabled:
+        return
+    changes = acm.diff() if acm is not None else None
+    if changes:
+        _pending_audit()[command.name] = changes
+    else:
+        _pending_audit().pop(command.name, None)
+
+
+def emit_audit(command, dn, keys, changes=None):
+    """Audit changes, by default those stashed for command, made to dn."""
+    if not audit.enabled:
+        return
+    if changes is None:
+        changes = _pending_audit().pop(command.name, None)
+        if changes is None:
             return
-        with codecs.open(f, 'r', 'utf-8') as fh:
-            for door in fh:
-                door = door.strip()
-                if not door or door.startswith('#'):
-                    continue
-                if door not in doors:
-                    doors.append(door)
-        self.known_accesses = doors
-
-    def _parse_accesses(self, acc_list, case=False):
-        accesses = {}
-        for acc_lel in acc_list or ():
-            iacc_lel = acc_lel.lower().strip()
-            if case and iacc_lel not in self._case:
-                self._case[iacc_lel] = acc_lel
-            acc_lel = acc_lel.replace(',', ';')
-            for acc_t in acc_lel.split(';'):
-                acc_t = acc_t.split(':', 1)
-                acc = acc_t[0].lower().strip()
-                if len(acc_t) == 2:
-                    exc = acc_t[1].strip().upper()
-                    if exc == 'DISABLED':
-                        exc = '0001-01-01T00:00:00'
-                    if 'T' not in exc:
-                        exc += 'T00:00:00'
-                else:
-                    exc = '9999-12-31T23:59:59'
-                try:
-                    exc_dt = datetime.datetime.strptime(exc, '%Y-%m-%dT%H:%M:%S')   
-                except:
-                    if acc not in accesses:
-                        accesses[acc] = acc_t[1]
-                else:
-                    if accesses.get(acc, exc_dt) <= exc_dt:
-                        accesses[acc] = exc_dt
-        for acc in accesses:
-            yield acc, accesses[acc]
-
-    def fill_gaps(self):
-        self.reload_known_accesses()
-        for acc in self._old:
-            if acc not in self._new:
-                self._new[acc] = self.DISABLED
-        for acc in list(self._new):
-            if self._new[acc] != self.DISABLED:
-                continue
-            if acc not in self.known_accesses:
-                del self._new[acc]
-
-    def get_access(self):
-        for acc, exc in self._new.items():
-            if exc == self.FOREVER:
-                yield self._case.get(acc, acc)
-            elif exc == self.DISABLED:
-                s = '{0}: disabled'.format(acc)
-                yield self._case.get(s, s)
-            elif not isinstance(exc, datetime.datetime):
-                s = '{0}:{1}'.format(acc, exc)
-                yield self._case.get(s, s)
-            elif (exc.hour, exc.minute, exc.second) == (0, 0, 0):
-                s = '{0}: {1}'.format(acc, exc.strftime('%Y-%m-%d'))
-                yield self._case.get(s, s)
-            else:
-                s = '{0}: {1}'.format(acc, exc.strftime('%Y-%m-%dT%H:%M:%S'))
-                yield self._case.get(s, s)
-
-
-
-def useradd_precallback(self, ldap, dn, entry, attrs_list, *keys, **options):
+    audit.record(command.name, getattr(context, 'principal', None),
+                 u'{0}'.format(keys[-1] if keys else dn), changes)
+
+
+@metrics.timed('rfidkey.check')
+def check_rfid_keys(command, ldap, dn, entry):
+    """Normalize the rfidkey values of entry and refuse keys of other users.
+
+    The keys are looked up with an indexed equality filter.
+    """
+    keys = []
+    for value in entry.get('rfidkey') or ():
+        try:
+            key = normalize_key(value)
+        except ValueError as e:
+            raise errors.ValidationError(name='rfidkey', error=unicode(e))
+        if key not in keys:
+            keys.append(key)
+    entry['rfidkey'] = keys
+    if not keys:
+        return
+    filter = ldap.make_filter_from_attr('rfidKey', keys, rules=ldap.MATCH_ANY)
+    try:
+        entries, truncated = ldap.find_entries(
+            filter=filter, attrs_list=['uid', 'rfidKey'],
+            base_dn=DN(command.api.env.container_user, command.api.env.basedn),
+            scope=ldap.SCOPE_ONELEVEL)
+    except errors.NotFound:
+        return
+    for other in entries:
+        if other.dn == dn:
+            continue
+        taken = [key for key in other.get('rfidkey', ()) if key in keys]
+        raise errors.DuplicateEntry(
+            message=_('RFID key %(key)s is already assigned to %(uid)s') % dict(
+                key=(taken or keys)[0], uid=other['uid'][0]))
+
+
+def add_rfid_access(entry, attrs_list):
+    """Add rfidDoorControl to a new entry and canonicalize its grants."""
     try:
         objectclass = entry['objectclass']
     except KeyError:
         objectclass = entry['objectclass'] = []
         if 'objectclass' not in attrs_list:
             attrs_list.append('objectclass')
-    if 'rfidkey' in entry or 'rfiddooraccess' in entry:
-        if 'rfidDoorControl' not in objectclass:
-            objectclass.append('rfidDoorControl')
+    if 'rfidDoorControl' not in objectclass:
+        objectclass.append('rfidDoorControl')
+    new_access = entry.get('rfiddooraccess', [])
+    acm = AccessChangeManager([], new_access)
+    entry['rfiddooraccess'] = list(acm.get_access())
+    return acm
+
+
+def update_rfid_access(ldap, dn, entry):
+    """Add rfidDoorControl to a stored entry and merge its grants.
+
+    Returns the AccessChangeManager if the grants changed, else None.
+    """
+    # a single read for both the object classes and the old grants
+    old_entry = ldap.get_entry(dn, ['objectclass', 'rfiddooraccess'])
+    objectclass = entry.get('objectclass') or list(old_entry['objectclass'])
+    if 'rfiddoorcontrol' not in [oc.lower() for oc in objectclass]:
+        entry['objectclass'] = objectclass + ['rfidDoorControl']
+    # replace deleted rfiddooraccess with 'door: disabled' entries
+    if 'rfiddooraccess' in entry:
+        old_access = old_entry.get('rfiddooraccess', ())
         new_access = entry.get('rfiddooraccess', [])
-        acm = AccessChangeManager([], new_access)
-        entry['rfiddooraccess'] = list(acm.get_access())
+        acm = AccessChangeManager(old_access, new_access)
+        if acm.changed():
+            entry['rfiddooraccess'] = list(acm.get_access())
+            return acm
+        else:
+            # same grants, maybe spelled differently: do not rewrite
+            del entry['rfiddooraccess']
+            metrics.incr('rfiddooraccess.writes_avoided')
+    return None
+
+
+def audit_postcallback(self, ldap, dn, entry_attrs, *keys, **options):
+    emit_audit(self, dn, keys)
+    return dn
+
+
+def audit_exccallback(self, keys, options, exc, call_func, *call_args,
+                      **call_kwargs):
+    # nothing was written: drop the stash of the pre-callback
+    if audit.enabled:
+        _pending_audit().pop(self.name, None)
+    raise exc
+
+
+@metrics.timed('user_add.precallback')
+def useradd_precallback(self, ldap, dn, entry, attrs_list, *keys, **options):
+    acm = None
+    if 'rfidkey' in entry:
+        check_rfid_keys(self, metrics.counting(ldap, self.name), dn, entry)
+    if 'rfidkey' in entry or 'rfiddooraccess' in entry:
+        acm = add_rfid_access(entry, attrs_list)
+    stash_audit(self, acm)
     return dn
 
 user.user_add.register_pre_callback(useradd_precallback)
+user.user_add.register_post_callback(audit_postcallback)
+user.user_add.register_exc_callback(audit_exccallback)
 
 
 
+@metrics.timed('user_mod.precallback')
 def usermod_precallback(self, ldap, dn, entry, attrs_list, *keys, **options):
-    if 'rfidkey' in entry or 'rfiddooraccess' in entry:
-        entry.update(add_missing_object_class(ldap, 'rfidDoorControl', dn, update=False))
-    # replace deleted rfiddooraccess with 'door: disabled' entries
-    if 'rfiddooraccess' in entry:
-        old_access = ldap.get_entry(dn, ['rfiddooraccess']).get('rfiddooraccess', ())
-        new_access = entry.get('rfiddooraccess', [])
-        acm = AccessChangeManager(old_access, new_access)
-        entry['rfiddooraccess'] = list(acm.get_access())
+    if 'rfidkey' not in entry and 'rfiddooraccess' not in entry:
+        stash_audit(self, None)
+        return dn
+    ldap = metrics.counting(ldap, self.name)
+    if 'rfidkey' in entry:
+        check_rfid_keys(self, ldap, dn, entry)
+    stash_audit(self, update_rfid_access(ldap, dn, entry))
     return dn
 
 user.user_mod.register_pre_callback(usermod_precallback)
+user.user_mod.register_post_callback(audit_postcallback)
+user.user_mod.register_exc_callback(audit_exccallback)
+
+
+@metrics.timed('group_add.precallback')
+def groupadd_precallback(self, ldap, dn, entry, attrs_list, *keys, **options):
+    acm = None
+    if 'rfiddooraccess' in entry:
+        acm = add_rfid_access(entry, attrs_list)
+    stash_audit(self, acm)
+    return dn
+
+group.group_add.register_pre_callback(groupadd_precallback)
+group.group_add.register_post_callback(audit_postcallback)
+group.group_add.register_exc_callback(audit_exccallback)
+
+
+@metrics.timed('group_mod.precallback')
+def groupmod_precallback(self, ldap, dn, entry, attrs_list, *keys, **options):
+    acm = None
+    if 'rfiddooraccess' in entry:
+        acm = update_rfid_access(metrics.counting(ldap, self.name), dn, entry)
+    stash_audit(self, acm)
+    return dn
+
+group.group_mod.register_pre_callback(groupmod_precallback)
+group.group_mod.register_post_callback(audit_postcallback)
+group.group_mod.register_exc_callback(audit_exccallback)
+
+
+def enable_rfid(entry, access=None):
+    if 'rfidDoorControl' not in entry['objectclass']:
+        entry['objectclass'].append('rfidDoorControl')
+    if access:
+        old_access = entry.get('rfiddooraccess', ())
+        acm = AccessChangeManager(old_access, old_access)
+        acm.update(access)
+        if acm.changed():
+            entry['rfiddooraccess'] = list(acm.get_access())
+            return acm
+        else:
+            metrics.incr('rfiddooraccess.writes_avoided')
+    return None
+
+
+def revoked_grants(entry):
+    """Audit changes of disable_rfid(entry), empty if not auditing."""
+    if not audit.enabled:
+        return []
+    acm = AccessChangeManager(entry.get('rfiddooraccess', ()), ())
+    acm.clear()
+    return acm.diff()
+
+
+def disable_rfid(entry):
+    while 'rfidDoorControl' in entry['objectclass']:
+        entry['objectclass'].remove('rfidDoorControl')
+
+    for att in ('rfidKey', 'rfidDoorAccess'):
+        try:
+            del entry[att]
+        except KeyError:
+            pass
 
 
 @register()
@@ -172,14 +285,16 @@ class user_addrfid(LDAPQuery):
     has_output = output.standard_value
     msg_summary = _('RFID enabled on "%(value)s"')
 
+    @metrics.timed('user_addrfid.execute')
     def execute(self, *keys, **options):
+        ldap = metrics.counting(self.obj.backend, self.name)
         dn = self.obj.get_dn(*keys, **options)
-        entry = self.obj.backend.get_entry(dn, ['objectclass'])
+        entry = ldap.get_entry(dn, ['objectclass'])
 
-        if 'rfidDoorControl' not in entry['objectclass']:
-            entry['objectclass'].append('rfidDoorControl')
+        enable_rfid(entry)
 
-        self.obj.backend.update_entry(entry)
+        ldap.update_entry(entry)
+        emit_audit(self, dn, keys, [])
 
         return dict(
             result=True,
@@ -194,23 +309,346 @@ class user_delrfid(LDAPQuery):
     has_output = output.standard_value
     msg_summary = _('RFID disabled on "%(value)s"')
 
+    @metrics.timed('user_delrfid.execute')
     def execute(self, *keys, **options):
+        ldap = metrics.counting(self.obj.backend, self.name)
         dn = self.obj.get_dn(*keys, **options)
-        entry = self.obj.backend.get_entry(dn, ['objectclass', 'rfidKey', 'rfidDoorAccess'])
+        entry = ldap.get_entry(dn, ['objectclass', 'rfidKey', 'rfidDoorAccess'])
+        changes = revoked_grants(entry)
+
+        disable_rfid(entry)
+
+        ldap.update_entry(entry)
+        emit_audit(self, dn, keys, changes)
+
+        return dict(
+            result=True,
+            value=pkey_to_value(keys[0], options),
+        )
+
 
-        while 'rfidDoorControl' in entry['objectclass']:
-            entry['objectclass'].remove('rfidDoorControl')
+BATCH_SEARCH_SIZE = 1000
+
+
+def find_user_entries(api, ldap, uids, attrs_list):
+    """Fetch the entries of many users, BATCH_SEARCH_SIZE per search.
+
+    The searches ignore the IPA search time and size limits, which
+    would otherwise cut a batch at ipasearchrecordslimit users; a
+    result truncated by the server raises LimitsExceeded.  Returns a
+    dict mapping the lower-cased uid to its entry.
+    """
+    base_dn = DN(api.env.container_user, api.env.basedn)
+    attrs_list = ['uid'] + list(attrs_list)
+    uids = list(uids)
+    entries = {}
+    for i in range(0, len(uids), BATCH_SEARCH_SIZE):
+        filter = ldap.make_filter_from_attr(
+            'uid', uids[i:i + BATCH_SEARCH_SIZE], rules=ldap.MATCH_ANY)
+        try:
+            found, truncated = ldap.find_entries(
+                filter=filter, attrs_list=attrs_list, base_dn=base_dn,
+                scope=ldap.SCOPE_ONELEVEL, time_limit=0, size_limit=0)
+        except errors.NotFound:
+            continue
+        if truncated:
+            raise errors.LimitsExceeded()
+        for entry in found:
+            entries[entry['uid'][0].lower()] = entry
+    return entries
+
+
+class BatchRFIDCommand(Command):
+    """Apply one change to many users, isolating per-user failures.
+
+    Subclasses define ``change(entry, **options)``, which modifies the
+    entry in place and returns the grant changes to audit; ``attrs_list``
+    names the attributes it needs.
+    """
+
+    takes_args = (
+        Str('uid+',
+            cli_name='login',
+            label=_('User login'),
+        ),
+    )
+
+    has_output = (
+        output.summary,
+        output.Output('result', (list, tuple), _('Users changed')),
+        output.Output('failed', dict, _('Users that could not be changed')),
+        output.Output('completed', int, _('Number of users changed')),
+    )
 
-        for att in ('rfidKey', 'rfidDoorAccess'):
+    attrs_list = ('objectclass',)
+
+    def execute(self, uids, **options):
+        ldap = metrics.counting(self.api.Backend.ldap2, self.name)
+        entries = find_user_entries(self.api, ldap, uids, self.attrs_list)
+        done = []
+        failed = {}
+        for uid in uids:
+            entry = entries.get(uid.lower())
+            if entry is None:
+                failed[uid] = unicode(_('user not found'))
+                continue
+            changes = self.change(entry, **options)
             try:
-                del entry[att]
-            except KeyError:
+                ldap.update_entry(entry)
+            except errors.EmptyModlist:
                 pass
+            except errors.PublicError as e:
+                failed[uid] = e.strerror
+                continue
+            emit_audit(self, entry.dn, (uid,), changes)
+            done.append(uid)
+        return dict(
+            summary=unicode(self.msg_summary % dict(completed=len(done))),
+            result=tuple(done),
+            failed=failed,
+            completed=len(done),
+        )
+
+
+@register()
+class user_addrfid_batch(BatchRFIDCommand):
+    __doc__ = _('Add RFID control to many users at once.')
+
+    takes_options = (
+        Str('rfiddooraccess*',
+            cli_name='rfid_door_access',
+            label=_('RFID Door Access'),
+            doc=_('Door access granted to all users, replacing their '
+                  'grants for the same doors'),
+        ),
+    )
+
+    attrs_list = ('objectclass', 'rfiddooraccess')
+    msg_summary = _('RFID enabled on %(completed)d users')
+
+    def change(self, entry, **options):
+        acm = enable_rfid(entry, options.get('rfiddooraccess'))
+        if acm is None or not audit.enabled:
+            return []
+        return acm.diff()
+
+
+@register()
+class user_delrfid_batch(BatchRFIDCommand):
+    __doc__ = _('Remove RFID control from many users at once.')
+
+    attrs_list = ('objectclass', 'rfidKey', 'rfidDoorAccess')
+    msg_summary = _('RFID disabled on %(completed)d users')
 
-        self.obj.backend.update_entry(entry)
+    def change(self, entry, **options):
+        changes = revoked_grants(entry)
+        disable_rfid(entry)
+        return changes
+
+
+@register()
+class rfiddoor_members(Command):
+    __doc__ = _('List the users with active access to a door, '
+                'directly or through their groups.')
+
+    takes_args = (
+        Str('door',
+            cli_name='door',
+            label=_('Door'),
+        ),
+    )
+
+    takes_options = (
+        Int('sizelimit?',
+            label=_('Size Limit'),
+            doc=_('Maximum number of users searched (0 is unlimited)'),
+            minvalue=0,
+        ),
+    )
+
+    has_output = output.standard_list_of_entries
+    msg_summary = ngettext(
+        '%(count)d user can open the door',
+        '%(count)d users can open the door', 0
+    )
+
+    def execute(self, door, **options):
+        ldap = metrics.counting(self.api.Backend.ldap2, self.name)
+        idoor = door.lower().strip()
+        now = datetime.datetime.now()
+        # grants are stored canonically, "door" or "door: ...", so the
+        # pre-selection is an eq/initial substring match served by the
+        # indices; the grants are evaluated below
+        filter = ldap.combine_filters([
+            '(objectClass=rfidDoorControl)',
+            ldap.combine_filters([
+                ldap.make_filter_from_attr('rfidDoorAccess', idoor),
+                ldap.make_filter_from_attr('rfidDoorAccess', idoor + u':',
+                                           exact=False, leading_wildcard=False),
+            ], rules=ldap.MATCH_ANY),
+        ], rules=ldap.MATCH_ALL)
+
+        # groups granting the door; memberOf of the users already
+        # includes nested groups, so the group tree is not walked here
+        try:
+            groups, truncated = ldap.find_entries(
+                filter=filter, attrs_list=['rfidDoorAccess'],
+                base_dn=DN(self.api.env.container_group, self.api.env.basedn),
+                scope=ldap.SCOPE_ONELEVEL, time_limit=0, size_limit=0)
+        except errors.NotFound:
+            groups = []
+        granted = dict((grp.dn, grp['rfiddooraccess']) for grp in groups
+                       if any(acc == idoor and is_active(exc, now)
+                              for acc, excs in parse_accesses(
+                                  grp.get('rfiddooraccess', ()))
+                              for exc in excs))
+        if granted:
+            filter = ldap.combine_filters([
+                filter,
+                ldap.make_filter_from_attr('memberOf', list(granted),
+                                           rules=ldap.MATCH_ANY),
+            ], rules=ldap.MATCH_ANY)
+
+        try:
+            entries, truncated = ldap.find_entries(
+                filter=filter, attrs_list=['uid', 'rfidDoorAccess', 'memberOf'],
+                base_dn=DN(self.api.env.container_user, self.api.env.basedn),
+                scope=ldap.SCOPE_ONELEVEL,
+                size_limit=options.get('sizelimit'),
+                paged_search=True)
+        except errors.NotFound:
+            entries, truncated = [], False
+
+        result = []
+        for entry in entries:
+            values = list(entry.get('rfiddooraccess', ()))
+            for group_dn in entry.get('memberof', ()):
+                values.extend(granted.get(group_dn, ()))
+            for acc, excs in parse_accesses(values):
+                if acc != idoor:
+                    continue
+                active = [format_grant(acc, exc) for exc in excs
+                          if is_active(exc, now)]
+                if active:
+                    result.append(dict(
+                        uid=entry['uid'],
+                        rfiddooraccess=active,
+                    ))
 
         return dict(
-            result=True,
-            value=pkey_to_value(keys[0], options),
+            summary=self.msg_summary % dict(count=len(result)),
+            result=result,
+            count=len(result),
+            truncated=truncated,
         )
 
+
+@register()
+class rfiddoor_list(Command):
+    __doc__ = _('List the doors of the door list.')
+
+    takes_options = (
+        Str('digest?',
+            label=_('Digest'),
+            doc=_('Digest of a cached door list; the doors are only '
+                  'returned if the list has changed since'),
+        ),
+    )
+
+    has_output = (
+        output.summary,
+        output.Output('result', (list, tuple, type(None)), _('Doors')),
+        output.Output('digest', doc=_('Digest of the door list')),
+        output.Output('count', int, _('Number of doors')),
+    )
+    msg_summary = ngettext(
+        '%(count)d door', '%(count)d doors', 0
+    )
+
+    @metrics.timed('rfiddoor_list.execute')
+    def execute(self, **options):
+        doors = known_doors()
+        result = list(doors)
+        if options.get('digest') == doors.digest:
+            # the caller's copy is current
+            result = None
+        return dict(
+            summary=self.msg_summary % dict(count=len(doors)),
+            result=result,
+            digest=unicode(doors.digest),
+            count=len(doors),
+        )
+
+
+@register()
+class rfiddoor_sweep(Command):
+    __doc__ = _('Disable lapsed door grants of all users and groups.')
+
+    takes_options = (
+        Flag('dry_run',
+            label=_('Dry run'),
+            doc=_('Only count the grants that would be changed'),
+        ),
+    )
+
+    has_output = (
+        output.summary,
+        output.Output('result', dict, _('Sweep counters')),
+        output.Output('failed', dict, _('Entries that could not be changed')),
+    )
+    msg_summary = _('%(expired)d grants disabled, %(dropped)d dropped '
+                    'on %(changed)d of %(users)d users and %(groups)d groups')
+
+    def execute(self, **options):
+        ldap = metrics.counting(self.api.Backend.ldap2, self.name)
+        # presence-indexed: every entry with a grant, the lapsed grants
+        # are found below
+        filter = ldap.combine_filters([
+            '(objectClass=rfidDoorControl)',
+            '(rfidDoorAccess=*)',
+        ], rules=ldap.MATCH_ALL)
+        result = dict(changed=0, expired=0, dropped=0)
+        entries = []
+        for counter, container in (('users', self.api.env.container_user),
+                                   ('groups', self.api.env.container_group)):
+            try:
+                found, truncated = ldap.find_entries(
+                    filter=filter, attrs_list=['uid', 'cn', 'rfidDoorAccess'],
+                    base_dn=DN(container, self.api.env.basedn),
+                    scope=ldap.SCOPE_ONELEVEL, time_limit=0, size_limit=0,
+                    paged_search=True)
+            except errors.NotFound:
+                found = []
+            result[counter] = len(found)
+            entries.extend(found)
+
+        now = datetime.datetime.now()
+        failed = {}
+        for entry in entries:
+            old_access = entry.get('rfiddooraccess', [])
+            acm = AccessChangeManager(old_access, old_access)
+            expired, dropped = acm.expire(now)
+            if not (expired or dropped):
+                continue
+            if not options.get('dry_run'):
+                # one failing entry must not stop the sweep
+                entry['rfiddooraccess'] = list(acm.get_access())
+                try:
+                    ldap.update_entry(entry)
+                except errors.EmptyModlist:
+                    pass
+                except errors.PublicError as e:
+                    failed[unicode(entry.dn)] = e.strerror
+                    continue
+                if audit.enabled:
+                    name = entry.get('uid') or entry.get('cn') or ()
+                    emit_audit(self, entry.dn, tuple(name[:1]), acm.diff())
+            result['changed'] += 1
+            result['expired'] += expired
+            result['dropped'] += dropped
+
+        return dict(
+            summary=self.msg_summary % result,
+            result=result,
+            failed=failed,
+        )
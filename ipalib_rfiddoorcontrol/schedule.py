@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+# -*- Mode: Python; py-indent-offset: 4; coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 expandtab
+
+## Copyright (c) 2015, Claudio Luck (Zurich, Switzerland)
+##
+## Licensed under the terms of the MIT License, see LICENSE file.
+
+"""Weekly time windows of door grants.
+
+    lab-3: Mon-Fri 07:00-19:00 until 2027-01-31
+    lab-3: Mon/Wed 08:00-12:00 13:00-17:00 Sat 09:00-12:00
+    lab-3: 22:00-06:00
+
+A window is a list of days ("Mon", "Mon-Fri", "Fri-Mon", joined by
+"/") followed by one or more HH:MM-HH:MM ranges on 15 minute
+boundaries; ranges without days apply to every day, ranges ending
+before their start on the next day.  A schedule is compiled to
+a week of WEEK_SLOTS bits (bit day * SLOTS_PER_DAY + slot, Monday
+first, local time), so checking a time is a single bit test.
+
+A door may be granted several times with different windows and
+expiries; reduce_grants() keeps the grants that are not covered by
+another one, and the door opens if any of them allows it.
+"""
+
+from __future__ import print_function
+
+import binascii
+import re
+
+
+SLOT_MINUTES = 15
+SLOTS_PER_DAY = 24 * 60 // SLOT_MINUTES
+WEEK_SLOTS = 7 * SLOTS_PER_DAY
+WEEK_BYTES = WEEK_SLOTS // 8
+FULL_WEEK = (1 << WEEK_SLOTS) - 1
+
+DAYS = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+
+_day_index = dict((day.lower(), i) for i, day in enumerate(DAYS))
+_time_range = re.compile(r'([0-9]{1,2}):([0-9]{2})-([0-9]{1,2}):([0-9]{2})\Z')
+
+
+def _slot(hour, minute):
+    minutes = int(hour) * 60 + int(minute)
+    if int(minute) >= 60 or minutes > 24 * 60:
+        raise ValueError('not a time of day: {0}:{1}'.format(hour, minute))
+    if minutes % SLOT_MINUTES:
+        raise ValueError('not a {0} minute boundary: {1}:{2}'.format(
+            SLOT_MINUTES, hour, minute))
+    return minutes // SLOT_MINUTES
+
+
+def _days(token):
+    days = []
+    for part in token.lower().split('/'):
+        first, _, last = part.partition('-')
+        start = _day_index[first]
+        end = _day_index[last] if last else start
+        days.extend((start + i) % 7 for i in range((end - start) % 7 + 1))
+    return days
+
+
+def _window(day, start, end):
+    if end <= start:
+        # overnight: the rest of day and the morning of the next day
+        return _window(day, start, SLOTS_PER_DAY) | \
+            _window((day + 1) % 7, 0, end)
+    return ((1 << (end - start)) - 1) << (day * SLOTS_PER_DAY + start)
+
+
+def parse_schedule(text):
+    """Parse "[windows] [until DATE]" into (week bitmap, until text).
+
+    The bitmap is None without windows or if they cover the whole
+    week, until is None without "until".  Raises ValueError.
+    """
+    tokens = text.split()
+    until = None
+    lowered = [t.lower() for t in tokens]
+    if 'until' in lowered:
+        i = lowered.index('until')
+        until = ' '.join(tokens[i + 1:])
+        tokens = tokens[:i]
+        if not until:
+            raise ValueError('missing date after "until"')
+    if not tokens:
+        if until is None:
+            raise ValueError('empty schedule')
+        return None, until
+    week = 0
+    days = None
+    need_range = False
+    for token in tokens:
+        m = _time_range.match(token)
+        if m is None:
+            try:
+                days = _days(token)
+            except KeyError:
+                raise ValueError('not a day or time range: {0}'.format(token))
+            need_range = True
+            continue
+        start, end = _slot(*m.group(1, 2)), _slot(*m.group(3, 4))
+        if start == SLOTS_PER_DAY:
+            raise ValueError('range starts at 24:00: {0}'.format(token))
+        if start == end:
+            raise ValueError('empty time range: {0}'.format(token))
+        for day in range(7) if days is None else days:
+            week |= _window(day, start, end)
+        need_range = False
+    if need_range:
+        raise ValueError('days without time range: {0}'.format(text))
+    return (None if week == FULL_WEEK else week), until
+
+
+def _format_slot(slot):
+    return '{0:02d}:{1:02d}'.format(*divmod(slot * SLOT_MINUTES, 60))
+
+
+def _runs(bits):
+    runs = []
+    start = None
+    for slot in range(SLOTS_PER_DAY + 1):
+        on = slot < SLOTS_PER_DAY and bits >> slot & 1
+        if on and start is None:
+            start = slot
+        elif not on and start is not None:
+            runs.append('{0}-{1}'.format(_format_slot(start), _format_slot(slot)))
+            start = None
+    return tuple(runs)
+
+
+def _format_days(days):
+    parts = []
+    i = 0
+    while i < len(days):
+        j = i
+        while j + 1 < len(days) and days[j + 1] == days[j] + 1:
+            j += 1
+        if j > i:
+            parts.append('{0}-{1}'.format(DAYS[days[i]], DAYS[days[j]]))
+        else:
+            parts.append(DAYS[days[i]])
+        i = j + 1
+    return '/'.join(parts)
+
+
+def format_schedule(week):
+    """Canonical windows of a week bitmap, e.g. "Mon-Fri 07:00-19:00"."""
+    mask = (1 << SLOTS_PER_DAY) - 1
+    groups = []
+    by_runs = {}
+    for day in range(7):
+        runs = _runs(week >> (day * SLOTS_PER_DAY) & mask)
+        if not runs:
+            continue
+        if runs not in by_runs:
+            by_runs[runs] = []
+            groups.append(runs)
+        by_runs[runs].append(day)
+    return ' '.join('{0} {1}'.format(_format_days(by_runs[runs]), ' '.join(runs))
+                    for runs in groups)
+
+
+def week_slot(weekday, hour, minute):
+    return weekday * SLOTS_PER_DAY + (hour * 60 + minute) // SLOT_MINUTES
+
+
+def allows(week, when):
+    """Is the datetime or struct_time when inside the windows of week?"""
+    if week is None:
+        return True
+    if hasattr(when, 'tm_wday'):
+        slot = week_slot(when.tm_wday, when.tm_hour, when.tm_min)
+    else:
+        slot = week_slot(when.weekday(), when.hour, when.minute)
+    return bool(week >> slot & 1)
+
+
+def covers(week, other):
+    """Does week include every slot of other (None: the whole week)?"""
+    if week is None:
+        return True
+    if other is None:
+        return False
+    return other & ~week == 0
+
+
+def reduce_grants(grants):
+    """Reduce the (expiry, week bitmap or None) grants of a door.
+
+    Grants expiring together are merged into the union of their
+    windows.  A grant is dropped if another one expires no earlier and
+    its windows include the grant's.  Returns the remaining grants
+    sorted by expiry; none of them is covered by another.
+    """
+    merged = {}
+    for expiry, week in grants:
+        if expiry in merged:
+            prev = merged[expiry]
+            week = None if prev is None or week is None else prev | week
+            if week == FULL_WEEK:
+                week = None
+        merged[expiry] = week
+    kept = []
+    for expiry in sorted(merged, reverse=True):
+        week = merged[expiry]
+        if not any(covers(later, week) for _, later in kept):
+            kept.append((expiry, week))
+    kept.reverse()
+    return kept
+
+
+def week_to_bytes(week):
+    return binascii.unhexlify('{0:0{1}x}'.format(week, WEEK_BYTES * 2))
+
+
+def week_from_bytes(data):
+    return int(binascii.hexlify(data), 16)
@@ -0,0 +1,348 @@
+#!/usr/bin/env python
+# -*- Mode: Python; py-indent-offset: 4; coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 expandtab
+
+## Copyright (c) 2015, Claudio Luck (Zurich, Switzerland)
+##
+## Licensed under the terms of the MIT License, see LICENSE file.
+
+"""Compiled, memory-mappable RFID access snapshot.
+
+Layout (little endian, all tables packed back to back):
+
+    header     magic, version, nschedules, nkeys, ngrants, ndoors,
+               generated (epoch)
+    keys       nkeys      x (key offset, key length, first grant, grant count)
+    grants     ngrants    x (door id, schedule, expiry epoch), by door id
+    doors      ndoors     x (name offset, name length)
+    schedules  nschedules x WEEK_BYTES week bitmap (big endian)
+    strings    UTF-8 keys and door names
+
+Keys are stored in the canonical form of keys.normalize_key() and
+sorted bytewise, so a card is found by binary search on the mapped
+file without reading the rest of it.  Door ids follow the order of
+doorlist.txt; doors granted but missing from the list get the next
+free ids.  Expiries are epochs: EXPIRY_DISABLED never opens,
+EXPIRY_FOREVER always does, anything else opens while now < expiry.
+Schedule 0 means no time windows, n > 0 the (n-1)th bitmap of the
+schedules table (see schedule); a grant with a schedule only opens
+inside its windows, in the local time of the reader.  A key may hold
+several grants of a door; the door opens if any of them does.
+"""
+
+from __future__ import print_function
+
+import calendar
+import datetime
+import mmap
+import os
+import struct
+import tempfile
+import time
+
+from ipalib_rfiddoorcontrol.access import DISABLED, FOREVER, parse_accesses
+from ipalib_rfiddoorcontrol.keys import canonical_key
+from ipalib_rfiddoorcontrol.schedule import (
+        WEEK_BYTES,
+        allows,
+        reduce_grants,
+        week_from_bytes,
+        week_to_bytes,
+    )
+
+
+MAGIC = b'RFDA'
+VERSION = 1
+
+HEADER = struct.Struct('<4sHHIIIq')
+KEY = struct.Struct('<IHxxII')
+GRANT = struct.Struct('<HxxIq')
+DOOR = struct.Struct('<IHxx')
+
+EXPIRY_DISABLED = 0
+EXPIRY_FOREVER = 2 ** 63 - 1
+
+
+def to_epoch(exc):
+    """Convert an AccessChangeManager expiry to a snapshot epoch.
+
+    Returns None for free-form expiries, which cannot be evaluated.
+    """
+    if not isinstance(exc, datetime.datetime):
+        return None
+    # the week of a Scheduled expiry is stored apart
+    exc = datetime.datetime(*exc.timetuple()[:6])
+    if exc == DISABLED:
+        return EXPIRY_DISABLED
+    if exc == FOREVER:
+        return EXPIRY_FOREVER
+    try:
+        return int(time.mktime(exc.timetuple()))
+    except (OverflowError, ValueError):
+        return int(calendar.timegm(exc.timetuple()))
+
+
+def snapshot_key(key):
+    return canonical_key(key).encode('utf-8')
+
+
+def merge_epochs(grants):
+    """Reduce (expiry epoch, week) grants of a door, see reduce_grants.
+
+    Disabled grants only remain if nothing else is granted.
+    """
+    live = [grant for grant in grants if grant[0] != EXPIRY_DISABLED]
+    if not live:
+        return ((EXPIRY_DISABLED, None),)
+    return tuple(reduce_grants(live))
+
+
+def active_expiry(grants, now=None):
+    """Return the latest expiry of the grants open at now, else None.
+
+    now is an epoch (default: the current time); windows are checked
+    in local time.
+    """
+    if now is None:
+        now = time.time()
+    local = None
+    found = None
+    for expiry, week in grants:
+        if now >= expiry or found is not None and expiry <= found:
+            continue
+        if week is not None:
+            if local is None:
+                local = time.localtime(now)
+            if not allows(week, local):
+                continue
+        found = expiry
+    return found
+
+
+def compile_grants(keyed_accesses, doors=(), grants=None):
+    """Merge (rfid key, rfidDoorAccess values) pairs into a grant table.
+
+    Returns (grants, doors) with grants mapping the UTF-8 key to a
+    {door id: ((expiry epoch, week bitmap or None), ...)} dict, and
+    doors the list of door names.  The grants of a door are reduced by
+    merge_epochs().  An existing grants table is updated in place.
+    """
+    doors = list(doors)
+    door_ids = dict((door.lower(), i) for i, door in enumerate(doors))
+    if grants is None:
+        grants = {}
+    for key, accesses in keyed_accesses:
+        bkey = snapshot_key(key)
+        if not bkey:
+            continue
+        kgrants = grants.setdefault(bkey, {})
+        for acc, excs in parse_accesses(accesses):
+            door_grants = tuple((to_epoch(exc), getattr(exc, 'week', None))
+                                for exc in excs if to_epoch(exc) is not None)
+            if not door_grants or not acc:
+                continue
+            door_id = door_ids.get(acc)
+            if door_id is None:
+                door_id = door_ids[acc] = len(doors)
+                doors.append(acc)
+            kgrants[door_id] = merge_epochs(kgrants.get(door_id, ()) +
+                                            door_grants)
+    return grants, doors
+
+
+def pack_snapshot(grants, doors, generated=None):
+    """Serialize a grant table as returned by compile_grants()."""
+    if generated is None:
+        generated = int(time.time())
+    keys = sorted(grants)
+    ngrants = sum(len(door_grants) for k in keys
+                  for door_grants in grants[k].values())
+    schedules = {}
+    for key in keys:
+        for door_grants in grants[key].values():
+            for expiry, week in door_grants:
+                if week is not None and week not in schedules:
+                    schedules[week] = len(schedules) + 1
+    strings_off = (HEADER.size + len(keys) * KEY.size + ngrants * GRANT.size +
+                   len(doors) * DOOR.size + len(schedules) * WEEK_BYTES)
+    keytab = []
+    granttab = []
+    doortab = []
+    schedtab = [week_to_bytes(week) for week in
+                sorted(schedules, key=schedules.get)]
+    strings = []
+    str_off = strings_off
+    for key in keys:
+        kgrants = grants[key]
+        first = len(granttab)
+        for door_id in sorted(kgrants):
+            for expiry, week in kgrants[door_id]:
+                granttab.append(GRANT.pack(
+                    door_id, 0 if week is None else schedules[week], expiry))
+        keytab.append(KEY.pack(str_off, len(key), first, len(granttab) - first))
+        strings.append(key)
+        str_off += len(key)
+    for door in doors:
+        bdoor = door.encode('utf-8')
+        doortab.append(DOOR.pack(str_off, len(bdoor)))
+        strings.append(bdoor)
+        str_off += len(bdoor)
+    header = HEADER.pack(MAGIC, VERSION, len(schedules), len(keys), ngrants,
+                         len(doors), generated)
+    return b''.join([header] + keytab + granttab + doortab + schedtab +
+                    strings)
+
+
+def write_snapshot(path, grants, doors, generated=None):
+    """Atomically replace path with a new snapshot."""
+    data = pack_snapshot(grants, doors, generated)
+    dirname = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(prefix='.snapshot-', dir=dirname)
+    try:
+        with os.fdopen(fd, 'wb') as fh:
+            fh.write(data)
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.chmod(tmp, 0o644)
+        os.rename(tmp, path)
+    except:
+        os.unlink(tmp)
+        raise
+    return len(data)
+
+
+class Snapshot(object):
+    """Read-only view of a snapshot file, mapped into memory.
+
+    Lookups binary-search the mapped key table and only decode what
+    they return; nothing is loaded up front.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as fh:
+            self.identity = os.fstat(fh.fileno()).st_mtime
+            self._map = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._map) < HEADER.size:
+            self.close()
+            raise ValueError('{0}: truncated access snapshot'.format(path))
+        (magic, version, self.nschedules, self.nkeys, self.ngrants,
+         self.ndoors, self.generated) = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError('{0}: not a version {1} access snapshot'.format(
+                path, VERSION))
+        self._keys_off = HEADER.size
+        self._grants_off = self._keys_off + self.nkeys * KEY.size
+        self._doors_off = self._grants_off + self.ngrants * GRANT.size
+        self._schedules_off = self._doors_off + self.ndoors * DOOR.size
+        self._door_ids = None
+        self._schedules = {0: None}
+
+    def close(self):
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return self.nkeys
+
+    def _key(self, i):
+        off, length, first, count = KEY.unpack_from(
+            self._map, self._keys_off + i * KEY.size)
+        return self._map[off:off + length], first, count
+
+    def _schedule(self, i):
+        week = self._schedules.get(i, False)
+        if week is False:
+            off = self._schedules_off + (i - 1) * WEEK_BYTES
+            week = self._schedules[i] = week_from_bytes(
+                self._map[off:off + WEEK_BYTES])
+        return week
+
+    def _grants(self, first, count):
+        """Yield (door id, (expiry, week bitmap or None)) by door id."""
+        base = self._grants_off + first * GRANT.size
+        for i in range(count):
+            door_id, schedule, expiry = GRANT.unpack_from(
+                self._map, base + i * GRANT.size)
+            yield door_id, (expiry, self._schedule(schedule))
+
+    def _door_grants(self, first, count):
+        """Return {door id: ((expiry, week), ...)}."""
+        doors = {}
+        for door_id, grant in self._grants(first, count):
+            doors[door_id] = doors.get(door_id, ()) + (grant,)
+        return doors
+
+    def _find(self, key):
+        # bytes too: a native str on Python 2 needs canonicalizing as well
+        if isinstance(key, bytes):
+            key = key.decode('utf-8')
+        key = snapshot_key(key)
+        lo, hi = 0, self.nkeys
+        while lo < hi:
+            mid = (lo + hi) // 2
+            mkey, first, count = self._key(mid)
+            if mkey < key:
+                lo = mid + 1
+            elif mkey > key:
+                hi = mid
+            else:
+                return first, count
+        return None
+
+    def door(self, door_id):
+        off, length = DOOR.unpack_from(
+            self._map, self._doors_off + door_id * DOOR.size)
+        return self._map[off:off + length].decode('utf-8')
+
+    @property
+    def doors(self):
+        return [self.door(i) for i in range(self.ndoors)]
+
+    def door_id(self, door):
+        if self._door_ids is None:
+            self._door_ids = dict(
+                (name.lower(), i) for i, name in enumerate(self.doors))
+        return self._door_ids.get(door.lower())
+
+    def lookup(self, key):
+        """Return {door id: ((expiry, week), ...)} for key, empty if unknown."""
+        found = self._find(key)
+        if found is None:
+            return {}
+        return self._door_grants(*found)
+
+    def grants(self, key, door):
+        """Return the ((expiry epoch, week bitmap or None), ...) of key for door.
+
+        Empty if key has no grant for door or door is unknown.
+        """
+        if not isinstance(door, int):
+            door = self.door_id(door)
+            if door is None:
+                return ()
+        found = self._find(key)
+        if found is None:
+            return ()
+        return tuple(grant for door_id, grant in self._grants(*found)
+                     if door_id == door)
+
+    def expiry(self, key, door, now=None):
+        """Return the expiry epoch of the grant opening door at now, or None."""
+        return active_expiry(self.grants(key, door), now)
+
+    def check(self, key, door, now=None):
+        """May key open door at now (default: the current time)?"""
+        return self.expiry(key, door, now) is not None
+
+    def __iter__(self):
+        """Yield (key, {door id: ((expiry, week), ...)}) in key order."""
+        for i in range(self.nkeys):
+            key, first, count = self._key(i)
+            yield key.decode('utf-8'), self._door_grants(first, count)
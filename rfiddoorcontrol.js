@@ -15,6 +15,82 @@ function get_item_by_attrval(array, attr, value) {
 
 var exp = IPA.rfiddoorcontrol = {};
 
+// Door names for autocompletion of rfiddooraccess inputs. The list is
+// fetched once per page load; browsers keep it in localStorage and send
+// its digest, so the doors only cross the wire when doorlist.txt changed.
+exp.doors_key = 'rfiddoorcontrol.doorlist';
+exp.doors_list_id = 'rfiddoorcontrol-doors';
+exp.doors_requested = false;
+
+exp.load_cached_doors = function() {
+    try {
+        var cached = JSON.parse(window.localStorage.getItem(exp.doors_key));
+        if (cached && cached.digest && cached.doors) return cached;
+    } catch (e) {
+    }
+    return null;
+};
+
+exp.store_cached_doors = function(digest, doors) {
+    try {
+        window.localStorage.setItem(exp.doors_key, JSON.stringify({
+            digest: digest,
+            doors: doors
+        }));
+    } catch (e) {
+    }
+};
+
+exp.set_door_options = function(doors) {
+    var list = document.getElementById(exp.doors_list_id);
+    if (!list) {
+        list = document.createElement('datalist');
+        list.id = exp.doors_list_id;
+        document.body.appendChild(list);
+    }
+    while (list.firstChild) list.removeChild(list.firstChild);
+    for (var i=0, l=doors.length; i<l; i++) {
+        var option = document.createElement('option');
+        option.value = doors[i];
+        list.appendChild(option);
+    }
+};
+
+exp.fetch_doors = function() {
+    if (exp.doors_requested) return;
+    exp.doors_requested = true;
+    var cached = exp.load_cached_doors();
+    var options = {};
+    if (cached) {
+        options.digest = cached.digest;
+        exp.set_door_options(cached.doors);
+    }
+    rpc.command({
+        method: 'rfiddoor_list',
+        options: options,
+        on_success: function(data) {
+            var doors = data.result.result;
+            if (doors === null || doors === undefined) return;
+            exp.store_cached_doors(data.result.digest, doors);
+            exp.set_door_options(doors);
+        },
+        on_error: function() {
+            exp.doors_requested = false;
+        }
+    }).execute();
+};
+
+exp.add_door_completion = function() {
+    document.addEventListener('focusin', function(event) {
+        var input = event.target;
+        if (input.tagName !== 'INPUT' || input.name !== 'rfiddooraccess') return;
+        input.setAttribute('list', exp.doors_list_id);
+        input.setAttribute('autocomplete', 'off');
+        exp.fetch_doors();
+    }, false);
+    return true;
+};
+
 exp.add_rfid_pre_op = function() {
     var facet = get_item_by_attrval(user_mod.entity_spec.facets, '$type', 'details');
     var section = get_item_by_attrval(facet.sections, 'name', 'identity');
@@ -60,6 +136,7 @@ exp.add_rfid_actions = function() {
 
 phases.on('registration', exp.add_rfid_actions);
 phases.on('customization', exp.add_rfid_pre_op);
+phases.on('customization', exp.add_door_completion);
 
 return exp;
 }); 
@@ -62,11 +62,12 @@ setup(
     cmdclass={"install_data": post_install},
     data_files=[
         (os.path.join(IPASHARE_DIR, 'ui/js/plugins', PLUGIN), [PLUGIN+'.js']),
+        (os.path.join(IPASHARE_DIR, 'updates'), ['80-'+PLUGIN+'.update']),
         (os.path.join(IPALIB_DIR, 'plugins'), [PLUGIN+'.py']),  # does not as expected -> post_install
     ],
     entry_points={
         'console_scripts': [
-            'rfiddoorctl = ipalib_rfiddoorcontrol.commands:rfiddoorctrl',
+            'rfiddoorctl = ipalib_rfiddoorcontrol.commands:rfiddoorctl',
         ],
     },
     zip_safe=False,
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+
+"""The tests run without FreeIPA: ipalib is replaced by the stand-ins
+of ipastubs when it is not installed."""
+
+import os
+import sys
+
+try:
+    unicode
+except NameError:  # the plugin is Python 2 code
+    import builtins
+    builtins.unicode = str
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest  # noqa: E402
+
+import ipastubs  # noqa: E402
+
+ipastubs.install()
+
+from ipalib_rfiddoorcontrol import doorlist, metrics  # noqa: E402
+
+
+# the door decision daemon (tools/rfiddoord.py) is Python 3 only
+collect_ignore = ['test_daemon.py'] if sys.version_info[0] < 3 else []
+
+DOORS = (u'lab-3', u'hall', u't\xfcr')
+
+
+@pytest.fixture(autouse=True)
+def doors(tmpdir):
+    """Point the door registry at a door list of DOORS."""
+    path = tmpdir.join('registry-doorlist.txt')
+    path.write_text(u'\n'.join(DOORS) + u'\n', 'utf-8')
+    saved = doorlist.registry
+    doorlist.registry = doorlist.DoorRegistry(str(path))
+    yield DOORS
+    doorlist.registry = saved
+
+
+@pytest.fixture
+def stats(tmpdir, monkeypatch):
+    """Enable the metrics, recording to a temporary STATS_DIR."""
+    monkeypatch.setattr(metrics, 'enabled', True)
+    monkeypatch.setattr(metrics, 'STATS_DIR', str(tmpdir.mkdir('stats')))
+    monkeypatch.setattr(metrics, '_flusher_pid', None)
+    monkeypatch.setattr(metrics, '_path', None)
+    metrics.reset()
+    yield metrics.STATS_DIR
+    metrics.reset()
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+
+"""In-memory stand-in for the ldap2 backend.
+
+Entries are dicts of lower-cased attribute names to value lists.  The
+search methods evaluate the filters the plugin builds (&, |, =, >=
+and * wildcards) and apply a default size limit like ipa's
+ipasearchrecordslimit, so truncation behaves as on a real server.
+Every call is counted in `calls`.
+"""
+
+from __future__ import print_function
+
+import collections
+import fnmatch
+import re
+
+from ipalib import errors
+
+
+class FakeEntry(dict):
+
+    def __init__(self, dn, *args, **kw):
+        super(FakeEntry, self).__init__()
+        self.dn = dn
+        self.deleted = set()
+        for att, values in dict(*args, **kw).items():
+            self[att] = values
+
+    def __setitem__(self, att, values):
+        super(FakeEntry, self).__setitem__(att.lower(), list(values))
+
+    def __getitem__(self, att):
+        return super(FakeEntry, self).__getitem__(att.lower())
+
+    def __delitem__(self, att):
+        super(FakeEntry, self).__delitem__(att.lower())
+        self.deleted.add(att.lower())
+
+    def __contains__(self, att):
+        return super(FakeEntry, self).__contains__(att.lower())
+
+    def get(self, att, default=None):
+        return super(FakeEntry, self).get(att.lower(), default)
+
+
+_term = re.compile(r'\(([A-Za-z0-9;-]+)(>=|<=|=)([^()]*)\)')
+
+
+def _parse(text, i=0):
+    """Parse the filter at text[i:], return (predicate, end)."""
+    if text[i + 1] in '&|':
+        op = all if text[i + 1] == '&' else any
+        i += 2
+        subs = []
+        while text[i] == '(':
+            sub, i = _parse(text, i)
+            subs.append(sub)
+        eqs = [getattr(sub, 'eq', None) for sub in subs]
+        atts = set(eq[0] for eq in eqs if eq is not None)
+        if op is any and None not in eqs and len(atts) == 1:
+            # (|(uid=a)(uid=b)...) as a set lookup
+            att = atts.pop()
+            values = set(value for _, value in eqs)
+            return (lambda entry: any(u'{0}'.format(v).lower() in values
+                                      for v in entry.get(att, ()))), i + 1
+        return (lambda entry: op(sub(entry) for sub in subs)), i + 1
+    m = _term.match(text, i)
+    att, rel, value = m.group(1).lower(), m.group(2), m.group(3).lower()
+    if rel == '>=':
+        test = lambda v: v >= value
+    elif rel == '<=':
+        test = lambda v: v <= value
+    elif '*' in value:
+        test = re.compile(fnmatch.translate(value)).match
+    else:
+        test = value.__eq__
+
+    def match(entry):
+        return any(test(u'{0}'.format(v).lower())
+                   for v in entry.get(att, ()))
+    if test == value.__eq__:
+        match.eq = (att, value)
+    return match, m.end()
+
+
+class FakeLDAP(object):
+
+    MATCH_ALL = '&'
+    MATCH_ANY = '|'
+    SCOPE_ONELEVEL = 1
+
+    def __init__(self, size_limit=100):
+        self.entries = collections.OrderedDict()
+        self.size_limit = size_limit
+        self.calls = collections.Counter()
+
+    def add_entry(self, entry):
+        self.calls['add_entry'] += 1
+        self.entries[entry.dn] = FakeEntry(entry.dn, entry)
+
+    def delete_entry(self, dn):
+        self.calls['delete_entry'] += 1
+        del self.entries[dn]
+
+    def get_entry(self, dn, attrs_list=None):
+        self.calls['get_entry'] += 1
+        try:
+            stored = self.entries[dn]
+        except KeyError:
+            raise errors.NotFound()
+        return self._copy(stored, attrs_list)
+
+    def update_entry(self, entry):
+        self.calls['update_entry'] += 1
+        stored = self.entries[entry.dn]
+        for att in getattr(entry, 'deleted', ()):
+            if att in stored:
+                del stored[att]
+        for att, values in entry.items():
+            if values:
+                stored[att] = values
+            elif att in stored:
+                del stored[att]
+
+    def _copy(self, stored, attrs_list):
+        if attrs_list is None:
+            return FakeEntry(stored.dn, stored)
+        return FakeEntry(stored.dn, ((att, stored[att]) for att in attrs_list
+                                     if att in stored))
+
+    def find_entries(self, filter=None, attrs_list=None, base_dn=None,
+                     scope=None, time_limit=None, size_limit=None,
+                     paged_search=False):
+        self.calls['find_entries'] += 1
+        if size_limit is None:
+            size_limit = self.size_limit
+        match = _parse(filter)[0] if filter else (lambda entry: True)
+        found = [self._copy(entry, attrs_list)
+                 for dn, entry in self.entries.items()
+                 if (base_dn is None or dn.endswith(u'{0}'.format(base_dn)))
+                 and match(entry)]
+        if not found:
+            raise errors.NotFound()
+        truncated = bool(size_limit) and len(found) > size_limit
+        if truncated:
+            found = found[:size_limit]
+        return found, truncated
+
+    def get_entries(self, base_dn, scope=None, filter=None, attrs_list=None):
+        self.calls['get_entries'] += 1
+        entries, truncated = self.find_entries(
+            filter=filter, attrs_list=attrs_list, base_dn=base_dn,
+            scope=scope)
+        if truncated:
+            raise errors.LimitsExceeded()
+        return entries
+
+    def make_filter_from_attr(self, attr, value, rules='|', exact=True,
+                              leading_wildcard=True, trailing_wildcard=True):
+        if isinstance(value, (list, tuple)):
+            return self.combine_filters(
+                [self.make_filter_from_attr(attr, v, rules, exact,
+                                            leading_wildcard, trailing_wildcard)
+                 for v in value], rules)
+        value = u'{0}'.format(value)
+        if not exact:
+            value = u'{0}{1}{2}'.format('*' if leading_wildcard else '', value,
+                                        '*' if trailing_wildcard else '')
+        return u'({0}={1})'.format(attr, value)
+
+    def combine_filters(self, filters, rules='|'):
+        filters = [f for f in filters if f]
+        if len(filters) == 1:
+            return filters[0]
+        return u'({0}{1})'.format(rules, ''.join(filters))
+
+
+class FakeAPI(object):
+    """Just the api.env and api.Backend.ldap2 the commands use."""
+
+    class env(object):
+        basedn = u'dc=example,dc=org'
+        container_user = u'cn=users,cn=accounts'
+        container_group = u'cn=groups,cn=accounts'
+
+    def __init__(self, ldap):
+        self.Backend = type('Backend', (object,), dict(ldap2=ldap))
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+
+"""Minimal stand-ins for the ipalib and ipapython modules the plugin
+imports, so that it can be loaded without a FreeIPA install.
+
+    import ipastubs  # tests/ on sys.path
+    ipastubs.install()
+    from ipalib_rfiddoorcontrol import rfiddoorcontrol
+
+install() does nothing when the real ipalib is importable.  The stubs
+only provide what the plugin uses at import time and on the paths the
+benchmarks and tests exercise; commands are plain classes.
+"""
+
+from __future__ import print_function
+
+import sys
+import threading
+import types
+
+
+class PublicError(Exception):
+
+    def __init__(self, message=None, **kw):
+        self.kw = kw
+        self.strerror = message or self.__class__.__name__
+        super(PublicError, self).__init__(self.strerror)
+
+
+class NotFound(PublicError):
+    pass
+
+
+class EmptyModlist(PublicError):
+    pass
+
+
+class LimitsExceeded(PublicError):
+    pass
+
+
+class DuplicateEntry(PublicError):
+    pass
+
+
+class DatabaseError(PublicError):
+    pass
+
+
+class ValidationError(PublicError):
+
+    def __init__(self, name=None, error=None, **kw):
+        super(ValidationError, self).__init__(
+            'invalid {0!r}: {1}'.format(name, error), **kw)
+
+
+class Param(object):
+
+    def __init__(self, name, *rules, **kw):
+        self.name = name
+        self.kw = kw
+
+
+class Output(object):
+
+    def __init__(self, name, type=None, doc=None, **kw):
+        self.name = name
+
+
+class Command(object):
+    """Base of the plugin's commands, without a framework around it."""
+
+    takes_args = ()
+    takes_options = ()
+    name = None
+    api = None
+    obj = None
+
+    def __init__(self, api=None):
+        if api is not None:
+            self.api = api
+        if self.name is None:
+            self.name = self.__class__.__name__
+
+
+class CallbackCommand(Command):
+    """A command of user/group taking registered pre/post callbacks."""
+
+    @classmethod
+    def register_pre_callback(cls, callback):
+        cls.pre_callbacks = cls.__dict__.get('pre_callbacks', []) + [callback]
+
+    @classmethod
+    def register_post_callback(cls, callback):
+        cls.post_callbacks = cls.__dict__.get('post_callbacks', []) + [callback]
+
+    @classmethod
+    def register_exc_callback(cls, callback):
+        cls.exc_callbacks = cls.__dict__.get('exc_callbacks', []) + [callback]
+
+
+class Object(object):
+    takes_params = ()
+
+
+class Messages(object):
+    messages = {'actions': {}}
+
+
+class Registry(object):
+
+    def __call__(self):
+        return lambda cls: cls
+
+
+class DN(tuple):
+    """Comma joined RDNs; DN('cn=users', 'dc=x') == DN('cn=users,dc=x')."""
+
+    def __new__(cls, *parts):
+        rdns = []
+        for part in parts:
+            if isinstance(part, DN):
+                rdns.extend(part)
+            elif part:
+                rdns.extend(p.strip().lower() for p in u'{0}'.format(part).split(','))
+        return tuple.__new__(cls, rdns)
+
+    def __str__(self):
+        return ','.join(self)
+
+    __unicode__ = __str__
+
+    def __format__(self, spec):
+        return format(str(self), spec)
+
+
+def _module(name, **attrs):
+    module = types.ModuleType(name)
+    module.__dict__.update(attrs)
+    sys.modules[name] = module
+    return module
+
+
+def _plugin(name, *commands):
+    """ipalib.plugins.<name> with an object and its callback commands."""
+    attrs = {name: type(name, (Object,), {})}
+    for command in commands:
+        command = '{0}_{1}'.format(name, command)
+        attrs[command] = type(command, (CallbackCommand,), {})
+    return _module('ipalib.plugins.' + name, **attrs)
+
+
+def install():
+    """Register the stubs in sys.modules unless ipalib is installed.
+
+    Returns True if the stubs are in use.
+    """
+    if 'ipalib' in sys.modules:
+        return getattr(sys.modules['ipalib'], 'STUB', False)
+    try:
+        import ipalib  # noqa: F401
+        return False
+    except ImportError:
+        pass
+
+    errors = _module(
+        'ipalib.errors', PublicError=PublicError, NotFound=NotFound,
+        EmptyModlist=EmptyModlist, LimitsExceeded=LimitsExceeded,
+        DuplicateEntry=DuplicateEntry, DatabaseError=DatabaseError,
+        ValidationError=ValidationError)
+    output = _module(
+        'ipalib.output', Output=Output,
+        summary=Output('summary'), standard_value=(),
+        standard_list_of_entries=())
+    user = _plugin('user', 'add', 'mod')
+    group = _plugin('group', 'add', 'mod')
+    plugins = _module('ipalib.plugins', user=user, group=group)
+    _module('ipalib.plugins.baseldap', LDAPQuery=Command,
+            pkey_to_value=lambda key, options: key)
+    _module('ipalib.plugins.internal', i18n_messages=Messages)
+    _module('ipalib.parameters', Str=Param, Int=Param, Flag=Param)
+    _module('ipalib.plugable', Registry=Registry)
+    _module('ipalib.request', context=threading.local())
+    _module('ipalib', STUB=True, errors=errors, output=output,
+            plugins=plugins, Command=Command,
+            _=lambda message: message,
+            ngettext=lambda singular, plural, n: plural)
+    _module('ipapython')
+    _module('ipapython.dn', DN=DN)
+    return True
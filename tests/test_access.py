@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+
+import datetime
+
+from ipalib_rfiddoorcontrol.access import (
+        FOREVER,
+        AccessChangeManager,
+        is_active,
+        parse_accesses,
+    )
+
+
+def test_free_form_case_change_is_unchanged():
+    acm = AccessChangeManager([u'lab-3: foo bar'], [u'lab-3: FOO bar'])
+    assert not acm.changed()
+    assert acm.diff() == []
+    assert list(acm.get_access()) == [u'lab-3: foo bar']
+
+
+def test_free_form_text_change_is_changed():
+    acm = AccessChangeManager([u'lab-3: foo bar'], [u'lab-3: foo baz'])
+    assert acm.changed()
+    assert acm.diff() == [(u'lab-3', u'lab-3: foo bar', u'lab-3: foo baz')]
+
+
+def test_respelled_grants_are_unchanged():
+    acm = AccessChangeManager([u'Lab-3: 2030-01-01', u'hall'],
+                              [u'hall;lab-3: 2030-01-01T00:00:00'])
+    assert not acm.changed()
+    assert acm.diff() == []
+
+
+SATURDAY = datetime.datetime(2026, 10, 17, 12, 0)
+MONDAY = datetime.datetime(2026, 10, 19, 12, 0)
+
+
+def grants(values):
+    return dict(parse_accesses(values))
+
+
+def test_grants_with_different_windows_are_kept():
+    values = [u'lab-3: 2027-01-31', u'lab-3: Mon-Fri 07:00-19:00']
+    acm = AccessChangeManager([], values)
+    assert list(acm.get_access()) == [u'lab-3: 2027-01-31',
+                                      u'lab-3: Mon-Fri 07:00-19:00']
+    excs = grants(values)[u'lab-3']
+    assert any(is_active(exc, SATURDAY) for exc in excs)
+    assert not any(is_active(exc, datetime.datetime(2027, 2, 6, 12, 0))
+                   for exc in excs)
+    assert any(is_active(exc, datetime.datetime(2027, 2, 8, 12, 0))
+               for exc in excs)
+
+
+def test_covered_grants_are_dropped():
+    assert grants([u'lab-3: 2026-01-01', u'lab-3: 2027-01-31',
+                   u'lab-3: Mon 08:00-12:00 until 2026-06-30',
+                   u'lab-3: disabled'])[u'lab-3'] == \
+        (datetime.datetime(2027, 1, 31),)
+    assert grants([u'lab-3', u'lab-3: Mon-Fri 07:00-19:00'])[u'lab-3'] == \
+        (FOREVER,)
+    assert grants([u'lab-3: Mon-Fri 07:00-19:00',
+                   u'lab-3: Mon 08:00-09:00 until 2027-01-31'])[u'lab-3'] == \
+        grants([u'lab-3: Mon-Fri 07:00-19:00'])[u'lab-3']
+
+
+def test_grants_expiring_together_are_merged():
+    acm = AccessChangeManager([], [u'lab-3: Mon 08:00-12:00 until 2027-01-31',
+                                   u'lab-3: Sat 09:00-12:00 until 2027-01-31'])
+    assert list(acm.get_access()) == [
+        u'lab-3: Mon 08:00-12:00 Sat 09:00-12:00 until 2027-01-31']
+
+
+def test_expire_keeps_the_other_grants():
+    old = [u'lab-3: 2026-06-30', u'lab-3: Sat 07:00-19:00 until 2027-01-31']
+    acm = AccessChangeManager(old, old)
+    assert acm.expire(SATURDAY) == (1, 0)
+    assert list(acm.get_access()) == [u'lab-3: Sat 07:00-19:00 until 2027-01-31']
+    assert acm.diff() == [(u'lab-3', u'lab-3: 2026-06-30; '
+                           u'lab-3: Sat 07:00-19:00 until 2027-01-31',
+                           u'lab-3: Sat 07:00-19:00 until 2027-01-31')]
+    acm.expire(datetime.datetime(2027, 2, 1))
+    assert list(acm.get_access()) == [u'lab-3: disabled']
+
+
+def test_user_mod_keeps_unchanged_multiple_grants():
+    old = [u'lab-3: 2027-01-31', u'lab-3: Mon-Fri 07:00-19:00']
+    acm = AccessChangeManager(old, list(reversed(old)))
+    assert not acm.changed()
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+
+from ipalib_rfiddoorcontrol import audit
+
+
+def record(target, door, when=1790000000.0):
+    return dict(time=when, actor=u'admin@EXAMPLE.ORG', command=u'user_mod',
+                target=target, changes=[[door, None, door]])
+
+
+def test_read_filters_non_ascii(tmpdir):
+    audit.AuditLog(str(tmpdir)).write([record(u'j\xfcrg', u't\xfcr'),
+                                       record(u'jdoe', u'hall')])
+    with open(str(tmpdir.join(audit.LOG_NAME)), 'rb') as fh:
+        assert u'j\xfcrg'.encode('utf-8') in fh.read()
+    assert [r['target'] for r in audit.read(str(tmpdir),
+                                            target=u'j\xfcrg')] == [u'j\xfcrg']
+    assert [r['target'] for r in audit.read(str(tmpdir),
+                                            door=u'T\xdcR')] == [u'j\xfcrg']
+
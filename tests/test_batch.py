@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from fakeldap import FakeAPI, FakeEntry, FakeLDAP
+
+from ipalib import errors
+from ipalib_rfiddoorcontrol import rfiddoorcontrol
+
+
+USERS_DN = u'cn=users,cn=accounts,dc=example,dc=org'
+
+
+@pytest.fixture
+def ldap():
+    ldap = FakeLDAP(size_limit=100)
+    for i in range(2000):
+        uid = u's{0:04d}'.format(i)
+        ldap.add_entry(FakeEntry(u'uid={0},{1}'.format(uid, USERS_DN),
+                                 uid=[uid], objectclass=['person']))
+    return ldap
+
+
+def test_find_user_entries_ignores_search_limits(ldap):
+    uids = [u'S{0:04d}'.format(i) for i in range(0, 2000, 2)] + [u'nobody']
+    entries = rfiddoorcontrol.find_user_entries(FakeAPI(ldap), ldap, uids,
+                                                ['objectclass'])
+    assert len(entries) == 1000
+    assert entries[u's0002']['uid'] == [u's0002']
+    assert ldap.calls['find_entries'] == 2
+
+
+def test_find_user_entries_truncated(ldap):
+    def find_entries(**kw):
+        assert (kw['size_limit'], kw['time_limit']) == (0, 0)
+        return [], True
+    ldap.find_entries = find_entries
+    with pytest.raises(errors.LimitsExceeded):
+        rfiddoorcontrol.find_user_entries(FakeAPI(ldap), ldap, [u's0001'], [])
+
+
+def test_addrfid_batch(ldap):
+    command = rfiddoorcontrol.user_addrfid_batch(FakeAPI(ldap))
+    uids = [u's{0:04d}'.format(i) for i in range(2000)] + [u'nobody']
+    result = command.execute(uids, rfiddooraccess=[u'lab-3'])
+    assert result['completed'] == 2000
+    assert list(result['failed']) == [u'nobody']
+    entry = ldap.entries[u'uid=s1999,' + USERS_DN]
+    assert 'rfidDoorControl' in entry['objectclass']
+    assert entry['rfiddooraccess'] == [u'lab-3']
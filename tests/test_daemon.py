@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'tools'))
+
+import rfiddoord
+
+from ipalib_rfiddoorcontrol.snapshot import compile_grants, write_snapshot
+
+from test_snapshot import (  # noqa: F401
+        LATE_MONDAY,
+        LATE_SATURDAY,
+        SATURDAY,
+        epoch,
+        snapshot,
+    )
+
+
+@pytest.mark.parametrize('now, answer', [
+    (SATURDAY, 'ALLOW {0:d}\n'.format(int(epoch(2027, 1, 31, 0, 0, 0)))),
+    (LATE_SATURDAY, 'DENY\n'),
+    (LATE_MONDAY, 'ALLOW {0:d}\n'.format(2 ** 63 - 1)),
+])
+def test_answers_from_any_grant(snapshot, monkeypatch, now, answer):
+    server = rfiddoord.DoorDecisionServer(*snapshot)
+    server.reload()
+    monkeypatch.setattr(rfiddoord.time, 'time', lambda: now)
+    assert server.answer(b'CHECK 04a1b2c3 lab-3\n') == answer.encode('ascii')
+    assert server.answer(b'CHECK 0A0B0C0D lab-3\n') == b'DENY\n'
+    assert server.answer(b'CHECK 04A1B2C3 attic\n') == b'ERR unknown door\n'
+
+
+def test_protocol(snapshot):
+    server = rfiddoord.DoorDecisionServer(*snapshot)
+    server.reload()
+    assert server.answer(b'PING\r\n') == b'PONG\n'
+    assert server.answer(b'CHECK 04A1B2C3\n') == b'ERR bad request\n'
+    assert server.answer(b'\xff\n') == b'ERR bad request\n'
+    assert server.requests == 3
+
+
+def test_doors_not_in_the_door_list_are_unknown(snapshot):
+    path, doorlist = snapshot
+    with open(doorlist, 'w') as fh:
+        fh.write('hall\n')
+    server = rfiddoord.DoorDecisionServer(path, doorlist)
+    server.reload()
+    assert server.answer(b'CHECK 04A1B2C3 lab-3\n') == b'ERR unknown door\n'
+    assert server.answer(b'CHECK 04A1B2C3 hall\n') == b'DENY\n'
+
+
+def write(path, key):
+    grants, doors = compile_grants([(key, [u'hall'])], [u'lab-3', u'hall'])
+    write_snapshot(path, grants, doors)
+
+
+async def until(condition, timeout=5.0):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not condition():
+        assert loop.time() < deadline
+        await asyncio.sleep(0.005)
+
+
+def run_watching(server, scenario):
+    async def main():
+        watch = asyncio.ensure_future(server.watch())
+        try:
+            await scenario()
+        finally:
+            watch.cancel()
+    asyncio.run(main())
+
+
+def test_watch_reloads_a_changed_snapshot(snapshot):
+    server = rfiddoord.DoorDecisionServer(*snapshot, interval=0.01)
+    server.reload()
+
+    async def scenario():
+        write(snapshot[0], u'0A0B0C0D')
+        await until(lambda: server.answer(b'CHECK 0A0B0C0D hall\n') != b'DENY\n')
+    run_watching(server, scenario)
+    assert server.answer(b'CHECK 04A1B2C3 lab-3\n') == b'DENY\n'
+
+
+def test_watch_backs_off_and_reports_once(snapshot, monkeypatch, capsys):
+    server = rfiddoord.DoorDecisionServer(*snapshot, interval=0.01,
+                                          max_retry_interval=0.08)
+    server.reload()
+    loads = []
+    load = rfiddoord.AccessIndex.load
+
+    def counting_load(*args):
+        loads.append(args)
+        return load(*args)
+    monkeypatch.setattr(rfiddoord.AccessIndex, 'load', counting_load)
+
+    async def scenario():
+        with open(snapshot[0], 'wb') as fh:
+            fh.write(b'garbage')
+        await asyncio.sleep(0.5)
+        # ~50 intervals, retried after 0.01, 0.02, 0.04, then every 0.08
+        assert 3 <= len(loads) <= 12
+        write(snapshot[0], u'0A0B0C0D')
+        await until(lambda: server.answer(b'CHECK 0A0B0C0D hall\n') != b'DENY\n',
+                    timeout=1.0)
+    run_watching(server, scenario)
+    # the old index was served meanwhile
+    err = capsys.readouterr().err
+    assert err.count('reload failed') == 1
+    assert 'reloaded' in err
+
+
+def test_serve_pipelined_requests(snapshot, tmpdir):
+    path = str(tmpdir.join('rfiddoord.sock'))
+    server = rfiddoord.DoorDecisionServer(*snapshot, interval=0.01)
+
+    async def main():
+        serve = asyncio.ensure_future(server.serve(path=path))
+        try:
+            await until(lambda: os.path.exists(path))
+            reader, writer = await asyncio.open_unix_connection(path)
+            writer.write(b'PING\nCHECK 0A0B0C0D lab-3\nCHECK 04A1B2C3 attic\n')
+            answers = [await reader.readline() for _ in range(3)]
+            writer.close()
+        finally:
+            serve.cancel()
+        return answers
+    assert asyncio.run(main()) == [b'PONG\n', b'DENY\n', b'ERR unknown door\n']
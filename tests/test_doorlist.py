@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+from ipalib_rfiddoorcontrol import doorlist, metrics
+
+
+def rewrite(path, doors, mtime):
+    with open(path, 'wb') as fh:
+        fh.write(u''.join(door + u'\n' for door in doors).encode('utf-8'))
+    os.utime(path, (mtime, mtime))
+
+
+def test_door_list():
+    doors = doorlist.DoorList([u'Lab-3', u'hall', u'lab-3'])
+    assert doors.doors == (u'Lab-3', u'hall')
+    assert u'LAB-3' in doors and u'attic' not in doors
+    assert (doors.door_id(u'hall'), doors.door_id(u'attic')) == (1, None)
+
+
+def test_load_skips_comments(tmpdir):
+    path = tmpdir.join('doorlist.txt')
+    path.write_text(u'# doors\nlab-3\n\n  hall  \n', 'utf-8')
+    assert list(doorlist.DoorList.load(str(path))) == [u'lab-3', u'hall']
+
+
+def test_registry_reloads_on_change(doors, stats):
+    registry = doorlist.registry
+    first = doorlist.known_doors()
+    assert tuple(first) == doors
+    assert doorlist.known_doors() is first
+    counters = metrics.snapshot()
+    assert (counters['doorlist.miss'], counters['doorlist.hit']) == (1, 1)
+
+    rewrite(registry.path, (u'hall', u'attic'), 1700000000)
+    second = doorlist.known_doors()
+    assert list(second) == [u'hall', u'attic']
+    assert second.digest != first.digest
+    assert metrics.snapshot()['doorlist.miss'] == 2
+
+
+def test_registry_digest_follows_the_doors(doors, stats):
+    first = doorlist.known_doors()
+    # same doors, new mtime: reloaded, same digest
+    rewrite(doorlist.registry.path, doors, 1700000000)
+    second = doorlist.known_doors()
+    assert second is not first
+    assert second.digest == first.digest
+
+
+def test_registry_stale_during_reload(doors, stats):
+    registry = doorlist.registry
+    first = doorlist.known_doors()
+    rewrite(registry.path, (u'hall',), 1700000000)
+    # another worker is reloading: keep the previous list
+    with registry._lock:
+        assert doorlist.known_doors() is first
+    assert metrics.snapshot()['doorlist.stale'] == 1
+    assert list(doorlist.known_doors()) == [u'hall']
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+import pytest
+
+from fakeldap import FakeEntry, FakeLDAP
+
+from ipalib_rfiddoorcontrol import rfiddoorcontrol
+from ipalib_rfiddoorcontrol.export import full_export, incremental_export
+from ipalib_rfiddoorcontrol.snapshot import Snapshot
+
+
+BASE_DN = u'cn=users,cn=accounts,dc=example,dc=org'
+NOW = 1790000000  # 2026-09-21
+
+
+def user_dn(uid):
+    return u'uid={0},{1}'.format(uid, BASE_DN)
+
+
+def add_user(ldap, uid, keys, access, ts='20261001000000Z', rfid=True):
+    ldap.add_entry(FakeEntry(
+        user_dn(uid), uid=[uid],
+        objectclass=['person'] + (['rfidDoorControl'] if rfid else []),
+        rfidkey=keys, rfiddooraccess=access, modifytimestamp=[ts]))
+
+
+class UserObject(object):
+
+    def __init__(self, ldap):
+        self.backend = ldap
+
+    def get_dn(self, uid, **options):
+        return user_dn(uid)
+
+
+@pytest.fixture
+def paths(tmpdir):
+    doorlist = tmpdir.join('doorlist.txt')
+    doorlist.write('lab-3\nhall\n')
+    return (str(tmpdir.join('access.snap')), str(doorlist),
+            str(tmpdir.join('access.snap.state')))
+
+
+@pytest.fixture
+def ldap():
+    # bob holds the high-water mark, so every incremental run re-reads
+    # him within WATERMARK_OVERLAP
+    ldap = FakeLDAP()
+    add_user(ldap, 'alice', ['04A1B2C3'], ['lab-3'])
+    add_user(ldap, 'bob', ['0A0B0C0D'], ['hall: 2099-12-31', 'lab-3'],
+             ts='20261001120000Z')
+    return ldap
+
+
+def export(ldap, paths, incremental=True):
+    output, doorlist, state = paths
+    run = incremental_export if incremental else full_export
+    result = run(ldap, BASE_DN, output, doorlist, state)
+    with Snapshot(output) as snap:
+        return result, dict(snap)
+
+
+def test_full_export(ldap, paths):
+    result, keys = export(ldap, paths, incremental=False)
+    assert sorted(keys) == ['04A1B2C3', '0A0B0C0D']
+    assert (result['users'], result['changed'], result['removed']) == (2, 2, 0)
+
+
+def test_full_export_ignores_search_limits(paths):
+    ldap = FakeLDAP(size_limit=100)
+    for i in range(250):
+        add_user(ldap, 'u{0:03d}'.format(i), ['{0:08X}'.format(i + 1)],
+                 ['lab-3'])
+    result, keys = export(ldap, paths, incremental=False)
+    assert result['users'] == len(keys) == 250
+
+
+def test_incremental_without_state_is_full(ldap, paths):
+    result, keys = export(ldap, paths)
+    assert sorted(keys) == ['04A1B2C3', '0A0B0C0D']
+    assert os.path.exists(paths[2])
+
+
+def test_incremental_only_fetches_modified_users(ldap, paths):
+    export(ldap, paths)
+    add_user(ldap, 'carol', ['0C0C0C0C'], ['hall'], ts='20261002120000Z')
+    searches = []
+    find_entries = ldap.find_entries
+
+    def spy(**kw):
+        searches.append(kw['filter'])
+        return find_entries(**kw)
+    ldap.find_entries = spy
+
+    result, keys = export(ldap, paths)
+    assert '(modifyTimestamp>=20261001115500Z)' in searches
+    assert sorted(keys) == ['04A1B2C3', '0A0B0C0D', '0C0C0C0C']
+    assert (result['changed'], result['removed']) == (2, 0)
+
+    searches[:] = []
+    result, keys = export(ldap, paths)
+    assert '(modifyTimestamp>=20261002115500Z)' in searches
+    assert (result['changed'], result['removed']) == (1, 0)
+
+
+def test_incremental_changed_grant(ldap, paths):
+    output = paths[0]
+    export(ldap, paths)
+    entry = ldap.entries[user_dn('alice')]
+    entry['rfiddooraccess'] = ['lab-3: disabled', 'hall']
+    entry['modifytimestamp'] = ['20261002120000Z']
+
+    result, keys = export(ldap, paths)
+    assert result['changed'] == 2
+    with Snapshot(output) as snap:
+        assert not snap.check('04A1B2C3', 'lab-3', NOW)
+        assert snap.check('04A1B2C3', 'hall', NOW)
+        assert snap.check('0A0B0C0D', 'lab-3', NOW)
+
+
+def test_incremental_delrfid_is_removed(ldap, paths):
+    output = paths[0]
+    export(ldap, paths)
+    command = rfiddoorcontrol.user_delrfid()
+    command.obj = UserObject(ldap)
+    command.execute(u'bob')
+    ldap.entries[user_dn('bob')]['modifytimestamp'] = ['20261002120000Z']
+
+    result, keys = export(ldap, paths)
+    assert (result['changed'], result['removed']) == (0, 1)
+    assert 'rfidkey' not in ldap.entries[user_dn('bob')]
+    assert sorted(keys) == ['04A1B2C3']
+    with Snapshot(output) as snap:
+        assert not snap.check('0A0B0C0D', 'hall', NOW)
+        assert snap.check('04A1B2C3', 'lab-3', NOW)
+
+
+def test_incremental_deleted_user_is_removed(ldap, paths):
+    export(ldap, paths)
+    ldap.delete_entry(user_dn('alice'))
+
+    result, keys = export(ldap, paths)
+    assert result['removed'] == 1
+    assert sorted(keys) == ['0A0B0C0D']
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from fakeldap import FakeEntry, FakeLDAP
+
+from ipalib_rfiddoorcontrol.commands import migrate_keys
+from ipalib_rfiddoorcontrol.keys import normalize_key, normalize_stored
+from ipalib_rfiddoorcontrol.snapshot import (
+        compile_grants,
+        write_snapshot,
+        Snapshot,
+    )
+
+
+USERS_DN = u'cn=users,cn=accounts,dc=example,dc=org'
+
+
+@pytest.mark.parametrize('key', [
+    u'04a1b2c3', u'04:A1:B2:C3', u'0x4A1B2C3', u' 04-a1-b2-c3 ',
+    u'#0077705923', u'# 0077705923',
+])
+def test_normalize_key(key):
+    assert normalize_key(key) == u'04A1B2C3'
+
+
+def test_ten_digits_are_hex():
+    # a 5 byte EM4100 ID, not the decimal form of 0614E3C5
+    assert normalize_key(u'0102030405') == u'0102030405'
+
+
+@pytest.mark.parametrize('key, canonical', [
+    (u'0004a1b2c3', u'0004A1B2C3'),
+    (u'00:04:A1:B2:C3', u'0004A1B2C3'),
+    (u'000000', u'000000'),
+    (u'0x004A1B2C3', u'0004A1B2C3'),
+    (u'#0', u'00'),
+])
+def test_leading_zeros_are_kept(key, canonical):
+    assert normalize_key(key) == canonical
+    assert normalize_key(key) != normalize_key(u'04A1B2C3')
+
+
+@pytest.mark.parametrize('key', [u'', u'#', u'04G1', u'#04A1', u'0x'])
+def test_invalid_key(key):
+    with pytest.raises(ValueError):
+        normalize_key(key)
+
+
+def test_normalize_stored():
+    assert normalize_stored([u'04:a1:b2:c3', u'junk', u'04A1B2C3']) == \
+        ([u'04A1B2C3', u'junk'], [u'junk'])
+    assert normalize_stored([u'0077705923'])[0] == [u'0077705923']
+    assert normalize_stored([u'0077705923'], decimal=True)[0] == [u'04A1B2C3']
+
+
+def test_snapshot_canonicalizes_every_key_type(tmpdir):
+    path = str(tmpdir.join('access.snap'))
+    grants, doors = compile_grants([(u'04A1B2C3', [u'lab-3'])], [u'lab-3'])
+    write_snapshot(path, grants, doors)
+    with Snapshot(path) as snap:
+        for key in (u'04:a1:b2:c3', b'04:a1:b2:c3', '04a1b2c3', u'0x4A1B2C3'):
+            assert snap.check(key, u'lab-3')
+
+
+def test_migrate_keys():
+    ldap = FakeLDAP()
+    for uid, keys in ((u'alice', [u'04:a1:b2:c3']), (u'bob', [u'0A0B0C0D']),
+                      (u'carol', [u'0077705923', u'bad key'])):
+        ldap.add_entry(FakeEntry(u'uid={0},{1}'.format(uid, USERS_DN),
+                                 uid=[uid], rfidkey=keys))
+
+    changed, invalid = migrate_keys(ldap, USERS_DN, decimal=True, dry_run=True)
+    assert changed == [
+        (u'alice', [u'04:a1:b2:c3'], [u'04A1B2C3']),
+        (u'carol', [u'0077705923', u'bad key'], [u'04A1B2C3', u'bad key']),
+    ]
+    assert invalid == [(u'carol', u'bad key')]
+    assert ldap.calls['update_entry'] == 0
+
+    migrate_keys(ldap, USERS_DN, decimal=True)
+    assert ldap.entries[u'uid=alice,' + USERS_DN]['rfidkey'] == [u'04A1B2C3']
+    assert ldap.entries[u'uid=bob,' + USERS_DN]['rfidkey'] == [u'0A0B0C0D']
+    assert migrate_keys(ldap, USERS_DN, decimal=True)[0] == []
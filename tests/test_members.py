@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from fakeldap import FakeAPI, FakeEntry, FakeLDAP
+
+from ipalib_rfiddoorcontrol import rfiddoorcontrol
+
+
+USERS_DN = u'cn=users,cn=accounts,dc=example,dc=org'
+GROUPS_DN = u'cn=groups,cn=accounts,dc=example,dc=org'
+STAFF = u'cn=staff,' + GROUPS_DN
+ALUMNI = u'cn=alumni,' + GROUPS_DN
+
+
+def add_user(ldap, uid, access=(), memberof=(), rfid=True):
+    ldap.add_entry(FakeEntry(
+        u'uid={0},{1}'.format(uid, USERS_DN), uid=[uid],
+        objectclass=['person'] + (['rfidDoorControl'] if rfid else []),
+        rfiddooraccess=list(access), memberof=list(memberof)))
+
+
+def add_group(ldap, dn, access):
+    ldap.add_entry(FakeEntry(dn, cn=[dn[3:dn.index(',')]],
+                             objectclass=['groupOfNames', 'rfidDoorControl'],
+                             rfiddooraccess=list(access)))
+
+
+@pytest.fixture
+def ldap():
+    ldap = FakeLDAP()
+    add_group(ldap, STAFF, [u'lab-3: 2099-12-31'])
+    add_group(ldap, ALUMNI, [u'lab-3: 2001-01-01'])
+    add_user(ldap, u'alice', [u'lab-3'])
+    add_user(ldap, u'bob', [u'Lab-3: 2099-12-31', u'hall'])
+    add_user(ldap, u'carol', [u'lab-3: 2001-01-01'])
+    add_user(ldap, u'dave', [u'lab-3: disabled'])
+    add_user(ldap, u'erin', [u'hall'], memberof=[STAFF])
+    add_user(ldap, u'frank', [], memberof=[ALUMNI])
+    add_user(ldap, u'grace', [u'lab-30'])
+    add_user(ldap, u'heidi', [u'lab-3: someday'])
+    return ldap
+
+
+def members(ldap, door, **options):
+    command = rfiddoorcontrol.rfiddoor_members(FakeAPI(ldap))
+    return command.execute(door, **options)
+
+
+def test_direct_group_and_expired_grants(ldap):
+    result = members(ldap, u'Lab-3')
+    assert dict((r['uid'][0], r['rfiddooraccess']) for r in result['result']) == {
+        u'alice': [u'lab-3'],
+        u'bob': [u'lab-3: 2099-12-31'],
+        u'erin': [u'lab-3: 2099-12-31'],
+    }
+    assert (result['count'], result['truncated']) == (3, False)
+
+
+def test_other_doors(ldap):
+    assert sorted(r['uid'][0] for r in members(ldap, u'hall')['result']) == \
+        [u'bob', u'erin']
+    assert members(ldap, u'attic')['count'] == 0
+
+
+def test_filters_are_indexable(ldap):
+    searches = []
+    find_entries = ldap.find_entries
+
+    def spy(**kw):
+        searches.append(kw['filter'])
+        return find_entries(**kw)
+    ldap.find_entries = spy
+    members(ldap, u'lab-3')
+    assert '(rfidDoorAccess=lab-3)(rfidDoorAccess=lab-3:*)' in searches[0]
+    assert '*lab-3' not in ''.join(searches)
+    assert u'(memberOf={0})'.format(STAFF) in searches[1]
+    assert ALUMNI not in searches[1]
+
+
+def test_size_limit(ldap):
+    result = members(ldap, u'lab-3', sizelimit=2)
+    assert result['truncated']
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import time
+
+import pytest
+
+from fakeldap import FakeLDAP
+
+from ipalib_rfiddoorcontrol import commands, metrics
+
+
+def test_disabled_is_a_no_op(monkeypatch):
+    monkeypatch.setattr(metrics, 'enabled', False)
+    metrics.reset()
+    ldap = FakeLDAP()
+    assert metrics.counting(ldap, 'user_mod') is ldap
+    metrics.incr('x')
+    metrics.observe('y', 0.1)
+    assert metrics.snapshot() == {}
+
+    def func():
+        pass
+    assert metrics.timed('func')(func) is func
+
+
+def test_counting_ldap(stats):
+    ldap = metrics.counting(FakeLDAP(), 'user_mod')
+    assert metrics.counting(ldap, 'other') is ldap
+    ldap.add_entry(type('Entry', (dict,), dict(dn=u'uid=a'))())
+    ldap.get_entry(u'uid=a')
+    ldap.get_entry(u'uid=a')
+    assert ldap.size_limit == 100
+    assert metrics.snapshot() == {'user_mod.ldap.add_entry': 1,
+                                  'user_mod.ldap.get_entry': 2}
+
+
+def test_flush_file_per_process_start(stats):
+    metrics.incr('x')
+    metrics.flush()
+    names = os.listdir(stats)
+    assert len(names) == 1
+    pid, start = names[0][:-len('.json')].split('-')
+    assert int(pid) == os.getpid()
+    with open(os.path.join(stats, names[0])) as fh:
+        assert json.load(fh)['counters'] == {'x': 1}
+
+    # a later process with the same pid
+    time.sleep(0.002)
+    metrics._flusher_pid = None
+    metrics.incr('x')
+    metrics.flush()
+    assert len(os.listdir(stats)) == 2
+
+
+def write(stats_dir, name, counters, histograms):
+    with open(os.path.join(stats_dir, name), 'w') as fh:
+        json.dump(dict(counters=counters, histograms=histograms), fh)
+
+
+def hist(total, *buckets):
+    buckets = list(buckets) + [0] * (len(metrics.BUCKETS) + 1 - len(buckets))
+    return dict(sum=total, buckets=buckets)
+
+
+def test_load_sums_processes(tmpdir):
+    stats_dir = tmpdir.mkdir('stats')
+    write(str(stats_dir), '1-1.json', {'a': 1, 'b': 2}, {'h': hist(0.5, 1, 2)})
+    write(str(stats_dir), '2-1.json', {'a': 3}, {'h': hist(0.25, 0, 1, 1),
+                                                 'g': hist(1.0, 1)})
+    stats_dir.join('3-1.json').write('{"counters": ')
+    stats_dir.join('4-1.json.tmp').write('{}')
+    stats_dir = str(stats_dir)
+    counters, histograms, processes = metrics.load(stats_dir)
+    assert processes == 2
+    assert counters == {'a': 4, 'b': 2}
+    assert histograms['h'] == hist(0.75, 1, 3, 1)
+    assert sorted(histograms) == ['g', 'h']
+
+    metrics.clear(stats_dir)
+    assert os.listdir(stats_dir) == ['4-1.json.tmp']
+
+
+def test_percentile():
+    assert metrics.percentile(hist(0.0), 50) is None
+    h = hist(1.0, 50, 40, 9, 1)
+    assert metrics.percentile(h, 50) == metrics.BUCKETS[0]
+    assert metrics.percentile(h, 90) == metrics.BUCKETS[1]
+    assert metrics.percentile(h, 99) == metrics.BUCKETS[2]
+    assert metrics.percentile(h, 100) == metrics.BUCKETS[3]
+    overflow = hist(10.0, *([0] * len(metrics.BUCKETS) + [1]))
+    assert metrics.percentile(overflow, 50) == float('inf')
+
+
+def test_observe_buckets(stats):
+    metrics.observe('h', 0.0001)
+    metrics.observe('h', 0.0003)
+    metrics.observe('h', 10.0)
+    h = metrics.histograms['h']
+    assert h['buckets'][:3] == [1, 0, 1]
+    assert h['buckets'][-1] == 1
+    assert h['sum'] == pytest.approx(10.0004)
+    assert metrics.snapshot()['h.calls'] == 3
+
+
+def test_stats_command(tmpdir, capsys):
+    stats_dir = str(tmpdir.mkdir('stats'))
+    write(stats_dir, '1-1.json', {'user_mod.ldap.get_entry': 7},
+          {'user_mod.precallback': hist(0.002, 0, 0, 0, 2)})
+    assert commands.rfiddoorctl(['stats', '-d', stats_dir]) == 0
+    out = capsys.readouterr().out
+    assert '1 processes' in out
+    assert 'user_mod.ldap.get_entry' in out
+    line = [l for l in out.splitlines() if l.startswith('user_mod.precallback')]
+    assert line[0].split()[1:] == ['2', '1.000', '1', '1']
+
+    assert commands.rfiddoorctl(['stats', '-d', stats_dir, '--reset']) == 0
+    assert os.listdir(stats_dir) == []
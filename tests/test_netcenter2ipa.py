@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+
+import collections
+import io
+import os
+import sys
+
+import pytest
+
+pytest.importorskip('lxml')
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'tools'))
+
+from ipalib import errors
+
+import netcenter2ipa
+from netcenter2ipa import ZoneReconciler
+
+
+class FakeCommand(object):
+    """api.Command with dnsrecord_find and batch, counting the calls."""
+
+    def __init__(self, zones, fail_batches=()):
+        self.zones = zones
+        self.fail_batches = fail_batches
+        self.calls = collections.Counter()
+        self.added = {}
+
+    def dnsrecord_find(self, zone, sizelimit=None, timelimit=None):
+        self.calls['dnsrecord_find'] += 1
+        assert (sizelimit, timelimit) == (0, 0)
+        if zone not in self.zones:
+            raise errors.NotFound(message=u'{0}: DNS zone not found'.format(zone))
+        return dict(result=[dict(idnsname=[name], **records)
+                            for name, records in self.zones[zone].items()])
+
+    def batch(self, *methods):
+        self.calls['batch'] += 1
+        if self.calls['batch'] in self.fail_batches:
+            raise errors.PublicError(message=u'connection reset')
+        for method in methods:
+            assert method['method'] == 'dnsrecord_add'
+            (zone, name), records = method['params']
+            self.added[(zone, name)] = records
+        return dict(results=[dict(error=None) for method in methods])
+
+
+def host(i):
+    return u'pc{0:03d}'.format(i), (u'10.0.{0:d}.{1:d}'.format(*divmod(i, 256)), None)
+
+
+def test_one_find_per_zone_and_existing_records():
+    command = FakeCommand({
+        u'a.example.org.': {u'pc000': dict(arecord=[u'10.0.0.0'])},
+        u'b.example.org.': {},
+    })
+    reconciler = ZoneReconciler(command)
+    for zone in (u'a.example.org.', u'b.example.org.'):
+        for i in range(50):
+            reconciler.reconcile(zone, *host(i))
+    added, failed = reconciler.flush()
+
+    assert command.calls['dnsrecord_find'] == 2
+    assert (added, failed) == (99, 0)
+    assert (u'a.example.org.', u'pc000') not in command.added
+    assert command.added[(u'b.example.org.', u'pc000')] == dict(arecord=[u'10.0.0.0'])
+
+
+def test_one_batch_per_batch_size_names():
+    command = FakeCommand({u'a.example.org.': {}})
+    reconciler = ZoneReconciler(command)
+    names = 2 * ZoneReconciler.BATCH_SIZE + 50
+    for i in range(names):
+        reconciler.reconcile(u'a.example.org.', *host(i))
+    added, failed = reconciler.flush()
+
+    assert command.calls['batch'] == 3
+    assert (added, failed) == (names, 0)
+    assert reconciler.calls == 4
+
+
+def test_missing_zone_is_skipped():
+    command = FakeCommand({u'a.example.org.': {}})
+    reconciler = ZoneReconciler(command)
+    for zone in (u'missing.example.org.', u'a.example.org.'):
+        for i in range(3):
+            reconciler.reconcile(zone, *host(i))
+    added, failed = reconciler.flush()
+
+    assert command.calls['dnsrecord_find'] == 2
+    assert list(reconciler.errors) == [u'missing.example.org.']
+    assert reconciler.skipped == 3
+    assert (added, failed) == (3, 0)
+
+
+def test_failing_batch_only_fails_its_chunk():
+    command = FakeCommand({u'a.example.org.': {}, u'b.example.org.': {}},
+                          fail_batches=(1,))
+    reconciler = ZoneReconciler(command)
+    for zone in (u'a.example.org.', u'b.example.org.'):
+        for i in range(ZoneReconciler.BATCH_SIZE + 1):
+            reconciler.reconcile(zone, *host(i))
+    added, failed = reconciler.flush()
+
+    assert command.calls['batch'] == 4
+    assert (added, failed) == (ZoneReconciler.BATCH_SIZE + 2,
+                               ZoneReconciler.BATCH_SIZE)
+
+
+USED_IPS = {
+    'v4': b"""<?xml version="1.0" encoding="UTF-8"?>
+<usedIps xmlns="http://www.netcenter.ethz.ch/netcenter">
+  <usedIp><ip>10.0.0.1</ip><fqname>pc001.a.example.org.</fqname></usedIp>
+  <usedIp><ip> 10.0.0.2 </ip><fqname>+pc002.a.example.org</fqname></usedIp>
+</usedIps>
+""",
+    'v6': b"""<?xml version="1.0" encoding="UTF-8"?>
+<usedIps>
+  <usedIp><ip>fd00::1</ip><fqname>pc001.a.example.org.</fqname></usedIp>
+</usedIps>
+""",
+}
+
+
+class FakeOpener(object):
+    """Serves USED_IPS by the v4/ or v6/ part of the url."""
+
+    def __init__(self, responses=USED_IPS):
+        self.responses = responses
+        self.requests = []
+        self.streams = []
+
+    def __call__(self, url, headers):
+        self.requests.append((url, headers))
+        stream = io.BytesIO(self.responses[url.split('/')[-2]])
+        self.streams.append(stream)
+        return stream
+
+
+def test_netcenter_hosts():
+    opener = FakeOpener()
+    hosts = {}
+    count = netcenter2ipa.netcenterHosts(hosts, 'Basic eA==', 'group', False,
+                                         opener, 'https://nc.example.org/')
+    assert count == 2
+    assert hosts == {u'pc001.a.example.org': [u'10.0.0.1', None],
+                     u'pc002.a.example.org': [u'10.0.0.2', None]}
+    (url, headers), = opener.requests
+    assert url == 'https://nc.example.org/v4/group'
+    assert headers['Authorization'] == 'Basic eA=='
+    assert all(stream.closed for stream in opener.streams)
+
+
+def test_fetch_hosts_merges_v4_and_v6():
+    pytest.importorskip('concurrent.futures')
+    hosts = netcenter2ipa.fetchHosts('Basic eA==', 'group', FakeOpener(),
+                                     'https://nc.example.org/')
+    assert hosts == {u'pc001.a.example.org': [u'10.0.0.1', u'fd00::1'],
+                     u'pc002.a.example.org': [u'10.0.0.2', None]}
+
+
+def test_incomplete_record_fails_and_closes():
+    opener = FakeOpener(dict(v4=b"<usedIps><usedIp><ip>10.0.0.1</ip>"
+                                b"</usedIp></usedIps>"))
+    with pytest.raises(KeyError):
+        netcenter2ipa.netcenterHosts({}, 'Basic eA==', 'group', False, opener)
+    assert opener.streams[0].closed
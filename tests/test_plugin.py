@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+
+import codecs
+
+import pytest
+
+from fakeldap import FakeAPI, FakeEntry, FakeLDAP
+
+from ipalib import errors
+from ipalib_rfiddoorcontrol import audit, doorlist, metrics, rfiddoorcontrol
+
+
+USERS_DN = u'cn=users,cn=accounts,dc=example,dc=org'
+ALICE = u'uid=alice,' + USERS_DN
+
+
+class FakeCommand(object):
+
+    def __init__(self, name, ldap):
+        self.name = name
+        self.api = FakeAPI(ldap)
+
+
+@pytest.fixture
+def ldap(stats):
+    ldap = FakeLDAP()
+    ldap.add_entry(FakeEntry(ALICE, uid=[u'alice'],
+                             objectclass=['person', 'rfidDoorControl'],
+                             rfidkey=[u'04A1B2C3'],
+                             rfiddooraccess=[u'lab-3', u'hall: 2030-01-01']))
+    return ldap
+
+
+def user_mod(ldap, command=None, **attrs):
+    entry = FakeEntry(ALICE, attrs)
+    rfiddoorcontrol.usermod_precallback(command or FakeCommand('user_mod', ldap),
+                                        ldap, ALICE, entry, [], u'alice')
+    return entry
+
+
+@pytest.fixture
+def records(monkeypatch):
+    records = []
+    monkeypatch.setattr(audit, 'enabled', True)
+    monkeypatch.setattr(audit, 'record',
+                        lambda *args: records.append(args[:1] + args[2:]))
+    return records
+
+
+def test_usermod_reads_old_entry_once(ldap):
+    entry = user_mod(ldap, rfidkey=[u'04:a1:b2:c3'],
+                     rfiddooraccess=[u'hall: 2031-01-01'])
+    counters = metrics.snapshot()
+    assert counters['user_mod.ldap.get_entry'] == 1
+    assert counters['user_mod.ldap.find_entries'] == 1
+    assert entry['rfidkey'] == [u'04A1B2C3']
+    assert entry['rfiddooraccess'] == [u'hall: 2031-01-01', u'lab-3: disabled']
+
+
+def test_usermod_without_rfid_attributes_reads_nothing(ldap):
+    user_mod(ldap, givenname=[u'Alice'])
+    assert not [name for name in metrics.snapshot()
+                if name.startswith('user_mod.ldap.')]
+
+
+def test_usermod_free_form_case_change_is_not_written(ldap):
+    ldap.entries[ALICE]['rfiddooraccess'] = [u'lab-3: foo bar']
+    entry = user_mod(ldap, rfiddooraccess=[u'lab-3: FOO bar'])
+    assert 'rfiddooraccess' not in entry
+    assert metrics.snapshot()['rfiddooraccess.writes_avoided'] == 1
+
+
+def test_sweep_users_and_groups(ldap):
+    staff = u'cn=staff,cn=groups,cn=accounts,dc=example,dc=org'
+    ldap.add_entry(FakeEntry(staff, cn=[u'staff'],
+                             objectclass=['groupOfNames', 'rfidDoorControl'],
+                             rfiddooraccess=[u'hall: 2020-01-01', u'lab-3']))
+    ldap.entries[ALICE]['rfiddooraccess'] = [u'lab-3: 2020-01-01']
+
+    result = rfiddoorcontrol.rfiddoor_sweep(FakeAPI(ldap)).execute()['result']
+    assert result == dict(users=1, groups=1, changed=2, expired=2, dropped=0)
+    assert ldap.entries[ALICE]['rfiddooraccess'] == [u'lab-3: disabled']
+    assert ldap.entries[staff]['rfiddooraccess'] == [u'hall: disabled', u'lab-3']
+
+
+def test_sweep_isolates_failed_entries(ldap):
+    bob = u'uid=bob,' + USERS_DN
+    ldap.add_entry(FakeEntry(bob, uid=[u'bob'],
+                             objectclass=['person', 'rfidDoorControl'],
+                             rfiddooraccess=[u'hall: 2020-01-01']))
+    ldap.entries[ALICE]['rfiddooraccess'] = [u'lab-3: 2020-01-01']
+    update_entry = ldap.update_entry
+
+    def failing_update(entry):
+        if entry.dn == ALICE:
+            raise errors.DatabaseError(message=u'busy')
+        update_entry(entry)
+    ldap.update_entry = failing_update
+
+    output = rfiddoorcontrol.rfiddoor_sweep(FakeAPI(ldap)).execute()
+    assert output['failed'] == {ALICE: u'busy'}
+    assert output['result']['changed'] == 1
+    assert ldap.entries[bob]['rfiddooraccess'] == [u'hall: disabled']
+    assert ldap.entries[ALICE]['rfiddooraccess'] == [u'lab-3: 2020-01-01']
+
+
+def test_sweep_dry_run_writes_nothing(ldap):
+    ldap.entries[ALICE]['rfiddooraccess'] = [u'lab-3: 2020-01-01']
+    output = rfiddoorcontrol.rfiddoor_sweep(FakeAPI(ldap)).execute(dry_run=True)
+    assert output['result']['expired'] == 1
+    assert ldap.calls['update_entry'] == 0
+
+
+def test_sweep_is_audited(ldap, records):
+    ldap.entries[ALICE]['rfiddooraccess'] = [u'lab-3: 2020-01-01', u'hall']
+
+    rfiddoorcontrol.rfiddoor_sweep(FakeAPI(ldap)).execute()
+    assert records == [(u'rfiddoor_sweep', u'alice', [
+        (u'lab-3', u'lab-3: 2020-01-01', u'lab-3: disabled')])]
+
+    rfiddoorcontrol.rfiddoor_sweep(FakeAPI(ldap)).execute(dry_run=True)
+    assert len(records) == 1
+
+
+def test_usermod_rename_is_audited(ldap, records):
+    command = FakeCommand('user_mod', ldap)
+    entry = user_mod(ldap, command, rfiddooraccess=[u'lab-3', u'hall'])
+    renamed = u'uid=alison,' + USERS_DN
+    rfiddoorcontrol.audit_postcallback(command, ldap, renamed, entry,
+                                       u'alice', rename=u'alison')
+    assert records == [(u'user_mod', u'alice', [
+        (u'hall', u'hall: 2030-01-01', u'hall')])]
+
+
+def test_failed_usermod_is_not_audited(ldap, records):
+    command = FakeCommand('user_mod', ldap)
+    user_mod(ldap, command, rfiddooraccess=[u'lab-3', u'hall'])
+    error = errors.DatabaseError(desc=u'busy', info=u'')
+    with pytest.raises(errors.DatabaseError):
+        rfiddoorcontrol.audit_exccallback(command, (u'alice',), {}, error,
+                                          ldap.update_entry)
+    # a later command writing without changes of its own
+    rfiddoorcontrol.audit_postcallback(command, ldap, ALICE, FakeEntry(ALICE),
+                                       u'alice')
+    assert records == []
+
+
+def rfiddoor_list(ldap, **options):
+    return rfiddoorcontrol.rfiddoor_list(FakeAPI(ldap)).execute(**options)
+
+
+def test_list_doors(ldap, doors):
+    output = rfiddoor_list(ldap)
+    assert output['result'] == list(doors)
+    assert output['count'] == 3
+    assert output['summary'] == u'3 doors'
+
+
+def test_list_doors_by_digest(ldap, doors):
+    digest = rfiddoor_list(ldap)['digest']
+    output = rfiddoor_list(ldap, digest=digest)
+    assert output['result'] is None
+    assert (output['digest'], output['count']) == (digest, 3)
+
+    # a changed list comes with a new digest
+    with codecs.open(doorlist.registry.path, 'w', 'utf-8') as fh:
+        fh.write(u'hall\nattic\n')
+    output = rfiddoor_list(ldap, digest=digest)
+    assert output['result'] == [u'hall', u'attic']
+    assert output['digest'] != digest
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+
+import datetime
+
+import pytest
+
+from ipalib_rfiddoorcontrol.access import is_active, parse_grant
+from ipalib_rfiddoorcontrol.schedule import (
+        SLOTS_PER_DAY,
+        format_schedule,
+        parse_schedule,
+    )
+
+
+@pytest.mark.parametrize('text', [
+    u'08:00-08:00',
+    u'00:00-00:00',
+    u'Mon 24:00-24:00',
+    u'07:60-08:00',
+    u'9:75-10:00',
+    u'08:00-25:00',
+    u'24:15-01:00',
+    u'08:00-24:15',
+    u'08:10-09:00',
+])
+def test_invalid_ranges_are_refused(text):
+    with pytest.raises(ValueError):
+        parse_schedule(text)
+
+
+@pytest.mark.parametrize('text', [u'08:00-08:00', u'07:60-08:00',
+                                  u'9:75-10:00'])
+def test_invalid_ranges_never_open(text):
+    door, exc = parse_grant(u'lab-3: ' + text)
+    assert exc.strip() == text
+    assert not is_active(exc, datetime.datetime(2026, 10, 19, 8, 0))
+
+
+def test_overnight_and_full_day_ranges():
+    week, until = parse_schedule(u'Fri 22:00-06:00')
+    assert until is None
+    assert format_schedule(week) == u'Fri 22:00-24:00 Sat 00:00-06:00'
+    assert parse_schedule(u'00:00-24:00') == (None, None)
+    week, _ = parse_schedule(u'Mon 23:45-24:00')
+    assert week == 1 << (SLOTS_PER_DAY - 1)
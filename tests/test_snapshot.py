@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+
+import struct
+import time
+
+import pytest
+
+from ipalib_rfiddoorcontrol.groups import GroupGraph
+from ipalib_rfiddoorcontrol.snapshot import (
+        VERSION,
+        Snapshot,
+        compile_grants,
+        write_snapshot,
+    )
+
+
+def epoch(*args):
+    return time.mktime(args + (0, 0, -1))
+
+
+SATURDAY = epoch(2026, 10, 17, 12, 0, 0)
+LATE_SATURDAY = epoch(2027, 2, 6, 12, 0, 0)
+LATE_MONDAY = epoch(2027, 2, 8, 12, 0, 0)
+
+STAFF = u'cn=staff,cn=groups,dc=example,dc=org'
+ALICE = u'uid=alice,cn=users,dc=example,dc=org'
+
+
+@pytest.fixture
+def snapshot(tmpdir):
+    """alice holds lab-3 until 2027-01-31, staff lab-3 on weekdays."""
+    graph = GroupGraph([(STAFF, [ALICE], [u'lab-3: Mon-Fri 07:00-19:00'])])
+    access = [u'lab-3: 2027-01-31'] + list(graph.access(ALICE))
+    grants, doors = compile_grants([(u'04A1B2C3', access)], [u'lab-3', u'hall'])
+    path = str(tmpdir.join('access.snap'))
+    write_snapshot(path, grants, doors)
+    doorlist = tmpdir.join('doorlist.txt')
+    doorlist.write('lab-3\nhall\n')
+    return path, str(doorlist)
+
+
+def test_group_windows_do_not_take_away_own_grant(snapshot):
+    with Snapshot(snapshot[0]) as snap:
+        assert len(snap.grants(u'04A1B2C3', u'lab-3')) == 2
+        assert snap.check(u'04A1B2C3', u'lab-3', SATURDAY)
+        assert not snap.check(u'04A1B2C3', u'lab-3', LATE_SATURDAY)
+        assert snap.check(u'04A1B2C3', u'lab-3', LATE_MONDAY)
+        assert not snap.check(u'04A1B2C3', u'hall', SATURDAY)
+        assert snap.grants(u'04A1B2C3', u'hall') == ()
+        assert snap.expiry(u'04A1B2C3', u'lab-3', SATURDAY) == \
+            epoch(2027, 1, 31, 0, 0, 0)
+
+
+def test_several_grants_of_a_door(snapshot):
+    with Snapshot(snapshot[0]) as snap:
+        assert [len(door_grants) for door_grants in
+                snap.lookup(u'04A1B2C3').values()] == [2]
+
+
+def test_other_version(snapshot):
+    with open(snapshot[0], 'r+b') as fh:
+        fh.seek(4)
+        fh.write(struct.pack('<H', VERSION + 1))
+    with pytest.raises(ValueError):
+        Snapshot(snapshot[0])
+
+
+@pytest.mark.parametrize('data', [b'', b'garbage', b'\0' * 64])
+def test_not_a_snapshot(tmpdir, data):
+    path = tmpdir.join('access.snap')
+    path.write_binary(data)
+    with pytest.raises(ValueError):
+        Snapshot(str(path))
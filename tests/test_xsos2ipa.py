@@ -0,0 +1,403 @@
+# -*- coding: utf-8 -*-
+
+import codecs
+import io
+import os
+import sys
+import time
+import types
+
+import pytest
+
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'tools'))
+
+from ipalib import errors
+
+import xsos2ipa
+from xsos2ipa import IpaState, LdapObject
+
+
+class FakeIpa(object):
+    """IpaClient running user_find, group_show, user_add and user_mod
+    against a dict of users, recording the calls."""
+
+    def __init__(self, users=(), groups=None):
+        self.users = dict((entry['uid'][0], entry) for entry in users)
+        self.groups = groups or {}
+        self.calls = []
+
+    def __call__(self, command, *args, **kw):
+        self.calls.append((command,) + args)
+        if command == 'user_find':
+            return dict(result=list(self.users.values()))
+        if command == 'group_show':
+            if args[0] not in self.groups:
+                raise errors.NotFound()
+            return dict(result=dict(member_user=self.groups[args[0]]))
+        if command == 'user_add':
+            if args[0].lower() in self.users:
+                raise errors.DuplicateEntry()
+            self.users[args[0].lower()] = dict(uid=[args[0].lower()])
+            return dict(result=self.users[args[0].lower()])
+        if command == 'user_mod':
+            return dict(result=self.users[args[0].lower()])
+        raise AssertionError(command)
+
+
+class PagedControl(object):
+    """Stand-in for ldap.controls.SimplePagedResultsControl."""
+
+    controlType = '1.2.840.113556.1.4.319'
+
+    def __init__(self, criticality=True, size=10, cookie=b''):
+        self.size = size
+        self.cookie = cookie
+
+
+class FakeConnection(object):
+    """python-ldap connection serving its entries in pages, the cookie
+    being the offset of the next page."""
+
+    def __init__(self, entries):
+        self.entries = entries
+        self.searches = []
+
+    def search_ext(self, base, scope, filterstr, attrlist, serverctrls):
+        ctrl = serverctrls[0]
+        start = int(ctrl.cookie or 0)
+        self.searches.append((filterstr, start))
+        return (start, ctrl.size)
+
+    def result3(self, msgid):
+        start, size = msgid
+        page = self.entries[start:start + size]
+        cookie = b''
+        if start + size < len(self.entries):
+            cookie = '{0:d}'.format(start + size).encode('ascii')
+        # like a search reference, skipped by ldapUsers
+        rdata = page + [(None, ['ldap://other/'])]
+        return 101, rdata, msgid, [PagedControl(cookie=cookie)]
+
+
+@pytest.fixture
+def connection(monkeypatch):
+    entries = [(u'uid=u{0:d},ou=people,dc=example,dc=org'.format(i),
+                {'uid': [u'u{0:d}'.format(i).encode('utf-8')],
+                 'cn': [b'  User \xc3\xa4  ']})
+               for i in range(5)]
+    conn = FakeConnection(entries)
+    ldap = types.ModuleType('ldap')
+    ldap.SCOPE_SUBTREE = 2
+    ldap.initialize = lambda url: conn
+    controls = types.ModuleType('ldap.controls')
+    controls.SimplePagedResultsControl = PagedControl
+    filter = types.ModuleType('ldap.filter')
+    filter.escape_filter_chars = lambda value: value.replace('*', '\\2a')
+    for module in (ldap, controls, filter):
+        monkeypatch.setitem(sys.modules, module.__name__, module)
+    return conn
+
+
+def test_ldap_users_are_paged(connection):
+    users = xsos2ipa.ldapUsers(u'ldap.example.org', u'dc=example,dc=org',
+                               page_size=2)
+    first = next(users)
+    # the second page is requested before the first is handed out
+    assert [start for _, start in connection.searches] == [0, 2]
+    assert (first.uid, first.cn) == (u'u0', u'User \xe4')
+    assert [user.uid for user in users] == [u'u1', u'u2', u'u3', u'u4']
+    assert [start for _, start in connection.searches] == [0, 2, 4]
+
+
+def test_ldap_users_filter_by_uid(connection):
+    list(xsos2ipa.ldapUsers(u'ldap.example.org', u'dc=example,dc=org',
+                            uid=u'j*'))
+    assert connection.searches[0][0] == \
+        u'(&(objectClass=inetOrgPerson)(uid=j\\2a))'
+
+
+def source_user(uid=u'jdoe', **attrs):
+    values = dict(uid=[uid], cn=[u'J Doe'], sn=[u'Doe'], uidNumber=[u'1000'],
+                  gidNumber=[u'1000'])
+    values.update(attrs)
+    return LdapObject(u'uid={0},ou=people,dc=example,dc=org'.format(uid),
+                      values)
+
+
+def ipa_user(uid=u'jdoe', **attrs):
+    entry = dict(uid=[uid], givenname=[uid], sn=[u'Doe'], uidnumber=[u'1000'],
+                 gidnumber=[u'1000'])
+    entry.update(attrs)
+    return entry
+
+
+def test_delta_compares_canonical_keys_and_grants():
+    state = IpaState.fetch(FakeIpa([ipa_user(
+        rfidkey=[u'04A1B2C3'],
+        rfiddooraccess=[u'hall: 2030-01-01', u'lab-3', u'lab-4: disabled'])]))
+    user = source_user(rfidKey=[u'04:a1:b2:c3'],
+                       rfidDoorAccess=[u'Lab-3', u'hall: 2030-01-01T00:00:00'])
+    kw = dict(xsos2ipa.userKw(user), uidnumber=u'1000', gidnumber=u'1000')
+    assert state.delta(u'jdoe', kw) == {}
+
+    kw['rfidkey'] = [u'0004A1B2C3']
+    kw['rfiddooraccess'] = [u'lab-3']
+    assert sorted(state.delta(u'jdoe', kw)) == ['rfiddooraccess', 'rfidkey']
+
+
+def test_mixed_case_uid_is_modified_not_added():
+    ipa = FakeIpa([ipa_user(mail=[u'old@example.org'])],
+                  groups={u'admins': [u'Root']})
+    state = IpaState.fetch(ipa)
+    result = xsos2ipa.syncUser(ipa, source_user(u'JDoe',
+                                                mail=[u'new@example.org']), state)
+    assert result.status == 'MOD'
+    assert ('user_add', u'JDoe') not in ipa.calls
+    assert xsos2ipa.syncUser(ipa, source_user(u'root'), state).status == 'SKIP'
+
+
+LDIF = u"""version: 1
+
+# jdoe, people
+dn: uid=jdoe,ou=people,dc=example,dc=org
+uid: jdoe
+cn: J Doe
+sn: Doe
+uidNumber: 1000
+gidNumber: 1000
+mail: jdoe@example.
+ org
+description:: SsO8cmc=
+jpegPhoto:< file:///tmp/jdoe.jpg
+
+dn: uid=root,ou=people,dc=example,dc=org
+uid: root
+cn: Root
+sn: Root
+uidNumber: 0
+gidNumber: 0
+
+dn: uid=new,ou=people,dc=example,dc=org
+uid: new
+cn: New
+sn: User
+uidNumber: 1001
+gidNumber: 1000
+"""
+
+IPA_LDIF = u"""dn: uid=jdoe,cn=users,cn=accounts,dc=example,dc=org
+uid: jdoe
+givenName: jdoe
+sn: Doe
+uidNumber: 1000
+gidNumber: 1000
+mail: old@example.org
+
+dn: uid=root,cn=users,cn=accounts,dc=example,dc=org
+uid: root
+memberOf: cn=admins,cn=groups,cn=accounts,dc=example,dc=org
+"""
+
+
+def test_parse_ldif():
+    records = list(xsos2ipa.ldifRecords(LDIF.splitlines(True)))
+    assert xsos2ipa.parseLdif(records[0]) == (None, None)
+    dn, attrs = xsos2ipa.parseLdif(records[1])
+    assert dn == u'uid=jdoe,ou=people,dc=example,dc=org'
+    assert attrs['mail'] == [u'jdoe@example.org']
+    assert attrs['description'] == [u'J\xfcrg']
+    assert 'jpegPhoto' not in attrs
+    assert len(records) == 4
+
+
+def plan_state():
+    users, protected = {}, {}
+    for uid, entry, group in xsos2ipa._ipaChunk(
+            xsos2ipa.ldifRecords(IPA_LDIF.splitlines(True))):
+        users[uid] = entry
+        if group is not None:
+            protected[uid] = group
+    return IpaState(users, protected)
+
+
+def test_plan_user():
+    state = plan_state()
+    records = list(xsos2ipa.ldifRecords(LDIF.splitlines(True)))[1:]
+    users = [LdapObject(*xsos2ipa.parseLdif(lines)) for lines in records]
+    jdoe, root, new = [xsos2ipa.planUser(user, state) for user in users]
+    assert jdoe['op'] == 'mod'
+    assert jdoe['delta'] == dict(mail=([u'old@example.org'],
+                                       [u'jdoe@example.org']))
+    assert jdoe['kw'] == dict(mail=[u'jdoe@example.org'])
+    assert root == {'op': 'skip', 'uid': u'root', 'reason': u'admins user'}
+    assert new['op'] == 'add'
+    assert new['kw']['sn'] == u'User'
+
+    unchanged = source_user(mail=[u'old@example.org'])
+    assert xsos2ipa.planUser(unchanged, state) is None
+
+
+def test_plan_builder(tmpdir):
+    source = tmpdir.join('source.ldif')
+    source.write_text(LDIF, 'utf-8')
+    ipa = tmpdir.join('ipa.ldif')
+    ipa.write_text(IPA_LDIF, 'utf-8')
+    changes = list(xsos2ipa.PlanBuilder(processes=2, chunk_size=1).run(
+        str(source), str(ipa)))
+    assert [change['op'] for change in changes] == ['mod', 'skip', 'add']
+
+
+def test_replay_change():
+    ipa = FakeIpa([ipa_user()])
+    assert xsos2ipa.replayChange(ipa, {
+        'op': 'mod', 'uid': u'jdoe', 'kw': {u'mail': [u'new@example.org']},
+    }).status == 'MOD'
+    assert ipa.calls[-1] == ('user_mod', u'jdoe')
+    assert xsos2ipa.replayChange(ipa, {
+        'op': 'add', 'uid': u'new', 'kw': {u'sn': u'User'},
+    }).status == 'ADD'
+    result = xsos2ipa.replayChange(ipa, {
+        'op': 'add', 'uid': u'new', 'kw': {u'sn': u'User'},
+    })
+    assert result.status == 'EEE' and 'DuplicateEntry' in result.details
+    assert xsos2ipa.replayChange(ipa, {
+        'op': 'skip', 'uid': u'root', 'reason': u'admins user',
+    }).status == 'SKIP'
+
+
+def test_replay_empty_modlist_is_unchanged():
+    def ipa(command, *args, **kw):
+        raise errors.EmptyModlist()
+    assert xsos2ipa.replayChange(ipa, {
+        'op': 'mod', 'uid': u'jdoe', 'kw': {u'mail': [u'x@example.org']},
+    }).status == xsos2ipa.UNCHANGED
+
+
+def test_write_and_read_plan(tmpdir):
+    changes = [None, {'op': 'add', 'uid': u'new', 'kw': {u'sn': u'J\xfcrg'}},
+               {'op': 'skip', 'uid': u'root', 'reason': u'admins user'}]
+    path = str(tmpdir.join('plan.jsonl'))
+    with codecs.open(path, 'w', 'utf-8') as out:
+        counts = xsos2ipa.writePlan(changes, out)
+    assert (counts['add'], counts['skip'], counts[xsos2ipa.UNCHANGED]) == \
+        (1, 1, 1)
+    with io.open(path, encoding='utf-8') as fh:
+        assert list(xsos2ipa.readPlan(fh)) == changes[1:]
+
+
+def test_sync_engine_keeps_input_order():
+    # the futures backport on Python 2
+    pytest.importorskip('concurrent.futures')
+
+    def sync(n):
+        time.sleep(0.001 * (n % 3))
+        if n == 5:
+            raise ValueError(n)
+        return xsos2ipa.SyncResult('MOD', n, None)
+    results = list(xsos2ipa.SyncEngine(sync, workers=4).run(range(20)))
+    assert [result.uid for result in results] == \
+        list(range(5)) + [None] + list(range(6, 20))
+    assert results[5].status == 'EEE' and 'ValueError' in results[5].details
+
+
+def test_sync_engine_bounds_read_ahead():
+    pytest.importorskip('concurrent.futures')
+    read = []
+
+    def users():
+        for n in range(100):
+            read.append(n)
+            yield n
+
+    def sync(n):
+        return xsos2ipa.SyncResult('MOD', n, None)
+    engine = xsos2ipa.SyncEngine(sync, workers=2)
+    results = engine.run(users())
+    assert next(results).uid == 0
+    assert len(read) <= engine.workers * engine.QUEUE_FACTOR + 1
+    assert len(list(results)) == 99
+
+
+class Clock(object):
+    """The time module, without waiting."""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+def test_rate_limiter(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(xsos2ipa, 'time', clock)
+    limiter = xsos2ipa.RateLimiter(rate=10, burst=2)
+    for i in range(4):
+        limiter.acquire()
+    # the burst passes, then one call per 1/rate seconds
+    assert clock.slept == pytest.approx([0.1, 0.1])
+
+    clock.slept[:] = []
+    clock.now += 60
+    limiter.acquire()
+    assert clock.slept == []
+
+
+def test_rate_limiter_unlimited(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(xsos2ipa, 'time', clock)
+    limiter = xsos2ipa.RateLimiter()
+    for i in range(100):
+        limiter.acquire()
+    assert clock.slept == []
+
+
+def test_ldap_object_values():
+    user = LdapObject(u'uid=jdoe', {'uid': [b' jdoe '], 'mail': [u'a', u'b']})
+    assert user.uid == u'jdoe'
+    assert user.values('mail') == [u'a', u'b']
+    assert user.values('mail', fmt='mail:{0}') == [u'mail:a', u'mail:b']
+    with pytest.raises(ValueError):
+        user.mail
+    with pytest.raises(KeyError):
+        user.sn
+    with pytest.raises(AttributeError):
+        user._attrs_copy
+    with pytest.raises(AttributeError):
+        user.values('mail', fmt='{0} {sn[0]}')
+
+
+def test_ldap_object_update_merges_ignoring_case():
+    user = LdapObject(u'uid=jdoe', {'mail': [u'A@example.org', u'b@example.org',
+                                             u'B@EXAMPLE.ORG']})
+    kw = {'mail': [u'a@example.org']}
+    user.update(kw, 'mail')
+    assert kw == {'mail': [u'a@example.org', u'b@example.org']}
+
+    kw = {}
+    user.update(kw, 'mail', 'edupersontargetedid', fmt='mail:{mail[0]}')
+    assert kw == {'edupersontargetedid': [u'mail:A@example.org']}
+
+
+def test_ldap_object_update_missing_attribute_clears():
+    user = LdapObject(u'uid=jdoe', {'uid': [u'jdoe']})
+    kw = {'mobile': [u'123']}
+    user.update(kw, 'mobile')
+    assert kw == {}
+
+
+def test_ldap_object_setone():
+    user = LdapObject(u'uid=jdoe', {'uid': [u'jdoe'], 'sn': [u'Doe']})
+    kw = {}
+    user.setone(kw, 'sn')
+    user.setone(kw, 'givenName', default=u'jdoe')
+    user.setone(kw, 'l')
+    user.setone(kw, 'uid', 'homedirectory', fmt='/home/{0}')
+    assert kw == {'sn': u'Doe', 'givenname': u'jdoe',
+                  'homedirectory': u'/home/jdoe'}
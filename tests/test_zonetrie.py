@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'tools'))
+
+from zonetrie import ZoneTrie, load
+
+
+@pytest.fixture
+def trie():
+    return ZoneTrie({u'inf.example.org': u'zone1.', u'example.org': u'zone2.',
+                     u'lab.inf.example.org.': u'zone4.'},
+                    fallback=(u'example.net', u'zone3.'))
+
+
+def test_longest_suffix(trie):
+    assert len(trie) == 3
+    assert trie.match(u'pc1.lab.inf.example.org') == (u'pc1', u'zone4.')
+    assert trie.match(u'pc1.dev.inf.example.org') == (u'pc1.dev', u'zone1.')
+    assert trie.match(u'www.example.org') == (u'www', u'zone2.')
+
+
+def test_names_are_case_and_dot_insensitive(trie):
+    assert trie.match(u'PC1.Inf.Example.ORG.') == (u'PC1', u'zone1.')
+
+
+def test_exact_zone(trie):
+    # a zone name has no host part in itself, only in a shorter zone
+    assert trie.match(u'inf.example.org') == (u'inf', u'zone2.')
+    assert trie.match(u'example.org') is None
+
+
+def test_fallback_and_no_match(trie):
+    assert trie.match(u'pc1.example.net') == (u'pc1', u'zone3.')
+    assert trie.match(u'pc1.example.com') is None
+    assert trie.match(u'org') is None
+    assert ZoneTrie().match(u'pc1.example.org') is None
+
+
+def test_load(tmpdir):
+    path = tmpdir.join('subnet-map.cf')
+    path.write_text(u'example.net zone3\n\ninf.example.org zone1.\n', 'utf-8')
+    trie = load(str(path), target=lambda zone: zone.upper())
+    assert trie.match(u'pc1.inf.example.org') == (u'pc1', u'ZONE1.')
+    assert trie.match(u'pc1.example.net') == (u'pc1', u'ZONE3.')
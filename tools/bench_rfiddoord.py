@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Load generator for the door decision daemon (rfiddoord.py).
+
+    python3 tools/bench_rfiddoord.py [--connections N] [--requests N]
+
+Writes a synthetic snapshot, starts the daemon in a subprocess and
+reports latency percentiles and throughput of CHECK requests.
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+TOOLS = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(TOOLS)
+sys.path.insert(0, ROOT)
+
+from ipalib_rfiddoorcontrol.snapshot import compile_grants, write_snapshot
+
+
+def make_snapshot(dirname, nkeys, ndoors, seed=42):
+    rnd = random.Random(seed)
+    doors = ['door-{0:05d}'.format(i) for i in range(ndoors)]
+    doorlist = os.path.join(dirname, 'doorlist.txt')
+    with open(doorlist, 'w') as fh:
+        fh.write('\n'.join(doors) + '\n')
+    keys = ['{0:08X}'.format(rnd.getrandbits(32)) for _ in range(nkeys)]
+    forms = ('{0}', '{0}: disabled', '{0}: 2099-12-31', '{0}: 2001-01-01',
+             '{0}: Mon-Fri 07:00-19:00')
+    grants, doors = compile_grants(
+        ((key, [rnd.choice(forms).format(rnd.choice(doors))
+                for _ in range(5)]) for key in keys), doors)
+    snapshot = os.path.join(dirname, 'access.snap')
+    write_snapshot(snapshot, grants, doors)
+    return snapshot, doorlist, keys, doors
+
+
+async def client(host, port, queries, latencies):
+    reader, writer = await asyncio.open_connection(host, port)
+    for key, door in queries:
+        t0 = time.perf_counter()
+        writer.write('CHECK {0} {1}\n'.format(key, door).encode('utf-8'))
+        await reader.readline()
+        latencies.append(time.perf_counter() - t0)
+    writer.close()
+
+
+async def wait_ready(host, port, timeout=10.0):
+    deadline = time.time() + timeout
+    while True:
+        try:
+            reader, writer = await asyncio.open_connection(host, port)
+        except OSError:
+            if time.time() > deadline:
+                raise
+            await asyncio.sleep(0.05)
+            continue
+        writer.write(b'PING\n')
+        await reader.readline()
+        writer.close()
+        return
+
+
+async def load(host, port, keys, doors, connections, requests):
+    rnd = random.Random(1)
+    await wait_ready(host, port)
+    latencies = []
+    clients = [
+        client(host, port,
+               [(rnd.choice(keys), rnd.choice(doors)) for _ in range(requests)],
+               latencies)
+        for _ in range(connections)]
+    t0 = time.perf_counter()
+    await asyncio.gather(*clients)
+    return latencies, time.perf_counter() - t0
+
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+
+def main(argv=sys.argv[1:]):
+    parser = argparse.ArgumentParser(prog='bench_rfiddoord')
+    parser.add_argument('--keys', type=int, default=50000)
+    parser.add_argument('--doors', type=int, default=1000)
+    parser.add_argument('--connections', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--port', type=int, default=17878)
+    args = parser.parse_args(argv)
+
+    dirname = tempfile.mkdtemp(prefix='bench_rfiddoord-')
+    host = '127.0.0.1'
+    proc = None
+    try:
+        snapshot, doorlist, keys, doors = make_snapshot(
+            dirname, args.keys, args.doors)
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(
+            filter(None, [ROOT, os.environ.get('PYTHONPATH')])))
+        proc = subprocess.Popen([
+            sys.executable, os.path.join(TOOLS, 'rfiddoord.py'),
+            '-s', snapshot, '--doorlist', doorlist,
+            '-l', '{0}:{1:d}'.format(host, args.port)], env=env)
+        latencies, elapsed = asyncio.run(load(
+            host, args.port, keys, doors, args.connections, args.requests))
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait()
+        shutil.rmtree(dirname)
+
+    latencies.sort()
+    print('{0:d} requests over {1:d} connections in {2:.2f} s'.format(
+        len(latencies), args.connections, elapsed))
+    print('p50 {0:.3f} ms  p99 {1:.3f} ms  max {2:.3f} ms  {3:.0f} req/s'.format(
+        percentile(latencies, 50) * 1e3, percentile(latencies, 99) * 1e3,
+        latencies[-1] * 1e3, len(latencies) / elapsed))
+
+
+if __name__ == '__main__':
+    main()
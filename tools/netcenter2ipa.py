@@ -8,15 +8,17 @@ import pwd
 import codecs
 import sys
 import getpass
-import httplib2
+import threading
 import base64
 
-from lxml import objectify
 from lxml import etree
 
-from ipaserver.plugins.ldap2 import ldap2
-from ipalib import api
-import ipalib.errors
+import zonetrie
+
+try:
+    unicode
+except NameError:  # Python 3
+    unicode = str
 
 """
 from ipalib import api
@@ -35,32 +37,177 @@ from ipalib.plugins.dns import DNSName
  result = api.Command.dnsrecord_find(nnzone, u'test55')['result']
 """
 
-def netcenterHosts(hosts, basicAuth, netgroup, ipv6=False):
-    method = 'GET'
-    url = 'https://www.netcenter.ethz.ch/netcenter/rest/nameToIP/usedIps/'
-    url += 'v6/' if ipv6 else 'v4/'
-    url += netgroup
+NETCENTER_URL = 'https://www.netcenter.ethz.ch/netcenter/rest/nameToIP/usedIps/'
+
+
+def urllibOpen(url, headers):
+    """Default HTTP layer: GET url and return the response as a stream."""
+    try:
+        from urllib.request import Request, urlopen
+    except ImportError:
+        from urllib2 import Request, urlopen
+    return urlopen(Request(url, headers=headers))
+
+
+def _localname(tag):
+    return tag.rpartition('}')[2]
+
+
+def parseUsedIps(stream, hosts, ipv6=False, lock=None):
+    """Feed the usedIp records of a NetCenter response into hosts.
+
+    hosts maps fqdn -> [ipv4, ipv6].  The response is parsed
+    incrementally and every record is dropped from the tree once read,
+    so memory does not grow with the size of the netgroup.
+    """
+    lock = lock or threading.Lock()
+    root = None
+    count = 0
+    for event, el in etree.iterparse(stream, events=('start', 'end')):
+        if event == 'start':
+            if root is None:
+                root = el
+            continue
+        if _localname(el.tag) != 'usedIp':
+            continue
+        fields = dict((_localname(c.tag), (c.text or '').strip()) for c in el)
+        try:
+            fqdn = fields['fqname'].lstrip('+').strip('.')
+            ip = unicode(fields['ip'])
+        except KeyError:
+            print( etree.tostring(el) )
+            raise
+        with lock:
+            hosts.setdefault(fqdn, [None, None])[int(bool(ipv6))] = ip
+        count += 1
+        root.clear()
+    return count
+
+
+def netcenterHosts(hosts, basicAuth, netgroup, ipv6=False, opener=urllibOpen,
+                   baseurl=NETCENTER_URL, lock=None):
+    url = baseurl + ('v6/' if ipv6 else 'v4/') + netgroup
     headers = {
-        'Host': 'www.netcenter.ethz.ch',
         'Authorization': basicAuth, 'Content-Type': 'text/xml',
         'User-Agent': 'curl/7.37.0', 'Accept': '*/*',
     }
-    http = httplib2.Http()
-    response, content = http.request(url, method=method, headers=headers, body=None)
+    stream = opener(url, headers)
     try:
-        usedIps = objectify.fromstring(content)
-    except:
-        print(content)
-        raise
-    for usedIp in usedIps.usedIp:
-        fqdn = str(usedIp.fqname)
-        fqdn = fqdn.lstrip('+').strip('.')
-        hosts.setdefault(fqdn, [None, None])
-        try:
-            hosts[fqdn][int(bool(ipv6))] = unicode(usedIp.ip)
-        except:
-            print( etree.tostring(usedIp, pretty_print=True) )
-            raise
+        return parseUsedIps(stream, hosts, ipv6, lock)
+    finally:
+        stream.close()
+
+
+def fetchHosts(basicAuth, netgroup, opener=urllibOpen, baseurl=NETCENTER_URL):
+    """Fetch the v4 and v6 addresses of netgroup concurrently."""
+    from concurrent.futures import ThreadPoolExecutor
+    hosts = dict()
+    lock = threading.Lock()
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        futures = [pool.submit(netcenterHosts, hosts, basicAuth, netgroup,
+                               ipv6, opener, baseurl, lock)
+                   for ipv6 in (False, True)]
+        for future in futures:
+            future.result()
+    return hosts
+
+
+class ZoneReconciler(object):
+    """Adds the missing A/AAAA records of NetCenter hosts to IPA zones.
+
+    Each zone is read once with dnsrecord_find; missing records are
+    collected per name and added with one batch call per BATCH_SIZE
+    names, so the number of calls grows with the zones, not the hosts.
+    command is api.Command or a stand-in with the same interface.
+
+    Errors only fail what they concern: a zone that cannot be read
+    (NotFound if it is not in IPA) is reported and its hosts are
+    skipped, a failing batch call fails the names of its chunk.
+    """
+
+    BATCH_SIZE = 200
+    RECORD_TYPES = ('arecord', 'aaaarecord')
+
+    def __init__(self, command):
+        self.command = command
+        self.zones = {}
+        self.pending = {}
+        self.errors = {}
+        self.calls = 0
+        self.skipped = 0
+
+    def records(self, zone):
+        """Return {name: {rtype: set(values)}} of a zone, loaded once.
+
+        Returns None if the zone could not be read.
+        """
+        key = unicode(zone)
+        if key in self.errors:
+            return None
+        if key not in self.zones:
+            self.calls += 1
+            try:
+                result = self.command.dnsrecord_find(
+                    zone, sizelimit=0, timelimit=0)['result']
+            except Exception as e:
+                self.errors[key] = e
+                print('Skipping zone {0}: {1}'.format(key, e))
+                return None
+            records = {}
+            for entry in result:
+                name = unicode(entry['idnsname'][0]).lower()
+                rec = records.setdefault(name, {})
+                for rtype in self.RECORD_TYPES:
+                    rec.setdefault(rtype, set()).update(
+                        unicode(v).lower() for v in entry.get(rtype, ()))
+            self.zones[key] = records
+            self.pending[key] = (zone, {})
+        return self.zones[key]
+
+    def reconcile(self, zone, name, ipaddrs):
+        """Queue the records of ipaddrs (v4, v6) missing from zone."""
+        records = self.records(zone)
+        if records is None:
+            self.skipped += 1
+            return
+        existing = records.get(unicode(name).lower(), {})
+        pending = self.pending[unicode(zone)][1]
+        for rtype, addr in zip(self.RECORD_TYPES, ipaddrs):
+            if addr and unicode(addr).lower() not in existing.get(rtype, ()):
+                pending.setdefault(unicode(name), {}).setdefault(rtype, [])
+                if addr not in pending[unicode(name)][rtype]:
+                    pending[unicode(name)][rtype].append(addr)
+
+    def flush(self):
+        """Add the queued records, return (names added, names failed)."""
+        added = failed = 0
+        for key, (zone, pending) in sorted(self.pending.items()):
+            names = sorted(pending)
+            for i in range(0, len(names), self.BATCH_SIZE):
+                methods = [
+                    {'method': 'dnsrecord_add',
+                     'params': [[key, name], pending[name]]}
+                    for name in names[i:i + self.BATCH_SIZE]]
+                self.calls += 1
+                try:
+                    result = self.command.batch(*methods)
+                except Exception as e:
+                    failed += len(methods)
+                    print('Batch of {0:d} names in {1} failed: {2}'.format(
+                        len(methods), key, e))
+                    continue
+                for method, res in zip(methods, result['results']):
+                    if not res.get('error') or res.get('error_name') == 'EmptyModlist':
+                        added += 1
+                        continue
+                    failed += 1
+                    print('*'*80)
+                    print(res['error'])
+                    print(repr(method['params']))
+                    print('*'*80)
+            pending.clear()
+        return added, failed
+
 
 def main():
 
@@ -74,6 +221,7 @@ def main():
         username, password = unpw.split('\n', 1)
     basicAuth = 'Basic %s' % base64.b64encode('%s:%s' % (username, password))
 
+    from ipalib import api
     api.bootstrap(context='example', in_server=True)
     api.finalize()
     if api.env.in_server:
@@ -82,65 +230,30 @@ def main():
         api.Backend.rpcclient.connect()
     print(' Done')
 
-    managed_zones = {}
     from ipalib.plugins.dns import DNSName
-    with codecs.open('subnet-map.cf', 'r', 'utf-8') as cf:
-        FALLBACK_S, FALLBACK_T = cf.readline().rstrip().split(None, 1)
-        FALLBACK_T = DNSName(FALLBACK_T.rstrip('.')+'.')
-        for line in cf.readlines():
-            s = line.rstrip().split(None, 1)
-            managed_zones[s[0]] = DNSName(s[1].rstrip('.')+'.')
- 
+    managed_zones = zonetrie.load('subnet-map.cf', DNSName)
+
     print('Reading NetCenter...')
-    hosts = dict()
-    h4 = netcenterHosts(hosts, basicAuth, netgroup)
-    h6 = netcenterHosts(hosts, basicAuth, netgroup, ipv6=True)
+    hosts = fetchHosts(basicAuth, netgroup)
     print(' Done')
 
+    reconciler = ZoneReconciler(api.Command)
     for fqdn, ipaddrs in hosts.items():
         fqdn = fqdn.lstrip('+').strip('.')
-        managed = False
-        nnzone = None
-        hn = None
-        for mz in managed_zones:
-            if fqdn.endswith('.'+mz):
-                hn = unicode(fqdn[:-len(mz)-1])
-                managed = True
-                nnzone = managed_zones[mz]
-                break
-        if not managed and fqdn.endswith(FALLBACK_S):
-            hn = fqdn[:-len(FALLBACK_S)-1]
-            managed = True
-            nnzone = FALLBACK_T
-        if not hn:
+        match = managed_zones.match(fqdn)
+        if match is None:
             continue
-        xmanaged = '* ' if managed else '  '
-        print("{}{:20s}: {}, {}".format(xmanaged, fqdn, *ipaddrs))
-        if nnzone:
-            nhn = DNSName(hn)
-            try:
-                result = api.Command.dnsrecord_show(nnzone, nhn)['result']
-            except ipalib.errors.NotFound:
-                result = {}  # {'arecord': [], 'aaaarecord': []})
-            if True: # len(result):
-                arecord = result.get('arecord', ())
-                aaaarecord = result.get('aaaarecord', ())
-                kw = {}
-                if ipaddrs[0] and ipaddrs[0] not in arecord:
-                    kw['arecord'] = ipaddrs[0]
-                if ipaddrs[1] and ipaddrs[1] not in aaaarecord:
-                    kw['aaaarecord'] = ipaddrs[1]
-                if kw:
-                    try:
-                        result2 = api.Command.dnsrecord_add(nnzone, nhn, **kw)
-                    except ipalib.errors.EmptyModlist:
-                        pass
-                    except Exception as e:
-                        print('*'*80)
-                        print(e)
-                        print(repr(ipaddrs))
-                        print('*'*80)
-            
+        hn, nnzone = match
+        print("{}{:20s}: {}, {}".format('* ', fqdn, *ipaddrs))
+        reconciler.reconcile(nnzone, hn, ipaddrs)
+
+    print('Updating FreeIPA...')
+    added, failed = reconciler.flush()
+    print(' {0:d} names updated, {1:d} failed, {2:d} hosts in {3:d} unreadable '
+          'zones skipped, {4:d} zones, {5:d} calls'.format(
+              added, failed, reconciler.skipped, len(reconciler.errors),
+              len(reconciler.zones), reconciler.calls))
+
 
 if __name__ == '__main__':
     main()
@@ -4,14 +4,21 @@
 #
 # Related Bug:
 # https://fedorahosted.org/freeipa/ticket/2679
+#
+# The version is a hash of the plugin contents, not of their mtimes:
+# reinstalling or touching unchanged plugins keeps the version, and
+# with it the copies cached by browsers.
 
-num_version=$(grep 'num_version: ' /usr/share/ipa/ui/js/libs/loader.js | cut -d\' -f2)
-stats=0
-for plugin in /usr/share/ipa/ui/js/plugins/* ; do
-    plugin_stats=$(stat -c %Y "$plugin"/$(basename "$plugin").js | cut -d ' ' -f1)
-    if [ $plugin_stats -gt $stats ] ; then
-        stats=$plugin_stats
-    fi
-done
-sed -i "s,^.*num_version: .*$,        num_version: '${num_version%.*}.${stats}'\,," /usr/share/ipa/ui/js/libs/loader.js
+export LC_ALL=C
 
+loader=/usr/share/ipa/ui/js/libs/loader.js
+num_version=$(grep 'num_version: ' "$loader" | cut -d\' -f2)
+digest=$(for plugin in /usr/share/ipa/ui/js/plugins/* ; do
+    name=$(basename "$plugin")
+    echo "$name $(sha1sum < "$plugin/$name.js" | cut -d ' ' -f1)"
+done | sha1sum | cut -c1-12)
+new_version="${num_version%.*}.$((16#$digest))"
+if [ "$new_version" = "$num_version" ] ; then
+    exit 0
+fi
+sed -i "s,^.*num_version: .*$,        num_version: '${new_version}'\,," "$loader"
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+# -*- Mode: Python; py-indent-offset: 4; coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 expandtab
+
+## Copyright (c) 2015, Claudio Luck (Zurich, Switzerland)
+##
+## Licensed under the terms of the MIT License, see LICENSE file.
+
+"""Door decision daemon answering "may key K open door D now?".
+
+    python3 rfiddoord.py [-s SNAPSHOT] [--doorlist PATH]
+                         [-l HOST:PORT] [-u SOCKET]
+
+The access snapshot written by `rfiddoorctl export` is loaded into an
+in-memory index (key -> door id -> grants) and served over TCP
+and/or a UNIX socket with a line protocol:
+
+    CHECK <key> <door>    ->  ALLOW <expiry epoch> | DENY | ERR <reason>
+    PING                  ->  PONG
+
+Requests may be pipelined.  The index is rebuilt in a worker thread
+when the snapshot or the door list changes and swapped in between two
+requests, so open connections are not interrupted; while the files
+cannot be loaded the old index is kept, the failure is printed once and
+retried less and less often until the files change.  Doors that are not
+in the door list are answered with "ERR unknown door".  Grants with
+time windows are only allowed inside them (local time); ALLOW carries
+the latest expiry of the grants open now.
+
+This is a Python 3 (asyncio) program and therefore not part of the
+plugin package; it only needs ipalib_rfiddoorcontrol, not FreeIPA.
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+from ipalib_rfiddoorcontrol.commands import DEFAULT_SNAPSHOT
+from ipalib_rfiddoorcontrol.doorlist import DOORLIST, DoorList, file_identity
+from ipalib_rfiddoorcontrol.keys import canonical_key
+from ipalib_rfiddoorcontrol.snapshot import Snapshot, active_expiry
+
+
+DEFAULT_LISTEN = '127.0.0.1:7878'
+# longest wait between two attempts to load files that failed to load
+MAX_RETRY_INTERVAL = 60.0
+
+
+def _identity(path):
+    try:
+        return file_identity(path)
+    except OSError:
+        return None
+
+
+class AccessIndex(object):
+    """Immutable in-memory copy of an access snapshot."""
+
+    __slots__ = ('keys', 'door_ids', 'identity')
+
+    def __init__(self, keys=None, door_ids=None, identity=None):
+        self.keys = keys or {}
+        self.door_ids = door_ids or {}
+        self.identity = identity
+
+    @classmethod
+    def load(cls, snapshot_path, doorlist_path):
+        identity = (_identity(snapshot_path), _identity(doorlist_path))
+        with Snapshot(snapshot_path) as snap:
+            keys = dict(snap)
+            door_ids = dict((door.lower(), i)
+                            for i, door in enumerate(snap.doors))
+        if identity[1] is not None:
+            known = DoorList.load(doorlist_path)
+            door_ids = dict((door, i) for door, i in door_ids.items()
+                            if door in known)
+        return cls(keys, door_ids, identity)
+
+    NO_GRANTS = ()
+
+    def grants(self, key, door):
+        """Return ((expiry epoch, week bitmap or None), ...), None if door unknown.
+
+        The tuple is empty if the key has no grant for the door.
+        """
+        door_id = self.door_ids.get(door.lower())
+        if door_id is None:
+            return None
+        return self.keys.get(canonical_key(key), {}).get(door_id, self.NO_GRANTS)
+
+
+class DoorDecisionServer(object):
+
+    def __init__(self, snapshot_path, doorlist_path, interval=1.0,
+                 max_retry_interval=MAX_RETRY_INTERVAL):
+        self.snapshot_path = snapshot_path
+        self.doorlist_path = doorlist_path
+        self.interval = interval
+        self.max_retry_interval = max_retry_interval
+        self.index = AccessIndex()
+        self.requests = 0
+
+    def identity(self):
+        return (_identity(self.snapshot_path), _identity(self.doorlist_path))
+
+    def reload(self):
+        self.index = AccessIndex.load(self.snapshot_path, self.doorlist_path)
+
+    async def watch(self):
+        loop = asyncio.get_running_loop()
+        failed = None  # identity and error of the last failed load
+        retry = self.interval
+        retry_at = 0.0
+        while True:
+            await asyncio.sleep(self.interval)
+            identity = self.identity()
+            if identity == self.index.identity:
+                continue
+            if failed is not None and failed[0] == identity and \
+                    loop.time() < retry_at:
+                continue
+            try:
+                index = await loop.run_in_executor(
+                    None, AccessIndex.load,
+                    self.snapshot_path, self.doorlist_path)
+            except (OSError, ValueError) as e:
+                # half-written or missing files: keep serving the old
+                # index, back off while the files stay the same
+                if failed is None or failed[1] != str(e):
+                    print('reload failed: {0}'.format(e), file=sys.stderr)
+                if failed is not None and failed[0] == identity:
+                    retry = min(retry * 2, self.max_retry_interval)
+                else:
+                    retry = self.interval
+                failed = (identity, str(e))
+                retry_at = loop.time() + retry
+                continue
+            if failed is not None:
+                print('reloaded', file=sys.stderr)
+                failed = None
+            self.index = index
+
+    def answer(self, line):
+        self.requests += 1
+        parts = line.decode('utf-8', 'replace').rstrip('\r\n').split(' ', 2)
+        if parts[0] == 'CHECK' and len(parts) == 3:
+            grants = self.index.grants(parts[1], parts[2])
+            if grants is None:
+                return b'ERR unknown door\n'
+            expiry = active_expiry(grants, time.time())
+            if expiry is not None:
+                return 'ALLOW {0:d}\n'.format(expiry).encode('ascii')
+            return b'DENY\n'
+        if parts[0] == 'PING':
+            return b'PONG\n'
+        return b'ERR bad request\n'
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                writer.write(self.answer(line))
+                if writer.transport.get_write_buffer_size() > 65536:
+                    await writer.drain()
+        except (ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host=None, port=None, path=None):
+        self.reload()
+        servers = []
+        if port is not None:
+            servers.append(await asyncio.start_server(
+                self.handle, host, port))
+        if path is not None:
+            if os.path.exists(path):
+                os.unlink(path)
+            servers.append(await asyncio.start_unix_server(
+                self.handle, path))
+        try:
+            await self.watch()
+        finally:
+            for server in servers:
+                server.close()
+
+
+def serve(snapshot_path, doorlist_path, host=None, port=None, path=None):
+    server = DoorDecisionServer(snapshot_path, doorlist_path)
+    try:
+        asyncio.run(server.serve(host, port, path))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='rfiddoord',
+        description='answer door access checks from the snapshot')
+    parser.add_argument('-s', '--snapshot', default=DEFAULT_SNAPSHOT,
+        help='snapshot file (default: %(default)s)')
+    parser.add_argument('--doorlist', default=DOORLIST,
+        help='door list (default: %(default)s)')
+    parser.add_argument('-l', '--listen', metavar='HOST:PORT',
+        help='TCP address (default: %s, unless --socket is given)'
+             % DEFAULT_LISTEN)
+    parser.add_argument('-u', '--socket', metavar='PATH',
+        help='UNIX socket path')
+    args = parser.parse_args(argv)
+    if not (args.listen or args.socket):
+        args.listen = DEFAULT_LISTEN
+    host = port = None
+    if args.listen:
+        host, port = args.listen.rsplit(':', 1)
+        host, port = host.strip('[]') or None, int(port)
+    return serve(args.snapshot, args.doorlist, host, port, args.socket)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
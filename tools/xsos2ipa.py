@@ -8,205 +8,709 @@ import pwd
 import codecs
 import sys
 import getpass
-import httplib2
+import argparse
+import collections
+import threading
+import time
+import json
+import io
+import multiprocessing
 import base64
 import traceback
 import pprint
 
-from lxml import objectify
-from lxml import etree
+# ipalib is imported where IPA is called, so that --plan and LdapObject
+# work without FreeIPA installed
+from ipalib_rfiddoorcontrol.access import (
+        DISABLED,
+        format_grant,
+        parse_accesses,
+    )
+from ipalib_rfiddoorcontrol.keys import canonical_key
 
-from ipaserver.plugins.ldap2 import ldap2
-from ipalib import api
-import ipalib.errors
+
+def _decode(val):
+    if isinstance(val, bytes):
+        val = val.decode('utf-8')
+    return val.strip()
 
 
 class LdapObject(object):
+    """LDAP entry with its values decoded and stripped once.
+
+    Attribute access returns the single value of an LDAP attribute
+    (KeyError if missing, ValueError if multi-valued).
+    """
+
+    __slots__ = ('dn', '_attrs')
 
     def __init__(self, dn, attrs):
-        #attrs2 = {}
-        #for k, v in attrs.items():
-        #    attrs2[k.lower()] = v
-        object.__setattr__(self, '_LdapObject__attrs', attrs)
-        object.__setattr__(self, 'dn', dn)
+        self.dn = dn
+        self._attrs = dict((k, [_decode(v) for v in vals])
+                           for k, vals in attrs.items())
 
     def __getattr__(self, att):
-        vals = object.__getattribute__(self, '_LdapObject__attrs')[att]
+        if att.startswith('_'):
+            raise AttributeError(att)
+        vals = self._attrs[att]
         if len(vals) != 1:
             raise ValueError('not exactly one value')
-        if isinstance(vals[0], basestring):
-            return vals[0].decode('utf-8').strip()
-        return vals[0].strip()
+        return vals[0]
 
     def __repr__(self):
-        atts = object.__getattribute__(self, '_LdapObject__attrs')
+        atts = self._attrs
         s = ''.join( ( '{0}={1} '.format(k, ','.join(atts[k])) for k in atts ) )
         return '<{0} {1}>'.format(self.dn, s.rstrip(' '))
 
     def values(self, att, fmt='{0}'):
-        vals = object.__getattribute__(self, '_LdapObject__attrs')[att]
+        vals = self._attrs[att]
+        if fmt == '{0}':
+            return list(vals)
         try:
-            for val in vals:
-                if isinstance(vals[0], basestring):
-                    yield fmt.format(val.decode('utf-8').strip(), **object.__getattribute__(self, '_LdapObject__attrs'))
-                else:
-                    yield fmt.format(val.strip(), **object.__getattribute__(self, '_LdapObject__attrs'))
+            return [fmt.format(val, **self._attrs) for val in vals]
         except KeyError as e:
             raise AttributeError(str(e))
 
     def update(self, kw, att, toatt=None, fmt='{0}'):
+        """Add the values of att missing (ignoring case) from kw[toatt]."""
         if toatt is None:
             toatt = att.lower()
         try:
-            vals = list(self.values(att, fmt=fmt))
+            vals = self.values(att, fmt=fmt)
         except KeyError:
             if toatt in kw:
                 del kw[toatt]
-        else:
-            ikw = map(lambda s: s.lower(), kw.get(toatt, ()))
-            for val in vals:
-                ival = val.lower()
-                if not any(ival == v for v in ikw):
-                    if toatt not in kw:
-                        kw[toatt] = [val]
-                    else:
-                        kw[toatt].append(val)
+            return
+        target = kw.get(toatt)
+        index = set(v.lower() for v in target) if target else set()
+        for val in vals:
+            ival = val.lower()
+            if ival in index:
+                continue
+            index.add(ival)
+            if target is None:
+                target = kw[toatt] = [val]
+            else:
+                target.append(val)
 
     def setone(self, kw, att, toatt=None, default=None, fmt='{0}'):
         if toatt is None:
             toatt = att.lower()
         try:
-            kw[toatt] = fmt.format(getattr(self, att), **object.__getattribute__(self, '_LdapObject__attrs'))
+            kw[toatt] = fmt.format(getattr(self, att), **self._attrs)
         except KeyError:
             if default:
                 kw[toatt] = default
 
 
-def ldapUsers(users, idoverrideusers, server, base):
+# Attributes read by main(), all others stay on the server.
+SYNC_ATTRS = (
+    'uid', 'cn', 'uidNumber', 'gidNumber', 'loginShell', 'homeDirectory',
+    'mail', 'registeredAddress', 'mobile', 'telephoneNumber',
+    'street', 'l', 'postalCode', 'givenName', 'sn',
+    'rfidKey', 'rfidDoorAccess',
+)
+PAGE_SIZE = 500
+
+
+def ldapUsers(server, base, uid=None, attrs=SYNC_ATTRS, page_size=PAGE_SIZE):
+    """Yield the inetOrgPerson entries below base as LdapObjects.
+
+    Uses the Simple Paged Results control and asks for the next page
+    before handing out the current one, so the server prepares it
+    while the caller syncs.
+    """
     import ldap
+    from ldap.controls import SimplePagedResultsControl
+    from ldap.filter import escape_filter_chars
     l = ldap.initialize('ldap://{0}:389'.format(server))
-    #ret = l.search_s(base, ldap.SCOPE_SUBTREE, '(objectClass=inetOrgPerson)', [str('*'), str('objectClass')])
-    ret = l.search_s(base, ldap.SCOPE_SUBTREE, '(objectClass=inetOrgPerson)')
-    for dn, attrs in ret:
-        user = LdapObject(dn, attrs)
-        idoverride = LdapObject(
-            'uid={0},cn=users,cn=compat,dc=soseth,dc=org'.format(user.uid), {
-                #'cn': [user.cn], 
-                'objectClass': ['posixAccount', 'top'],
-                'gidNumber': ['10000'],
-                'gecos': [user.cn],
-                'uidNumber': [user.uidNumber],
-                'loginShell': ['/bin/sh'],
-                'homeDirectory': ['/home/{0}'.format(user.uid)],
-                'uid': [user.uid],
-             })
-        idoverrideusers[user.uid] = idoverride
-        users[user.uid] = user
-
-
-def main(netgroup='adm-soseth'):
+    filterstr = '(objectClass=inetOrgPerson)'
+    if uid is not None:
+        filterstr = '(&{0}(uid={1}))'.format(filterstr, escape_filter_chars(uid))
+    attrlist = [str(a) for a in attrs]
+    ctrl = SimplePagedResultsControl(True, size=page_size, cookie=b'')
+    msgid = l.search_ext(base, ldap.SCOPE_SUBTREE, str(filterstr), attrlist,
+                         serverctrls=[ctrl])
+    while msgid is not None:
+        rtype, rdata, rmsgid, serverctrls = l.result3(msgid)
+        msgid = None
+        for c in serverctrls:
+            if c.controlType == SimplePagedResultsControl.controlType and c.cookie:
+                ctrl.cookie = c.cookie
+                msgid = l.search_ext(base, ldap.SCOPE_SUBTREE, str(filterstr),
+                                     attrlist, serverctrls=[ctrl])
+        for dn, entry in rdata:
+            if dn is not None:
+                yield LdapObject(dn, entry)
 
-    print('Authenticating to FreeIPA...')
-    api.bootstrap(context='example', in_server=True)
-    api.finalize()
-    if api.env.in_server:
-        api.Backend.ldap2.connect(ccache=api.Backend.krb.default_ccname())
-    else:
-        api.Backend.rpcclient.connect()
-    print(' Done')
 
-    ## sys.setrecursionlimit(20)
-    print('Reading LDAP...')
-    users = dict()
-    idoverrideusers = dict()
-    server = sys.argv[1]
-    base = sys.argv[2]
-    ldapUsers(users, idoverrideusers, server, base)
-    print(' {0:d} Done'.format(len(users)))
-    from ipapython.dn import DN
-
-    for user in users.values():
-        uid = user.uid
-        if len(sys.argv) > 3 and uid != sys.argv[3]:
-            continue
+def idoverrideUser(user):
+    return LdapObject(
+        'uid={0},cn=users,cn=compat,dc=soseth,dc=org'.format(user.uid), {
+            #'cn': [user.cn], 
+            'objectClass': ['posixAccount', 'top'],
+            'gidNumber': ['10000'],
+            'gecos': [user.cn],
+            'uidNumber': [user.uidNumber],
+            'loginShell': ['/bin/sh'],
+            'homeDirectory': ['/home/{0}'.format(user.uid)],
+            'uid': [user.uid],
+         })
+
+
+class RateLimiter(object):
+    """Token bucket shared by all workers: at most rate calls per second."""
+
+    def __init__(self, rate=None, burst=None):
+        self.rate = rate
+        self.burst = burst or max(1, rate or 1)
+        self.tokens = self.burst
+        self.stamp = time.time()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if not self.rate:
+            return
+        with self.lock:
+            now = time.time()
+            self.tokens = min(self.burst,
+                              self.tokens + (now - self.stamp) * self.rate)
+            self.stamp = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+
+class IpaClient(object):
+    """Runs IPA commands on a connection of the calling thread."""
+
+    def __init__(self, limiter=None):
+        self.limiter = limiter or RateLimiter()
+        self.local = threading.local()
+
+    def connect(self):
+        from ipalib import api
+        if getattr(self.local, 'connected', False):
+            return
+        if api.env.in_server:
+            if not api.Backend.ldap2.isconnected():
+                api.Backend.ldap2.connect(ccache=api.Backend.krb.default_ccname())
+        else:
+            if not api.Backend.rpcclient.isconnected():
+                api.Backend.rpcclient.connect()
+        self.local.connected = True
+
+    def __call__(self, command, *args, **kw):
+        from ipalib import api
+        self.connect()
+        self.limiter.acquire()
+        return api.Command[command](*args, **kw)
+
+
+SyncResult = collections.namedtuple('SyncResult', 'status uid details')
+
+UNCHANGED = '   '
+
+
+PROTECTED_GROUPS = ('admins', 'trust_admins', 'editors')
+
+
+def _values(value):
+    if isinstance(value, (list, tuple)):
+        return sorted('{0}'.format(v) for v in value)
+    return ['{0}'.format(value)]
+
+
+def _access(values, old=()):
+    """rfidDoorAccess values as user_mod stores them, lower-cased.
+
+    Doors of old missing from values are disabled, as by the plugin.
+    """
+    grants = dict(parse_accesses(values))
+    for acc, excs in parse_accesses(old):
+        grants.setdefault(acc, (DISABLED,))
+    return sorted(format_grant(acc, exc).lower()
+                  for acc, excs in grants.items() for exc in excs)
+
+
+def _canonical(att, old, new):
+    """Return old and new values of att in the form the plugin stores."""
+    if att == 'rfidkey':
+        return (sorted(set(canonical_key(v) for v in old)),
+                sorted(set(canonical_key(v) for v in new)))
+    if att == 'rfiddooraccess':
+        return _access(old), _access(new, old)
+    return old, new
+
+
+class IpaState(object):
+    """Existing IPA users and members of the protected groups.
+
+    Fetched with one user_find and one group_show per protected group,
+    so the sync can diff locally instead of calling user_show per user.
+    Users and protected members are keyed by lower-cased uid, as IPA
+    stores them.
+    """
+
+    def __init__(self, users, protected):
+        self.users = users
+        self.protected = protected
+
+    @classmethod
+    def fetch(cls, ipa, uid=None):
+        from ipalib import errors
+        kw = dict(all=True, sizelimit=0, timelimit=0)
+        if uid is not None:
+            kw['uid'] = uid
+        users = {}
+        for entry in ipa('user_find', **kw)['result']:
+            users[entry['uid'][0].lower()] = dict(
+                (att.lower(), _values(vals)) for att, vals in entry.items())
+        protected = {}
+        for group in PROTECTED_GROUPS:
+            try:
+                result = ipa('group_show', group)['result']
+            except errors.NotFound:
+                continue
+            for member in result.get('member_user', ()):
+                protected.setdefault(member.lower(), group)
+        return cls(users, protected)
+
+    def delta(self, uid, kw):
+        """Return {attribute: (old, new)} for what user_mod(uid, **kw) changes.
+
+        rfidKey and rfidDoorAccess are compared in canonical form, so
+        spelling differences the plugin would not write are no change.
+        """
+        current = self.users[uid.lower()]
+        delta = {}
+        for att, value in kw.items():
+            old = current.get(att.lower(), [])
+            new = _values(value)
+            if new == old:
+                continue
+            iold, inew = _canonical(att.lower(), old, new)
+            if inew != iold:
+                delta[att] = (old, new)
+        return delta
+
+    def exists(self, uid):
+        return uid.lower() in self.users
+
+    def protected_by(self, uid):
+        """Return the protected group of uid, None if there is none."""
+        return self.protected.get(uid.lower())
+
+    def changed(self, uid, kw):
+        """Does user_mod(uid, **kw) change anything?"""
+        return bool(self.delta(uid, kw))
+
+
+def userKw(user):
+    """Map a source user to the IPA user_add/user_mod options."""
+    uid = user.uid
+    kw = {}
+    user.update(kw, 'mail')
+    user.update(kw, 'mobile')
+    user.setone(kw, 'loginShell')
+    user.setone(kw, 'homeDirectory')
+    user.update(kw, 'rfidKey')
+    user.update(kw, 'rfidDoorAccess')
+
+    user.update(kw, 'mail', 'edupersontargetedid', fmt='mail:{mail[0]}')
+    user.update(kw, 'registeredAddress', 'edupersontargetedid', fmt='mail:{registeredAddress[0]}')
+    user.setone(kw, 'street')
+    user.setone(kw, 'l')
+    user.setone(kw, 'postalCode')
+    user.setone(kw, 'telephoneNumber')
+
+    user.setone(kw, 'givenName', default=uid)
+    user.setone(kw, 'sn')
+    return kw
+
+
+def syncUser(ipa, user, state):
+    from ipalib import errors
+    uid = user.uid
+    group = state.protected_by(uid)
+    if group is not None:
+        return SyncResult('SKIP', uid, 'Skipping {0} user {1}'.format(group, uid))
+    kw = userKw(user)
+
+    kwovr = {}
+    userovr = idoverrideUser(user)
+    #userovr.setone(kwovr, 'cn')
+    userovr.setone(kwovr, 'gecos')
+    userovr.setone(kwovr, 'loginShell')
+    userovr.setone(kwovr, 'homeDirectory')
+    userovr.setone(kwovr, 'uidNumber')
+    userovr.setone(kwovr, 'gidNumber')
+    kwovr['uidnumber'] = int(kwovr['uidnumber'])
+    kwovr['gidnumber'] = int(kwovr['gidnumber'])
+
+    #print(user)
+    #for k, v in kw.items():
+    #    print("{0}: {1}".format(k, v))
+    #continue
+    try:
+        if state.exists(uid):
+            kwmod = dict(kw, uidnumber=user.uidNumber, gidnumber=user.gidNumber)
+            if not state.changed(uid, kwmod):
+                return SyncResult(UNCHANGED, uid, None)
+            try:
+                result = ipa('user_mod', uid, **kwmod)
+                #result1 = ipa('idoverrideuser_mod', uid, **kwovr)
+                return SyncResult('MOD', uid, None)
+            except errors.EmptyModlist as e:
+                return SyncResult(UNCHANGED, uid, None)
+        else:
+            result = ipa('user_add', uid,
+                #uidnumber=user.uidNumber, gidnumber=user.gidNumber,
+                #uidnumber=None, gidnumber=None,
+                gidnumber=10000,
+                **kw)
+            #kwovr['ipaanchoruuid'] = result['result']['ipauniqueid'][0]
+            #result1 = ipa('idoverrideuser_add', 'xsos', result['result']['uid'][0], **kwovr)
+            #result1 = ipa('idoverrideuser_add', 'xsos', result['result']['ipauniqueid'][0], **kwovr)
+            return SyncResult('ADD', uid, repr(result))
+    except Exception as e:
+        details = ['-----------', traceback.format_exc(), repr(user), '']
+        try:
+            result2 = ipa('user_show', uid)
+            details.append(repr(result2['result']))
+        except Exception as e2:
+            details.append(repr(e2))
+        details.append('')
+        return SyncResult('EEE', uid, '\n'.join(details))
+
+
+class SyncEngine(object):
+    """Syncs users on a bounded pool of worker threads.
+
+    Results are yielded in the order of the input.  At most
+    workers * QUEUE_FACTOR users are in flight, so a streaming source
+    is not read ahead further than that.
+    """
+
+    QUEUE_FACTOR = 4
+
+    def __init__(self, sync, workers=4):
+        self.sync = sync
+        self.workers = workers
+
+    def _sync(self, user):
         try:
-            result0 = api.Command.user_show(uid, all=True)
-            memberof_group = result0['result'].get('memberof_group', ())
-            for g_protected in ('admins', 'trust_admins', 'editors'):
-                if g_protected in memberof_group:
-                    print('Skipping {0} user {1}'.format(g_protected, uid))
-                    uid = None
-        except ipalib.errors.NotFound:
-            pass
-        if uid is None:
+            return self.sync(user)
+        except Exception:
+            return SyncResult('EEE', getattr(user, 'dn', None), traceback.format_exc())
+
+    def run(self, users):
+        from concurrent.futures import ThreadPoolExecutor
+        pending = collections.deque()
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for user in users:
+                pending.append(pool.submit(self._sync, user))
+                if len(pending) >= self.workers * self.QUEUE_FACTOR:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+
+# Offline change plans: diff a source LDIF against an LDIF export of
+# the IPA users without connecting to either server, write the result
+# as JSON lines and replay it later with --replay.
+#
+#   {"op": "add", "uid": ..., "kw": {...}}
+#   {"op": "mod", "uid": ..., "kw": {...}, "delta": {att: [old, new]}}
+#   {"op": "skip", "uid": ..., "reason": ...}
+#   {"op": "error", "uid": ..., "reason": ...}
+#
+# Unchanged users are counted but not written.
+
+CHUNK_SIZE = 1000
+
+
+def ldifRecords(fh):
+    """Yield the raw lines of each record of an LDIF stream."""
+    record = []
+    for line in fh:
+        line = line.rstrip('\r\n')
+        if line:
+            record.append(line)
+        elif record:
+            yield record
+            record = []
+    if record:
+        yield record
+
+
+def parseLdif(lines):
+    """Parse the lines of one LDIF record into (dn, {attribute: [values]}).
+
+    Returns (None, None) for the version line and for records without dn.
+    """
+    unfolded = []
+    for line in lines:
+        if line.startswith(' ') and unfolded:
+            unfolded[-1] += line[1:]
+        elif not line.startswith('#'):
+            unfolded.append(line)
+    dn, attrs = None, collections.OrderedDict()
+    for line in unfolded:
+        att, _, value = line.partition(':')
+        if value.startswith(':'):
+            value = base64.b64decode(value[1:].strip()).decode('utf-8', 'replace')
+        elif value.startswith('<'):
+            continue
+        else:
+            value = value.lstrip(' ')
+        if att.lower() == 'dn':
+            dn = value
+        elif dn is not None:
+            attrs.setdefault(att, []).append(value)
+    if dn is None:
+        return None, None
+    return dn, attrs
+
+
+def chunks(iterable, size=CHUNK_SIZE):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _protectedGroup(memberof):
+    for dn in memberof:
+        rdn = dn.split(',', 1)[0]
+        att, _, group = rdn.partition('=')
+        if att.strip().lower() == 'cn' and group.strip() in PROTECTED_GROUPS:
+            return group.strip()
+    return None
+
+
+def _ipaChunk(records):
+    users = []
+    for lines in records:
+        dn, attrs = parseLdif(lines)
+        if dn is None or 'uid' not in set(a.lower() for a in attrs):
+            continue
+        entry = dict((att.lower(), _values([_decode(v) for v in vals]))
+                     for att, vals in attrs.items())
+        users.append((entry['uid'][0].lower(), entry,
+                      _protectedGroup(entry.get('memberof', ()))))
+    return users
+
+
+def planUser(user, state):
+    """Compare a source user with the IPA state, return a plan entry."""
+    uid = user.uid
+    group = state.protected_by(uid)
+    if group is not None:
+        return {'op': 'skip', 'uid': uid, 'reason': '{0} user'.format(group)}
+    kw = userKw(user)
+    if not state.exists(uid):
+        return {'op': 'add', 'uid': uid, 'kw': kw}
+    kwmod = dict(kw, uidnumber=user.uidNumber, gidnumber=user.gidNumber)
+    delta = state.delta(uid, kwmod)
+    if not delta:
+        return None
+    return {'op': 'mod', 'uid': uid,
+            'kw': dict((att, kwmod[att]) for att in delta),
+            'delta': delta}
+
+
+_planState = None
+
+
+def _initPlan(state):
+    global _planState
+    _planState = state
+
+
+def _planChunk(records):
+    plan = []
+    for lines in records:
+        dn, attrs = parseLdif(lines)
+        if dn is None:
             continue
-        kw = {}
-        user.update(kw, 'mail')
-        user.update(kw, 'mobile')
-        user.setone(kw, 'loginShell')
-        user.setone(kw, 'homeDirectory')
-        user.update(kw, 'rfidKey')
-        user.update(kw, 'rfidDoorAccess')
-
-        user.update(kw, 'mail', 'edupersontargetedid', fmt='mail:{mail[0]}')
-        user.update(kw, 'registeredAddress', 'edupersontargetedid', fmt='mail:{registeredAddress[0]}')
-        user.setone(kw, 'street')
-        user.setone(kw, 'l')
-        user.setone(kw, 'postalCode')
-        user.setone(kw, 'telephoneNumber')
-
-        user.setone(kw, 'givenName', default=uid)
-        user.setone(kw, 'sn')
-
-        kwovr = {}
-        userovr = idoverrideusers[user.uid]
-        #userovr.setone(kwovr, 'cn')
-        userovr.setone(kwovr, 'gecos')
-        userovr.setone(kwovr, 'loginShell')
-        userovr.setone(kwovr, 'homeDirectory')
-        userovr.setone(kwovr, 'uidNumber')
-        userovr.setone(kwovr, 'gidNumber')
-        kwovr['uidnumber'] = int(kwovr['uidnumber'])
-        kwovr['gidnumber'] = int(kwovr['gidnumber'])
-
-        #print(user)
-        #for k, v in kw.items():
-        #    print("{0}: {1}".format(k, v))
-        #continue
         try:
-            try:
-                result = api.Command.user_mod(uid,
-                    uidnumber=user.uidNumber, gidnumber=user.gidNumber,
-                    **kw)
-                #result1 = api.Command.idoverrideuser_mod(uid, **kwovr)
-                print('MOD', uid)
-            except ipalib.errors.EmptyModlist as e:
-                print('   ', uid)
-                continue
-            except ipalib.errors.NotFound as e:
-                result = api.Command.user_add(uid,
-                    #uidnumber=user.uidNumber, gidnumber=user.gidNumber,
-                    #uidnumber=None, gidnumber=None,
-                    gidnumber=10000,
-                    **kw)
-                print(result)
-                #kwovr['ipaanchoruuid'] = result['result']['ipauniqueid'][0]
-                #result1 = api.Command.idoverrideuser_add('xsos', result['result']['uid'][0], **kwovr)
-                #result1 = api.Command.idoverrideuser_add('xsos', result['result']['ipauniqueid'][0], **kwovr)
-                print('ADD', uid)
+            user = LdapObject(dn, attrs)
+            change = planUser(user, _planState)
         except Exception as e:
-            print('-----------')
-            traceback.print_exc()
-            print()
-            print(repr(user))
-            print()
-            result2 = api.Command.user_show(uid)
-            print(repr(result2['result']))
-            print()
-            print('EEE', uid)
-        #break
+            change = {'op': 'error', 'uid': dn, 'reason': repr(e)}
+        plan.append(change or {'op': None})
+    return plan
+
+
+class PlanBuilder(object):
+    """Computes a change plan from two LDIF files on a process pool.
+
+    The IPA export is parsed in chunks into an IpaState (users hashed by
+    uid), which is handed once to each worker; the source is then parsed
+    and compared chunk by chunk.  Both files are streamed, only the IPA
+    side is held in memory.
+    """
+
+    def __init__(self, processes=None, chunk_size=CHUNK_SIZE):
+        self.processes = processes
+        self.chunk_size = chunk_size
+
+    def state(self, pool, ipa_ldif):
+        users, protected = {}, {}
+        with io.open(ipa_ldif, encoding='utf-8') as fh:
+            for chunk in pool.imap(_ipaChunk, chunks(ldifRecords(fh), self.chunk_size)):
+                for uid, entry, group in chunk:
+                    users[uid] = entry
+                    if group is not None:
+                        protected[uid] = group
+        return IpaState(users, protected)
+
+    def run(self, source_ldif, ipa_ldif):
+        """Yield plan entries (None for unchanged users) in source order."""
+        pool = multiprocessing.Pool(self.processes)
+        try:
+            state = self.state(pool, ipa_ldif)
+        finally:
+            pool.close()
+            pool.join()
+        pool = multiprocessing.Pool(self.processes, _initPlan, (state,))
+        try:
+            with io.open(source_ldif, encoding='utf-8') as fh:
+                records = chunks(ldifRecords(fh), self.chunk_size)
+                for plan in pool.imap(_planChunk, records):
+                    for change in plan:
+                        yield change if change['op'] else None
+        finally:
+            pool.close()
+            pool.join()
+
+
+def writePlan(changes, out):
+    counts = collections.Counter()
+    for change in changes:
+        if change is None:
+            counts[UNCHANGED] += 1
+            continue
+        counts[change['op']] += 1
+        out.write(json.dumps(change, sort_keys=True))
+        out.write('\n')
+    return counts
+
+
+def readPlan(fh):
+    for line in fh:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+
+def replayChange(ipa, change):
+    from ipalib import errors
+    uid = change['uid']
+    op = change['op']
+    if op == 'skip':
+        return SyncResult('SKIP', uid, 'Skipping {0} ({1})'.format(uid, change['reason']))
+    if op == 'error':
+        return SyncResult('EEE', uid, change['reason'])
+    kw = dict((str(att), value) for att, value in change['kw'].items())
+    try:
+        if op == 'mod':
+            try:
+                ipa('user_mod', uid, **kw)
+            except errors.EmptyModlist:
+                return SyncResult(UNCHANGED, uid, None)
+            return SyncResult('MOD', uid, None)
+        result = ipa('user_add', uid, gidnumber=10000, **kw)
+        return SyncResult('ADD', uid, repr(result))
+    except Exception:
+        return SyncResult('EEE', uid, traceback.format_exc())
+
+
+def report(results):
+    """Print the sync results as they come and a summary."""
+    counts = collections.Counter()
+    started = time.time()
+    for result in results:
+        counts[result.status] += 1
+        if result.status in ('EEE', 'ADD') and result.details:
+            print(result.details)
+        if result.status == 'SKIP':
+            print(result.details)
+        else:
+            print(result.status, result.uid)
+    elapsed = time.time() - started
+    total = sum(counts.values())
+    print(' {0:d} Done in {1:.1f}s ({2:.1f} users/s): {3:d} MOD, {4:d} ADD, '
+          '{5:d} unchanged, {6:d} skipped, {7:d} errors'.format(
+              total, elapsed, total / elapsed if elapsed else 0.0,
+              counts['MOD'], counts['ADD'], counts[UNCHANGED],
+              counts['SKIP'], counts['EEE']))
+    return counts
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Sync users from LDAP to FreeIPA')
+    parser.add_argument('server', nargs='?', help='source LDAP server')
+    parser.add_argument('base', nargs='?', help='source search base')
+    parser.add_argument('uid', nargs='?', help='only sync this user')
+    parser.add_argument('-w', '--workers', type=int, default=4,
+        help='concurrent IPA connections (default: %(default)s)')
+    parser.add_argument('-r', '--rate', type=float, default=None,
+        help='maximum IPA calls per second (default: unlimited)')
+    parser.add_argument('--plan', nargs=2, metavar=('SOURCE_LDIF', 'IPA_LDIF'),
+        help='write a change plan instead of syncing, without connecting')
+    parser.add_argument('-o', '--output', default='-',
+        help='change plan file (default: stdout)')
+    parser.add_argument('-p', '--processes', type=int, default=None,
+        help='processes comparing the LDIF files (default: CPU count)')
+    parser.add_argument('--replay', metavar='PLAN',
+        help='apply a change plan written by --plan')
+    args = parser.parse_args(argv)
+
+    if args.plan:
+        started = time.time()
+        changes = PlanBuilder(args.processes).run(*args.plan)
+        if args.output == '-':
+            counts = writePlan(changes, sys.stdout)
+        else:
+            with codecs.open(args.output, 'w', 'utf-8') as out:
+                counts = writePlan(changes, out)
+        sys.stderr.write(' Planned in {0:.1f}s: {1:d} mod, {2:d} add, {3:d} unchanged, '
+                         '{4:d} skipped, {5:d} errors\n'.format(
+                             time.time() - started, counts['mod'], counts['add'],
+                             counts[UNCHANGED], counts['skip'], counts['error']))
+        return
+    if not args.replay and not (args.server and args.base):
+        parser.error('server and base are required unless --plan or --replay is given')
+
+    print('Authenticating to FreeIPA...')
+    from ipalib import api
+    api.bootstrap(context='example', in_server=True)
+    api.finalize()
+    ipa = IpaClient(RateLimiter(args.rate))
+    ipa.connect()
+    print(' Done')
+
+    if args.replay:
+        engine = SyncEngine(lambda change: replayChange(ipa, change), workers=args.workers)
+        with codecs.open(args.replay, 'r', 'utf-8') as fh:
+            report(engine.run(readPlan(fh)))
+    else:
+        ## sys.setrecursionlimit(20)
+        print('Reading FreeIPA...')
+        state = IpaState.fetch(ipa, args.uid)
+        print(' {0:d} users, {1:d} protected'.format(len(state.users), len(state.protected)))
+
+        print('Reading LDAP...')
+
+        engine = SyncEngine(lambda user: syncUser(ipa, user, state), workers=args.workers)
+        report(engine.run(ldapUsers(args.server, args.base, args.uid)))
 
 
 if __name__ == '__main__':
     main()
-
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Longest-suffix matching of host names against DNS zones.
+
+    trie = ZoneTrie({'inf.example.org': 'zone1.', 'example.org': 'zone2.'},
+                    fallback=('example.net', 'zone3.'))
+    trie.match('pc1.lab.inf.example.org')  ->  ('pc1.lab', 'zone1.')
+
+Labels are stored reversed in nested dicts, so a lookup costs one dict
+access per label of the host name, however many zones there are.  The
+fallback zone is only used when no other zone matches.  A name equal
+to a zone suffix does not match (there is no host part).
+"""
+
+from __future__ import unicode_literals
+
+
+_TARGET = None  # key of the (suffix, target) entry in a trie node
+
+
+def _labels(name):
+    return name.strip('.').lower().split('.')
+
+
+class ZoneTrie(object):
+
+    def __init__(self, zones=(), fallback=None):
+        self._zones = {}
+        self._fallback = {}
+        if hasattr(zones, 'items'):
+            zones = zones.items()
+        for suffix, target in zones:
+            self.add(suffix, target)
+        if fallback is not None:
+            self._insert(self._fallback, *fallback)
+
+    def __len__(self):
+        return self._count(self._zones)
+
+    def _count(self, node):
+        return sum(self._count(child) if label is not _TARGET else 1
+                   for label, child in node.items())
+
+    @staticmethod
+    def _insert(root, suffix, target):
+        node = root
+        for label in reversed(_labels(suffix)):
+            node = node.setdefault(label, {})
+        node[_TARGET] = target
+
+    @staticmethod
+    def _lookup(root, labels):
+        node = root
+        found = None
+        for depth in range(len(labels) - 1, 0, -1):
+            node = node.get(labels[depth])
+            if node is None:
+                break
+            if _TARGET in node:
+                found = depth, node[_TARGET]
+        return found
+
+    def add(self, suffix, target):
+        self._insert(self._zones, suffix, target)
+
+    def match(self, fqdn):
+        """Return (host part, target) of the longest matching zone, or None."""
+        fqdn = fqdn.strip('.')
+        labels = _labels(fqdn)
+        found = self._lookup(self._zones, labels) or \
+            self._lookup(self._fallback, labels)
+        if found is None:
+            return None
+        depth, target = found
+        return '.'.join(fqdn.split('.')[:depth]), target
+
+
+def load(path, target=lambda zone: zone):
+    """Read a subnet-map.cf: "suffix zone" per line, the first is the fallback.
+
+    target converts the zone names, e.g. to DNSName.
+    """
+    import codecs
+    with codecs.open(path, 'r', 'utf-8') as cf:
+        lines = [line.split(None, 1) for line in cf if line.strip()]
+    fallback = lines[0][0], target(lines[0][1].strip().rstrip('.') + '.')
+    return ZoneTrie(((s, target(z.strip().rstrip('.') + '.')) for s, z in lines[1:]),
+                    fallback=fallback)